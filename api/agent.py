@@ -1,10 +1,13 @@
 import os
 import sys
-from langchain_openai import ChatOpenAI
 from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import SystemMessage
 from langchain_core.tools import tool
+from .model_router import model_router
+from .log import get_logger
+
+log = get_logger(__name__)
 
 # NOTE: functions are dynamically imported - will trigger linter
 
@@ -16,28 +19,27 @@ if gmail_backend_path not in sys.path:
 # Import Gmail functions directly
 try:
     import gmail_interact # type: ignore
-    print("Gmail interact imported successfully in agent.py")
+    log.debug("gmail_interact imported in agent.py")
 except ImportError as e:
-    print(f"couldn't import gmail_interact in agent.py: {e}")
+    log.warning("couldn't import gmail_interact in agent.py: %s", e)
     gmail_interact = None
 
 class GmailAgent:
-    def __init__(self, gmail_service):
+    def __init__(self, gmail_service, router=None):
         # initialize the Gmail AI agent with a user's Gmail service
         self.gmail_service = gmail_service
         
         if not gmail_interact:
             raise ValueError("Gmail interact module not available")
         
-        # Initialize OpenAI model
+        # OpenAI key is only needed when the shared router builds real models
         api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        if not api_key and router is None:
             raise ValueError("OPENAI_API_KEY environment variable is required")
         
-        self.llm = ChatOpenAI(
-            model="gpt-4",
-            temperature=0.1
-        )
+        # model tier is picked per message, executors are built per tier on first use
+        self.router = router or model_router
+        self._executors = {}
         
         # create tools that use the gmail_service directly
         self.tools = self._create_tools()
@@ -68,22 +70,23 @@ class GmailAgent:
             ("user", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
-        
-        # Create agent
-        self.agent = create_openai_functions_agent(
-            llm=self.llm,
-            tools=self.tools,
-            prompt=self.prompt
-        )
-        
-        # Create agent executor
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=5
-        )
+    
+    def _get_executor(self, tier: str):
+        """Create (once per tier) the agent executor backed by that tier's model"""
+        if tier not in self._executors:
+            agent = create_openai_functions_agent(
+                llm=self.router.get_llm(tier),
+                tools=self.tools,
+                prompt=self.prompt
+            )
+            
+            self._executors[tier] = AgentExecutor(
+                agent=agent,
+                tools=self.tools,
+                handle_parsing_errors=True,
+                max_iterations=5
+            )
+        return self._executors[tier]
     
     def _create_tools(self):
         """Create LangChain tools that use the gmail_service"""
@@ -196,16 +199,17 @@ Emails this month: {stats.get('emails_this_month', 'Unknown')}"""
             get_email_stats
         ]
     
-    def chat(self, message: str, chat_history=None) -> str:
+    def chat(self, message: str, chat_history=None, callbacks=None) -> str:
         """Process a user message and return AI response"""
         try:
             if chat_history is None:
                 chat_history = []
             
-            response = self.agent_executor.invoke({
+            executor = self._get_executor(self.router.choose_tier(message))
+            response = executor.invoke({
                 "input": message,
                 "chat_history": chat_history
-            })
+            }, config={"callbacks": callbacks})
             
             return response["output"]
             
@@ -0,0 +1,72 @@
+import os
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Set
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction
+from . import turns
+
+# shared pool for tool calls, bounded so one chat can't starve the others
+_tool_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_TOOL_WORKERS", "4")),
+    thread_name_prefix="agent-tool"
+)
+
+class ParallelAgentExecutor(AgentExecutor):
+    """agent executor that runs the tool calls of one step concurrently
+
+    the base executor yields every planned action of a step before performing
+    any of them. when the first one is performed the whole step is submitted to
+    the pool and each _perform_agent_action call waits on its own future, so
+    observations keep the order the model emitted the calls in.
+    """
+
+    # tools that must not overlap with other calls in the same step (mutations)
+    sequential_tools: Set[str] = set()
+
+    _steps: Dict[int, List[AgentAction]] = {}
+    _pending: Dict[int, Future] = {}
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        actions = []
+        try:
+            for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+                if isinstance(item, AgentAction):
+                    actions.append(item)
+                    self._steps[id(item)] = actions
+                yield item
+        finally:
+            for action in actions:
+                self._steps.pop(id(action), None)
+                self._pending.pop(id(action), None)
+
+    def _submit_step(self, actions, name_to_tool_map, color_mapping, run_manager):
+        """start every action of a step on the pool"""
+        for action in actions:
+            # copy context so callbacks and tracing follow the tool into the worker
+            ctx = contextvars.copy_context()
+            self._pending[id(action)] = _tool_pool.submit(
+                ctx.run,
+                self._timed_action,
+                name_to_tool_map,
+                color_mapping,
+                action,
+                run_manager
+            )
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        actions = self._steps.get(id(agent_action), [])
+        parallel = len(actions) > 1 and not any(a.tool in self.sequential_tools for a in actions)
+
+        if parallel and id(agent_action) not in self._pending:
+            self._submit_step(actions, name_to_tool_map, color_mapping, run_manager)
+
+        future = self._pending.pop(id(agent_action), None)
+        if future is not None:
+            return future.result()
+        return self._timed_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+    def _timed_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        """perform one action, timed into the chat turn along with the gmail calls it makes"""
+        with turns.tool_call(agent_action.tool):
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
@@ -1,36 +1,65 @@
 import os
+import functools
+from contextvars import ContextVar
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import tool
-from langchain.agents import create_tool_calling_agent, AgentExecutor
+from langchain.agents import create_tool_calling_agent
 from langchain_core.messages import HumanMessage, SystemMessage
 from .gmail_service import GmailService
+from .agent_executor import ParallelAgentExecutor
+from .response_cache import response_cache, normalize_input
+from .model_router import model_router
+from . import tracing, turns
 
 load_dotenv()
 
-# global gmail service reference for tools
-_gmail_service = None
+# gmail service of the chat turn running in this context, tools read it from here.
+# worker threads of the executor get a copy of the context
+_gmail_service: ContextVar[Optional[GmailService]] = ContextVar("gmail_service", default=None)
 
-def init_gmail_service(service):
-    global _gmail_service
-    _gmail_service = service
+# mailbox history id at the start of the current chat turn
+_history_id: ContextVar[Optional[str]] = ContextVar("history_id", default=None)
+
+def _cached_read(func):
+    """reuse a read-only tool result while the mailbox version is unchanged"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        gmail_service, history_id = _gmail_service.get(), _history_id.get()
+        if not gmail_service or not history_id:
+            return func(*args, **kwargs)
+        
+        user = gmail_service.user_key
+        key = f"tool:{func.__name__}:{args!r}:{sorted(kwargs.items())!r}"
+        cached = response_cache.get(user, history_id, key)
+        if cached is not None:
+            return cached
+        
+        generation = response_cache.generation(user)
+        result = func(*args, **kwargs)
+        if not result.startswith("error"):
+            response_cache.put(user, history_id, key, result, generation)
+        return result
+    return wrapper
 
 @tool
+@_cached_read
 def search_emails_tool(query: str, max_results: int = 5) -> str:
-    if not _gmail_service:
+    """search emails using gmail search syntax"""
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
         return "gmail service not initialized"
     
     try:
-        messages = _gmail_service.search_emails(query, max_results)
+        messages = gmail_service.search_emails(query, max_results)
         if not messages:
             return f"no emails found matching query: {query}"
         
         results = []
         for msg in messages[:max_results]:
-            details = _gmail_service.get_email_details(msg['id'])
+            details = gmail_service.get_email_details(msg['id'])
             if details:
                 results.append(f"id: {msg['id']}, subject: {details['subject']}, from: {details['sender']}, date: {details['date']}")
         
@@ -40,12 +69,38 @@ def search_emails_tool(query: str, max_results: int = 5) -> str:
         return f"error searching emails: {str(e)}"
 
 @tool
+@_cached_read
+def rank_emails_tool(text: str, query: str = "", top_k: int = 5) -> str:
+    """find the emails most relevant to a description, best match first.
+    text is free text like 'invoice for the hotel'; query optionally narrows the
+    candidates with gmail search syntax like 'after:2024/01/01' or 'from:billing'"""
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
+        return "gmail service not initialized"
+    
+    try:
+        messages = gmail_service.rank_emails(text, query, min(top_k, 20))
+        if not messages:
+            return f"no emails relevant to: {text}"
+        
+        return "\n".join(
+            f"id: {m['id']}, subject: {m['subject']}, from: {m['sender']}, date: {m['date']}, score: {m['score']}"
+            for m in messages
+        )
+        
+    except Exception as e:
+        return f"error ranking emails: {str(e)}"
+
+@tool
+@_cached_read
 def get_email_details_tool(message_id: str) -> str:
-    if not _gmail_service:
+    """get subject, sender, date and body of an email by id"""
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
         return "gmail service not initialized"
     
     try:
-        details = _gmail_service.get_email_details(message_id)
+        details = gmail_service.get_email_details(message_id)
         if not details:
             return f"email not found: {message_id}"
         
@@ -55,13 +110,15 @@ def get_email_details_tool(message_id: str) -> str:
         return f"error getting email details: {str(e)}"
 
 @tool
+@_cached_read
 def list_labels_tool() -> str:
     """list available gmail labels/folders"""
-    if not _gmail_service:
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
         return "gmail service not initialized"
     
     try:
-        labels = _gmail_service.list_labels()
+        labels = gmail_service.list_labels()
         label_names = [label['name'] for label in labels]
         return f"available labels: {', '.join(label_names)}"
         
@@ -70,11 +127,13 @@ def list_labels_tool() -> str:
 
 @tool
 def trash_email_tool(message_id: str) -> str:
-    if not _gmail_service:
+    """move a single email to trash by id"""
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
         return "gmail service not initialized"
     
     try:
-        success = _gmail_service.trash_email(message_id)
+        success = gmail_service.trash_email(message_id)
         if success:
             return f"email {message_id} moved to trash"
         else:
@@ -84,12 +143,15 @@ def trash_email_tool(message_id: str) -> str:
         return f"error trashing email: {str(e)}"
 
 @tool
+@_cached_read
 def get_email_stats_tool() -> str:
-    if not _gmail_service:
+    """get email counts for today, this week, this month, unread and attachments"""
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
         return "gmail service not initialized"
     
     try:
-        stats = _gmail_service.get_email_stats_summary()
+        stats = gmail_service.get_email_stats_summary()
         return f"""Email Statistics:
 Total emails: {stats['total']}
 Unread emails: {stats['unread']}
@@ -101,36 +163,159 @@ With attachments: {stats['with_attachments']}"""
     except Exception as e:
         return f"error getting email stats: {str(e)}"
 
+# bulk tools act on at most this many matches per call, newest first
+BULK_MAX_MESSAGES = 10000
+BULK_SAMPLE_SIZE = 5
+
+def _run_bulk_action(query: str, confirm: bool, description: str, apply) -> str:
+    """resolve a query to message ids, then dry-run or apply a bulk action
+
+    apply(service, ids, errors) fills errors with the ids it failed on
+    """
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
+        return "gmail service not initialized"
+    
+    if not query.strip():
+        return "a search query is required for bulk actions"
+    
+    try:
+        # one past the cap tells whether matches are left over
+        messages = gmail_service.search_emails(query, BULK_MAX_MESSAGES + 1)
+        if not messages:
+            return f"no emails found matching query: {query}"
+        
+        message_ids = [msg['id'] for msg in messages[:BULK_MAX_MESSAGES]]
+        more = len(messages) > BULK_MAX_MESSAGES
+        remaining = (
+            f"\nmore than {BULK_MAX_MESSAGES} emails match, only the newest {BULK_MAX_MESSAGES} are included. "
+            "narrow the query to reach the rest"
+        ) if more else ""
+        
+        if not confirm:
+            sample = gmail_service.get_emails_metadata(message_ids[:BULK_SAMPLE_SIZE])
+            lines = [f"id: {m['id']}, subject: {m['subject']}, from: {m['sender']}, date: {m['date']}" for m in sample]
+            return (
+                f"dry run: {len(message_ids)} emails matching '{query}' would be {description}.\n"
+                f"sample:\n" + "\n".join(lines) + remaining +
+                "\ncall again with confirm=true to apply"
+            )
+        
+        errors = {}
+        apply(gmail_service, message_ids, errors)
+        done = len(message_ids) - len(errors)
+        if not done:
+            reason = next(iter(errors.values()), {}).get('message', 'unknown error')
+            return f"failed to apply bulk action to emails matching '{query}': {reason}"
+        
+        result = f"{done} emails matching '{query}' {description}"
+        if errors:
+            reason = next(iter(errors.values())).get('message', 'unknown error')
+            result += f"\n{len(errors)} emails failed, first error: {reason}"
+        return result + remaining
+            
+    except Exception as e:
+        return f"error running bulk action: {str(e)}"
+
+@tool
+def bulk_trash_tool(query: str, confirm: bool = False) -> str:
+    """move every email matching a gmail search query to trash.
+    call with confirm=false first for a dry-run count and sample, then confirm=true to apply"""
+    return _run_bulk_action(
+        query, confirm, "moved to trash",
+        lambda service, ids, errors: service.batch_trash_emails(ids, errors=errors)
+    )
+
+@tool
+def bulk_archive_tool(query: str, confirm: bool = False) -> str:
+    """archive (remove from inbox) every email matching a gmail search query.
+    call with confirm=false first for a dry-run count and sample, then confirm=true to apply"""
+    return _run_bulk_action(
+        query, confirm, "archived",
+        lambda service, ids, errors: service.batch_modify_emails(ids, remove_labels=['INBOX'], errors=errors)
+    )
+
+@tool
+def bulk_mark_read_tool(query: str, confirm: bool = False) -> str:
+    """mark every email matching a gmail search query as read.
+    call with confirm=false first for a dry-run count and sample, then confirm=true to apply"""
+    return _run_bulk_action(
+        query, confirm, "marked as read",
+        lambda service, ids, errors: service.batch_modify_emails(ids, remove_labels=['UNREAD'], errors=errors)
+    )
+
+@tool
+def bulk_label_tool(query: str, label: str, confirm: bool = False) -> str:
+    """add an existing label (by name) to every email matching a gmail search query.
+    call with confirm=false first for a dry-run count and sample, then confirm=true to apply"""
+    gmail_service = _gmail_service.get()
+    if not gmail_service:
+        return "gmail service not initialized"
+    
+    label_id = gmail_service.map_label_name_to_id(label)
+    if not label_id:
+        return f"label not found: {label}"
+    
+    return _run_bulk_action(
+        query, confirm, f"labelled '{label}'",
+        lambda service, ids, errors: service.batch_modify_emails(ids, add_labels=[label_id], errors=errors)
+    )
+
+# tools that change the mailbox
+MUTATING_TOOLS = {
+    trash_email_tool.name,
+    bulk_trash_tool.name,
+    bulk_archive_tool.name,
+    bulk_mark_read_tool.name,
+    bulk_label_tool.name
+}
+
 class MailAgent:
-    def __init__(self, gmail_service):
-        # initialize gmail service for tools
-        init_gmail_service(gmail_service)
+    def __init__(self, gmail_service, router=None):
+        # tools get the service through _gmail_service while a turn runs
+        self.gmail_service = gmail_service
         
-        self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+        # model tier is picked per turn, executors are built per tier on first use
+        self.router = router or model_router
+        self._executors = {}
+        self.last_turn = None
         self.tools = [
             search_emails_tool,
+            rank_emails_tool,
             get_email_details_tool,
             list_labels_tool,
             trash_email_tool,
-            get_email_stats_tool
+            get_email_stats_tool,
+            bulk_trash_tool,
+            bulk_archive_tool,
+            bulk_mark_read_tool,
+            bulk_label_tool
         ]
-        self.agent_executor = self._create_agent()
     
-    def _create_agent(self):
+    def _get_executor(self, tier: str):
+        if tier not in self._executors:
+            self._executors[tier] = self._create_agent(self.router.get_llm(tier))
+        return self._executors[tier]
+    
+    def _create_agent(self, llm):
         """cangchain agent with gmail tools"""
         system_prompt = """you are a helpful gmail assistant. you can help users manage their emails using the available tools.
 
         key capabilities:
         - search for emails using gmail search syntax
+        - rank emails by relevance to a description
         - view email details
         - list available labels/folders  
         - move emails to trash (with user confirmation)
+        - trash, archive, label or mark as read every email matching a query in one call
 
         important guidelines:
         - always confirm before performing destructive actions like deleting emails
         - use gmail search syntax for queries (e.g., 'from:sender@email.com', 'subject:keyword', 'is:unread')
         - provide clear, helpful responses about what you found or did
-        - if a user asks to delete emails, first search and show what would be deleted, then ask for confirmation
+        - when the user describes an email rather than giving exact criteria, use rank_emails_tool with the description as text and any dates or senders as the query
+        - for actions on more than one email, use the bulk tools with a query instead of acting on ids one by one
+        - bulk tools default to a dry run; show the user the count and sample, and only call again with confirm=true once they agree
 
         gmail search syntax examples:
         - from:john@example.com (emails from specific sender)
@@ -148,22 +333,54 @@ class MailAgent:
         ])
         
         agent = create_tool_calling_agent(
-            llm=self.llm,
+            llm=llm,
             tools=self.tools,
             prompt=prompt_template
         )
         
-        return AgentExecutor(
+        # read-only calls from one step run concurrently, mutations run alone
+        return ParallelAgentExecutor(
             agent=agent, 
             tools=self.tools, 
-            verbose=True,
-            max_iterations=3
+            max_iterations=3,
+            sequential_tools=MUTATING_TOOLS
         )
     
-    def chat(self, user_input: str) -> str:
-        """process user input and return response"""
+    def chat(self, user_input: str, callbacks=None) -> str:
+        """process user input and return response, timed into self.last_turn"""
+        trace = tracing.current()
+        service_token = _gmail_service.set(self.gmail_service)
+        history_token = _history_id.set(None)
         try:
-            result = self.agent_executor.invoke({"input": user_input})
-            return result["output"]
+            with turns.chat_turn(self.gmail_service.user_key, trace.trace_id if trace else None) as turn:
+                self.last_turn = turn
+                return self._chat(user_input, turn, callbacks)
+        finally:
+            _history_id.reset(history_token)
+            _gmail_service.reset(service_token)
+
+    def _chat(self, user_input: str, turn, callbacks=None) -> str:
+        # answers are cached per mailbox version, a mutation during the turn skips the store
+        user = self.gmail_service.user_key
+        history_id = self.gmail_service.get_history_id()
+        _history_id.set(history_id)
+        key = f"answer:{normalize_input(user_input)}"
+        
+        if history_id:
+            cached = response_cache.get(user, history_id, key)
+            if cached is not None:
+                turn.cached = True
+                return cached
+        
+        generation = response_cache.generation(user)
+        try:
+            turn.tier = self.router.choose_tier(user_input)
+            executor = self._get_executor(turn.tier)
+            result = executor.invoke({"input": user_input}, config={"callbacks": callbacks})
         except Exception as e:
-            return f"sorry, i encountered an error: {str(e)}"
\ No newline at end of file
+            turn.error = True
+            return f"sorry, i encountered an error: {str(e)}"
+        
+        if history_id:
+            response_cache.put(user, history_id, key, result["output"], generation)
+        return result["output"]
\ No newline at end of file
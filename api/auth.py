@@ -1,10 +1,13 @@
 import os
 import jwt
+import functools
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from fastapi import HTTPException
+from .log import get_logger, fields
+from . import discovery
+
+log = get_logger(__name__)
 
 class AuthService:
     def __init__(self):
@@ -28,25 +31,29 @@ class AuthService:
             'https://mail.google.com/'
         ]
         
-        # debug print to see what's loaded
-        print(f"looking for .env at: {env_path}")
-        print(f".env exists: {os.path.exists(env_path)}")
-        print(f"loaded environment variables:")
-        print(f"  client_id: {self.client_id}")
-        print(f"  client_secret exists: {bool(self.client_secret)}")
-        print(f"  jwt_secret exists: {bool(self.jwt_secret)}")
+        log.debug("loaded oauth configuration", extra=fields(
+            env_path=env_path,
+            env_exists=os.path.exists(env_path),
+            client_id=self.client_id,
+            client_secret_set=bool(self.client_secret),
+            jwt_secret_set=bool(self.jwt_secret)
+        ))
         
         self._sessions = {}
         
         if not self.client_id or not self.client_secret or not self.jwt_secret:
-            print("error: missing required environment variables")
-            print(f"  GOOGLE_CLIENT_ID: {'✓' if self.client_id else '✗'}")
-            print(f"  GOOGLE_CLIENT_SECRET: {'✓' if self.client_secret else '✗'}")
-            print(f"  JWT_SECRET_KEY: {'✓' if self.jwt_secret else '✗'}")
+            missing = [name for name, value in (
+                ("GOOGLE_CLIENT_ID", self.client_id),
+                ("GOOGLE_CLIENT_SECRET", self.client_secret),
+                ("JWT_SECRET_KEY", self.jwt_secret)
+            ) if not value]
+            log.error("missing required environment variables", extra=fields(missing=missing))
             raise Exception("missing oauth credentials in .env file")
     
     def create_oauth_flow(self):
         """create oauth flow for gmail api access"""
+        # only the login endpoints need oauthlib and requests, keep them off the import path
+        from google_auth_oauthlib.flow import Flow
         client_config = {
             "web": {
                 "client_id": self.client_id,
@@ -100,7 +107,7 @@ class AuthService:
     
     def get_user_info(self, credentials):
         """get user information from google"""
-        user_info_service = build('oauth2', 'v2', credentials=credentials)
+        user_info_service = discovery.client('oauth2', 'v2', credentials=credentials)
         user_info = user_info_service.userinfo().get().execute()
         return user_info
     
@@ -127,3 +134,14 @@ class AuthService:
             raise HTTPException(401, "token expired")
         except jwt.InvalidTokenError:
             raise HTTPException(401, "invalid token")
+
+
+@functools.lru_cache(maxsize=None)
+def get_auth_service() -> AuthService:
+    """the process wide AuthService, built on first use
+
+    routes share it instead of constructing one per request, which reloaded
+    .env every time and lost the sessions kept on the instance. a failed
+    construction is not cached, so fixing the environment takes effect
+    """
+    return AuthService()
@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable
+import httplib2
+from .log import get_logger
+
+log = get_logger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """raised instead of calling gmail while its circuit is open"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"gmail unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_outage(exception: Exception) -> bool:
+    """errors that say gmail is unhealthy rather than that the request was wrong"""
+    if isinstance(exception, UpstreamUnavailable):
+        return True
+    status = getattr(getattr(exception, 'resp', None), 'status', None)
+    if status is not None:
+        return int(status) >= 500 or int(status) == 429
+    # timeouts and refused or reset connections
+    return isinstance(exception, (OSError, httplib2.HttpLib2Error))
+
+
+class CircuitBreaker:
+    """stops calling an upstream after failure_threshold outage errors in a row
+
+    an open circuit refuses calls for reset_seconds, then lets one trial call
+    through (half open). its success closes the circuit, its failure opens it
+    again. a trial that never reports back is replaced after another reset_seconds
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """seconds until a call would be let through, 0 when one would be now"""
+        if self.state == 'closed':
+            return 0.0
+        return max(self._changed_at + self.reset_seconds - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.retry_after() == 0:
+                self.state = 'half_open'
+                self._changed_at = time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.state = 'closed'
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                self.state = 'open'
+                self._changed_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opens': self.opens,
+            'rejected': self.rejected,
+            'retry_after': round(self.retry_after(), 1)
+        }
+
+
+class Breakers:
+    """one global gmail circuit plus one per user
+
+    the global one trips on a gmail wide incident, a user's own on problems
+    only their mailbox or token has. a call needs both to be closed
+    """
+
+    def __init__(self, failure_threshold: int = 20, user_failure_threshold: int = 5,
+                 reset_seconds: float = 30.0):
+        self.user_failure_threshold = user_failure_threshold
+        self.reset_seconds = reset_seconds
+        self.upstream = CircuitBreaker(failure_threshold, reset_seconds)
+        self._users: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def _user(self, user: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._users.get(user)
+            if breaker is None:
+                breaker = self._users[user] = CircuitBreaker(self.user_failure_threshold, self.reset_seconds)
+            return breaker
+
+    def check(self, user: str):
+        """raise UpstreamUnavailable unless a call may go out now"""
+        for breaker in (self._user(user), self.upstream):
+            if not breaker.allow():
+                raise UpstreamUnavailable(breaker.retry_after())
+
+    def record(self, user: str, ok: bool):
+        self._user(user).record(ok)
+        self.upstream.record(ok)
+
+    def degraded(self, user: str) -> bool:
+        """whether either circuit is open or probing, reads should prefer cached data"""
+        return self.upstream.state != 'closed' or self._user(user).state != 'closed'
+
+    def retry_after(self, user: str) -> float:
+        return max(self.upstream.retry_after(), self._user(user).retry_after())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            users = list(self._users.values())
+        return dict(
+            self.upstream.stats(),
+            users_open=sum(1 for b in users if b.state != 'closed'),
+            user_opens=sum(b.opens for b in users)
+        )
+
+
+class Revalidator:
+    """background refreshes behind stale answers, at most one per key at a time"""
+
+    def __init__(self, max_workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="revalidate")
+        self._running = set()
+        self._lock = threading.Lock()
+        self.started = 0
+
+    def submit(self, key: Hashable, refresh: Callable[[], Any]) -> bool:
+        """start refresh unless one for the same key is still running"""
+        with self._lock:
+            if key in self._running:
+                return False
+            self._running.add(key)
+            self.started += 1
+        self._pool.submit(self._run, key, refresh)
+        return True
+
+    def _run(self, key: Hashable, refresh: Callable[[], Any]):
+        try:
+            refresh()
+        except Exception as e:
+            log.error("error revalidating %s: %s", key, e)
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'started': self.started, 'running': len(self._running)}
+
+
+breakers = Breakers(
+    failure_threshold=int(os.getenv("GMAIL_BREAKER_THRESHOLD", "20")),
+    user_failure_threshold=int(os.getenv("GMAIL_BREAKER_USER_THRESHOLD", "5")),
+    reset_seconds=float(os.getenv("GMAIL_BREAKER_RESET_SECONDS", "30"))
+)
+revalidator = Revalidator()
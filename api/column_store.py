@@ -0,0 +1,503 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# row flags
+DELETED = 1
+
+INITIAL_CAPACITY = 1024
+
+
+def _private_dir(path: str):
+    """directory only the server's user can read, mail metadata is private"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+
+
+def _private_open(path: str, flags: int) -> int:
+    fd = os.open(path, flags | os.O_CREAT, 0o600)
+    # files of an older version may have been created with the default mode
+    os.fchmod(fd, 0o600)
+    return fd
+
+
+def id_hash(message_id: str) -> int:
+    """stable 64 bit key of a message id, the row lookup searches these"""
+    return int.from_bytes(hashlib.blake2b(message_id.encode(), digest_size=8).digest(), "little")
+
+
+class Column:
+    """fixed width array memory-mapped from a file, grown by doubling"""
+
+    def __init__(self, path: str, dtype, width: int = 1):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.array = None
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._map(max(size // (self.dtype.itemsize * width), INITIAL_CAPACITY))
+
+    def _map(self, capacity: int):
+        nbytes = capacity * self.dtype.itemsize * self.width
+        fd = _private_open(self.path, os.O_RDWR)
+        try:
+            if os.fstat(fd).st_size < nbytes:
+                os.ftruncate(fd, nbytes)
+        finally:
+            os.close(fd)
+        shape = (capacity, self.width) if self.width > 1 else (capacity,)
+        self.array = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=shape)
+
+    @property
+    def capacity(self) -> int:
+        return self.array.shape[0]
+
+    def reserve(self, rows: int):
+        if rows > self.capacity:
+            capacity = self.capacity
+            while capacity < rows:
+                capacity *= 2
+            self.array.flush()
+            self._map(capacity)
+
+    def widen(self, width: int):
+        """rewrite with more columns per row, existing values keep their place"""
+        old = np.array(self.array)
+        self.array = None
+        os.remove(self.path)
+        self.width = width
+        self._map(old.shape[0])
+        self.array[:, :old.shape[1] if old.ndim > 1 else 1] = old.reshape(old.shape[0], -1)
+
+    def flush(self):
+        self.array.flush()
+
+
+class StringTable:
+    """append-only strings: utf-8 blob plus a memory-mapped end offset per string"""
+
+    def __init__(self, path: str, count: int = 0, interned: bool = False):
+        self.count = count
+        self.ends = Column(path + ".idx", np.uint64)
+        self._blob = os.fdopen(_private_open(path + ".dat", os.O_RDWR | os.O_APPEND), "a+b")
+        # small tables (senders) keep a reverse dict for interning
+        self.lookup: Optional[Dict[str, int]] = None
+        if interned:
+            self.lookup = {self.get(i): i for i in range(count)}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, value: str) -> int:
+        data = value.encode()
+        self._blob.seek(0, os.SEEK_END)
+        self._blob.write(data)
+        self.ends.reserve(self.count + 1)
+        self.ends.array[self.count] = self._blob.tell()
+        if self.lookup is not None:
+            self.lookup[value] = self.count
+        self.count += 1
+        return self.count - 1
+
+    def intern(self, value: str) -> int:
+        index = self.lookup.get(value)
+        return index if index is not None else self.append(value)
+
+    def get(self, index: int) -> str:
+        start = int(self.ends.array[index - 1]) if index else 0
+        self._blob.flush()
+        self._blob.seek(start)
+        return self._blob.read(int(self.ends.array[index]) - start).decode()
+
+    def get_many(self, indexes: Iterable[int]) -> List[str]:
+        return [self.get(int(i)) for i in indexes]
+
+    def flush(self):
+        self._blob.flush()
+        self.ends.flush()
+
+    def close(self):
+        self._blob.close()
+
+
+class MailboxColumns:
+    """one user's message metadata as columns
+
+    each message is a row: internal date, size estimate, interned sender id,
+    a label bitset (64 labels per word) and flags, about 40 bytes instead of
+    a dict per message. ids live in a string table and are found through a
+    sorted array of their 64 bit hashes, so filters and aggregates are numpy
+    operations over whole columns
+
+    history_id is the mailbox version the rows are current to. columns
+    left by an earlier process are only trusted once history since then
+    has been applied, and dropped when they carry no version to catch up from
+    """
+
+    def __init__(self, path: str):
+        _private_dir(path)
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        meta = {'count': 0, 'labels': [], 'senders': 0}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if not meta.get('history_id'):
+                shutil.rmtree(path)
+                _private_dir(path)
+                meta = {'count': 0, 'labels': [], 'senders': 0}
+
+        self.history_id: Optional[str] = meta.get('history_id')
+        # when history was last applied, 0 until this process has caught up
+        self.synced_at = 0.0
+        self.count = meta['count']
+        self.labels: Dict[str, int] = {label: bit for bit, label in enumerate(meta['labels'])}
+        self.ids = StringTable(os.path.join(path, "ids"), self.count)
+        self.senders = StringTable(os.path.join(path, "senders"), meta['senders'], interned=True)
+        self.internal_date = Column(os.path.join(path, "internal_date.i8"), np.int64)
+        self.size_estimate = Column(os.path.join(path, "size_estimate.i4"), np.int32)
+        self.sender = Column(os.path.join(path, "sender.u4"), np.uint32)
+        self.flags = Column(os.path.join(path, "flags.u1"), np.uint8)
+        self.hashes = Column(os.path.join(path, "id_hash.u8"), np.uint64)
+        self.label_bits = Column(os.path.join(path, "labels.u8"), np.uint64, max(1, -(-len(self.labels) // 64)))
+        self._order = None
+
+    @property
+    def columns(self) -> List[Column]:
+        return [self.internal_date, self.size_estimate, self.sender, self.flags, self.hashes, self.label_bits]
+
+    def _rows(self, message_ids: List[str]) -> np.ndarray:
+        """row of each id, -1 when unknown"""
+        if self._order is None:
+            self._order = np.argsort(self.hashes.array[:self.count], kind="stable")
+        keys = np.array([id_hash(i) for i in message_ids], dtype=np.uint64)
+        sorted_hashes = self.hashes.array[:self.count][self._order]
+        at = np.searchsorted(sorted_hashes, keys)
+        found = at < self.count
+        found[found] &= sorted_hashes[at[found]] == keys[found]
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        rows[found] = self._order[at[found]]
+        return rows
+
+    def _label_bit(self, label: str) -> int:
+        bit = self.labels.get(label)
+        if bit is None:
+            bit = self.labels[label] = len(self.labels)
+            if bit >= 64 * self.label_bits.width:
+                self.label_bits.widen(self.label_bits.width + 1)
+        return bit
+
+    def _label_words(self, labels: Iterable[str]) -> np.ndarray:
+        bits = [self._label_bit(label) for label in labels]
+        words = np.zeros(self.label_bits.width, dtype=np.uint64)
+        for bit in bits:
+            words[bit // 64] |= np.uint64(1 << (bit % 64))
+        return words
+
+    def _set_labels(self, row: int, labels: Iterable[str]):
+        words = self._label_words(labels)
+        self.label_bits.array[row] = words if self.label_bits.width > 1 else words[0]
+
+    def row_labels(self, row: int) -> List[str]:
+        words = np.atleast_1d(self.label_bits.array[row])
+        return [label for label, bit in self.labels.items() if int(words[bit // 64]) >> (bit % 64) & 1]
+
+    def upsert(self, records: List[Dict[str, Any]]):
+        records = list({r['id']: r for r in records}.values())
+        if not records:
+            return
+        rows = self._rows([r['id'] for r in records])
+        for column in self.columns:
+            column.reserve(self.count + int((rows < 0).sum()))
+
+        # most messages share a handful of senders and label sets
+        sender_ids: Dict[str, int] = {}
+        label_words: Dict[tuple, np.ndarray] = {}
+        for record, row in zip(records, rows):
+            if row < 0:
+                row = self.count
+                self.ids.append(record['id'])
+                self.hashes.array[row] = id_hash(record['id'])
+                self.count += 1
+                self._order = None
+            self.internal_date.array[row] = int(record.get('internal_date') or 0)
+            self.size_estimate.array[row] = int(record.get('size_estimate') or 0)
+            sender = record.get('sender', '')
+            if sender not in sender_ids:
+                sender_ids[sender] = self.senders.intern(parseaddr(sender)[1].lower())
+            self.sender.array[row] = sender_ids[sender]
+            self.flags.array[row] = 0
+            key = tuple(record.get('labels', []))
+            if key not in label_words:
+                label_words[key] = self._label_words(key)
+            words = label_words[key]
+            if len(words) < self.label_bits.width:
+                words = label_words[key] = self._label_words(key)
+            self.label_bits.array[row] = words if self.label_bits.width > 1 else words[0]
+
+    def remove(self, message_ids: List[str]):
+        rows = self._rows(message_ids)
+        self.flags.array[rows[rows >= 0]] |= DELETED
+
+    def update_labels(self, message_ids: List[str], add: List[str] = None, remove: List[str] = None):
+        rows = self._rows(message_ids)
+        rows = rows[rows >= 0]
+        # register every label first, a new one can widen the bitset
+        for label in list(add or []) + list(remove or []):
+            self._label_bit(label)
+        added, removed = self._label_words(add or []), self._label_words(remove or [])
+        bits = self.label_bits.array.reshape(self.label_bits.capacity, -1)
+        bits[rows] = (bits[rows] | added) & ~removed
+
+    def set_labels(self, message_id: str, labels: List[str]):
+        row = self._rows([message_id])[0]
+        if row >= 0:
+            self._set_labels(row, labels)
+
+    def mask(self, label: Optional[str] = None, exclude_labels: Iterable[str] = ('TRASH', 'SPAM'),
+             sender: Optional[str] = None, after_ms: Optional[int] = None, before_ms: Optional[int] = None,
+             min_size: Optional[int] = None, max_size: Optional[int] = None) -> np.ndarray:
+        """boolean row mask of live messages matching every given filter"""
+        n = self.count
+        mask = (self.flags.array[:n] & DELETED) == 0
+        bits = self.label_bits.array[:n].reshape(n, self.label_bits.width)
+
+        if label is not None:
+            bit = self.labels.get(label)
+            if bit is None:
+                return np.zeros(n, dtype=bool)
+            mask &= (bits[:, bit // 64] >> np.uint64(bit % 64)) & np.uint64(1) == 1
+        for excluded in exclude_labels or ():
+            bit = self.labels.get(excluded)
+            if bit is not None:
+                mask &= (bits[:, bit // 64] >> np.uint64(bit % 64)) & np.uint64(1) == 0
+        if sender is not None:
+            sender_id = self.senders.lookup.get(sender.lower())
+            if sender_id is None:
+                return np.zeros(n, dtype=bool)
+            mask &= self.sender.array[:n] == sender_id
+        if after_ms is not None:
+            mask &= self.internal_date.array[:n] >= after_ms
+        if before_ms is not None:
+            mask &= self.internal_date.array[:n] < before_ms
+        if min_size is not None:
+            mask &= self.size_estimate.array[:n] > min_size
+        if max_size is not None:
+            mask &= self.size_estimate.array[:n] < max_size
+        return mask
+
+    def select(self, limit: int = 100, **filters) -> List[str]:
+        """ids of matching messages, newest first"""
+        rows = np.flatnonzero(self.mask(**filters))
+        dates = self.internal_date.array[rows]
+        if limit and len(rows) > limit:
+            keep = np.argpartition(-dates, limit - 1)[:limit]
+            rows, dates = rows[keep], dates[keep]
+        return self.ids.get_many(rows[np.argsort(-dates, kind="stable")])
+
+    def summary(self, top: int = 10, **filters) -> Dict[str, Any]:
+        """counts, sizes, label totals and top senders of the matching messages"""
+        mask = self.mask(**filters)
+        n = self.count
+        bits = self.label_bits.array[:n].reshape(n, self.label_bits.width)[mask]
+        label_counts = {
+            label: int(np.count_nonzero((bits[:, bit // 64] >> np.uint64(bit % 64)) & np.uint64(1)))
+            for label, bit in self.labels.items()
+        }
+        sender_counts = np.bincount(self.sender.array[:n][mask], minlength=len(self.senders))
+        top_ids = np.argsort(-sender_counts, kind="stable")[:top]
+        dates = self.internal_date.array[:n][mask]
+
+        return {
+            'count': int(mask.sum()),
+            'total_size': int(self.size_estimate.array[:n][mask].sum(dtype=np.int64)),
+            'oldest_ms': int(dates.min()) if len(dates) else None,
+            'newest_ms': int(dates.max()) if len(dates) else None,
+            'labels': {label: count for label, count in label_counts.items() if count},
+            'top_senders': [
+                {'sender': self.senders.get(int(i)), 'count': int(sender_counts[i])}
+                for i in top_ids if sender_counts[i]
+            ]
+        }
+
+    def nbytes(self) -> int:
+        """bytes of the mapped columns and string tables on disk"""
+        total = sum(c.capacity * c.width * c.dtype.itemsize for c in self.columns)
+        for table in (self.ids, self.senders):
+            total += table.ends.capacity * 8 + (int(table.ends.array[table.count - 1]) if table.count else 0)
+        return total
+
+    def flush(self):
+        for column in self.columns:
+            column.flush()
+        self.ids.flush()
+        self.senders.flush()
+        meta = {
+            'count': self.count,
+            'labels': sorted(self.labels, key=self.labels.get),
+            'senders': len(self.senders),
+            'history_id': self.history_id
+        }
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with os.fdopen(_private_open(tmp, os.O_WRONLY | os.O_TRUNC), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.path, "meta.json.tmp"), os.path.join(self.path, "meta.json"))
+
+    def close(self):
+        self.flush()
+        self.ids.close()
+        self.senders.close()
+
+
+class ColumnStore:
+    """columnar metadata of every user's mailbox under one private directory
+
+    writes only touch the memory maps, a background thread flushes dirty
+    mailboxes every flush_interval seconds (0 flushes on every write). at
+    most max_open mailboxes stay mapped, the least recently used is closed
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0, max_open: int = 64, sync_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_open = max_open
+        self.sync_interval = sync_interval
+        self._mailboxes: "OrderedDict[str, MailboxColumns]" = OrderedDict()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _dir(self, user: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(user.encode()).hexdigest()[:16])
+
+    def mailbox(self, user: str) -> MailboxColumns:
+        mailbox = self._mailboxes.get(user)
+        if mailbox is not None:
+            self._mailboxes.move_to_end(user)
+            return mailbox
+        _private_dir(self.path)
+        mailbox = self._mailboxes[user] = MailboxColumns(self._dir(user))
+        while len(self._mailboxes) > self.max_open:
+            evicted, columns = self._mailboxes.popitem(last=False)
+            self._dirty.discard(evicted)
+            columns.close()
+        return mailbox
+
+    def _written(self, user: str):
+        if self.flush_interval <= 0:
+            self._mailboxes[user].flush()
+            return
+        self._dirty.add(user)
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, name="column-store-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("error flushing column store: %s", e)
+
+    def flush(self):
+        with self._lock:
+            for user in self._dirty:
+                self._mailboxes[user].flush()
+            self._dirty.clear()
+
+    def upsert(self, user: str, records: List[Dict[str, Any]], history_id: Optional[str] = None):
+        """store records, history_id is the mailbox version they are at least as new as"""
+        with self._lock:
+            mailbox = self.mailbox(user)
+            mailbox.upsert(records)
+            if mailbox.history_id is None and history_id:
+                mailbox.history_id = history_id
+                mailbox.synced_at = time.time()
+            self._written(user)
+
+    def remove(self, user: str, message_ids: List[str]):
+        with self._lock:
+            self.mailbox(user).remove(message_ids)
+            self._written(user)
+
+    def update_labels(self, user: str, message_ids: List[str], add: List[str] = None, remove: List[str] = None):
+        with self._lock:
+            self.mailbox(user).update_labels(message_ids, add, remove)
+            self._written(user)
+
+    def apply_history(self, user: str, records: List[Dict[str, Any]], history_id: Optional[str] = None):
+        """apply deletions and label changes from history.list records, skipping ones already applied"""
+        with self._lock:
+            mailbox = self.mailbox(user)
+            if mailbox.history_id:
+                records = [r for r in records if int(r['id']) > int(mailbox.history_id)]
+            for record in records:
+                deleted = [item['message']['id'] for item in record.get('messagesDeleted', [])]
+                if deleted:
+                    mailbox.remove(deleted)
+                for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    message = item['message']
+                    if 'labelIds' in message:
+                        mailbox.set_labels(message['id'], message['labelIds'])
+            if history_id and (not mailbox.history_id or int(history_id) > int(mailbox.history_id)):
+                mailbox.history_id = history_id
+            mailbox.synced_at = time.time()
+            self._written(user)
+
+    def history_id(self, user: str) -> Optional[str]:
+        with self._lock:
+            return self.mailbox(user).history_id
+
+    def needs_sync(self, user: str) -> bool:
+        """stored rows whose version is older than sync_interval, including ones left by an earlier process"""
+        with self._lock:
+            mailbox = self.mailbox(user)
+            return bool(mailbox.count and mailbox.history_id) and time.time() - mailbox.synced_at >= self.sync_interval
+
+    def reset(self, user: str):
+        """drop a mailbox whose history gmail no longer has"""
+        with self._lock:
+            mailbox = self._mailboxes.pop(user, None)
+            self._dirty.discard(user)
+            if mailbox is not None:
+                mailbox.close()
+            shutil.rmtree(self._dir(user), ignore_errors=True)
+
+    def select(self, user: str, limit: int = 100, **filters) -> List[str]:
+        with self._lock:
+            return self.mailbox(user).select(limit, **filters)
+
+    def summary(self, user: str, top: int = 10, **filters) -> Dict[str, Any]:
+        with self._lock:
+            return self.mailbox(user).summary(top, **filters)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'users': len(self._mailboxes),
+                'messages': sum(m.count for m in self._mailboxes.values()),
+                'bytes': sum(m.nbytes() for m in self._mailboxes.values()),
+                'dirty': len(self._dirty)
+            }
+
+
+column_store = ColumnStore(
+    os.getenv("COLUMN_STORE_PATH", os.path.join(tempfile.gettempdir(), "mail-columns")),
+    flush_interval=float(os.getenv("COLUMN_STORE_FLUSH_INTERVAL", "5")),
+    max_open=int(os.getenv("COLUMN_STORE_MAX_OPEN", "64")),
+    sync_interval=float(os.getenv("COLUMN_STORE_SYNC_INTERVAL", "5"))
+)
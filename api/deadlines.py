@@ -0,0 +1,136 @@
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Dict, Optional
+from fastapi.responses import JSONResponse
+
+
+class RequestAborted(Exception):
+    """the request this work belongs to can no longer use its result"""
+
+
+class DeadlineExceeded(RequestAborted):
+    pass
+
+
+class RequestCancelled(RequestAborted):
+    """the client disconnected"""
+
+
+class Deadline:
+    """time budget and cancel flag of one request
+
+    carried in a context variable, so worker threads started with
+    asyncio.to_thread see the same object and stop when it is cancelled
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.cancelled = False
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled("client disconnected")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("request deadline exceeded")
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def check():
+    """raise when the current request is cancelled or out of time, a no-op outside requests"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def remaining() -> Optional[float]:
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def expired() -> bool:
+    deadline = _current.get()
+    if deadline is None:
+        return False
+    left = deadline.remaining()
+    return deadline.cancelled or (left is not None and left <= 0)
+
+
+class DeadlineMiddleware:
+    """gives every http request a deadline and cancels it when the client goes away
+
+    the budget is timeout seconds (or the path's override), less when the client sends
+    X-Request-Timeout. the connection is watched for a disconnect, which
+    cancels the deadline so outstanding gmail calls of the request stop
+    before they are made
+    """
+
+    def __init__(self, app, timeout: float = 30.0, overrides: Optional[Dict[str, float]] = None):
+        self.app = app
+        self.timeout = timeout
+        # longer budgets for slow paths like the chat agent, by path
+        self.overrides = overrides or {}
+
+    def _seconds(self, scope) -> float:
+        timeout = self.overrides.get(scope.get("path"), self.timeout)
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-timeout":
+                try:
+                    return min(float(value), timeout)
+                except ValueError:
+                    break
+        return timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(self._seconds(scope))
+        token = _current.set(deadline)
+        # the watcher reads the connection and queues what the app would have received
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def watch():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    deadline.cancel()
+                    return
+
+        async def queued_receive():
+            message = await messages.get()
+            if message["type"] == "http.disconnect":
+                # every later receive sees the disconnect too
+                messages.put_nowait(message)
+            return message
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await self.app(scope, queued_receive, send)
+        finally:
+            watcher.cancel()
+            _current.reset(token)
+
+
+async def aborted_response(request, exc: RequestAborted) -> JSONResponse:
+    """504 for a blown deadline, 499 for a client that is no longer listening"""
+    if isinstance(exc, RequestCancelled):
+        return JSONResponse({"detail": str(exc)}, status_code=499)
+    return JSONResponse({"detail": str(exc)}, status_code=504)
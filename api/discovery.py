@@ -0,0 +1,60 @@
+import json
+import threading
+from typing import Any, Dict, Optional, Tuple
+import httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# apis the server builds clients for, preloaded at startup
+APIS = (("gmail", "v1"), ("oauth2", "v2"))
+
+_documents: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+_lock = threading.Lock()
+
+
+def _prime(resource, description: Dict[str, Any]):
+    """build every nested resource once
+
+    building a resource fills in parameter defaults on its part of the
+    document in place. doing it for the whole tree up front leaves a
+    document that later builds only read, so threads can share it
+    """
+    for name, child in description.get("resources", {}).items():
+        _prime(getattr(resource, name)(), child)
+
+
+def document(api: str, version: str) -> Optional[Dict[str, Any]]:
+    """parsed discovery document shipped with googleapiclient, None when it has none"""
+    key = (api, version)
+    if key in _documents:
+        return _documents[key]
+    with _lock:
+        if key not in _documents:
+            raw = discovery_cache.get_static_doc(api, version)
+            doc = json.loads(raw) if raw else None
+            if doc is not None:
+                _prime(build_from_document(doc, http=httplib2.Http()), doc)
+            _documents[key] = doc
+        return _documents[key]
+
+
+def client(api: str, version: str, **kwargs):
+    """googleapiclient resource built from the parsed document
+
+    build() reads and parses the json for every client, and GmailService
+    makes one per request. an api missing from the bundled documents falls
+    back to build(), which fetches it
+    """
+    doc = document(api, version)
+    if doc is None:
+        return build(api, version, **kwargs)
+    return build_from_document(doc, **kwargs)
+
+
+def preload():
+    for api, version in APIS:
+        if document(api, version) is None:
+            log.warning("no bundled discovery document for %s %s, clients will fetch it", api, version)
@@ -0,0 +1,27 @@
+import hashlib
+from typing import Any, Dict, Iterable, Optional
+
+
+def _tag(*parts: Any) -> str:
+    digest = hashlib.sha1("\x00".join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def message_etag(record: Dict[str, Any], fields: Iterable[str] = ()) -> str:
+    """strong etag of a message: its history id changes with every change, labels guard local edits"""
+    return _tag('message', record['id'], record.get('history_id'), ",".join(sorted(record.get('labels', []))),
+                ",".join(fields))
+
+
+def list_etag(history_id: str, query: str, max_results: int, page_token: Optional[str],
+              fields: Iterable[str] = ()) -> str:
+    """strong etag of a list page, valid while the mailbox version is unchanged"""
+    return _tag('list', history_id, query, max_results, page_token, ",".join(fields))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison, weak tags compare by their opaque value"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
@@ -0,0 +1,345 @@
+"""
+gmail search syntax parser and local evaluator
+turns queries like 'from:bob is:unread after:2024/01/01' into an ast and
+compiles it to sql over the local message store
+"""
+import re
+import time
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class UnsupportedQuery(Exception):
+    """query uses syntax the local store can't answer exactly"""
+
+
+class Node:
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+
+class Term(Node):
+    """op:value, op is None for free text"""
+
+    def __init__(self, op: Optional[str], value: str):
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return f"Term({self.op!r}, {self.value!r})"
+
+
+class Not(Node):
+    def __init__(self, child: Node):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child!r})"
+
+
+class And(Node):
+    def __init__(self, children: List[Node]):
+        self.children = children
+
+    def __repr__(self):
+        return f"And({self.children!r})"
+
+
+class Or(Node):
+    def __init__(self, children: List[Node]):
+        self.children = children
+
+    def __repr__(self):
+        return f"Or({self.children!r})"
+
+
+# tokenizing and parsing
+
+TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<open>[({])
+  | (?P<close>[)}])
+  | (?P<neg>-(?=\S))
+  | (?P<opgroup>[A-Za-z_]+:(?=[({]))
+  | (?P<term>(?:[A-Za-z_]+:)?(?:"[^"]*"|[^\s(){}"]+)|"[^"]*")
+''', re.VERBOSE)
+
+
+def tokenize(query: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if not match:
+            raise UnsupportedQuery(f"can't parse query near: {query[pos:pos + 20]!r}")
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group()))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> Tuple[str, str]:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse_and(self) -> Node:
+        children = []
+        while self.peek() and self.peek()[0] != 'close':
+            if self.peek() == ('term', 'AND'):
+                self.take()
+                continue
+            children.append(self.parse_or())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_or(self) -> Node:
+        children = [self.parse_unary()]
+        while self.peek() == ('term', 'OR'):
+            self.take()
+            children.append(self.parse_unary())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_unary(self) -> Node:
+        kind, text = self.take()
+        if kind == 'neg':
+            return Not(self.parse_unary())
+        if kind == 'open':
+            return self.parse_group(text, None)
+        if kind == 'opgroup':
+            opener = self.take()[1]
+            return self.parse_group(opener, text[:-1].lower())
+        if kind == 'term':
+            return make_term(text)
+        raise UnsupportedQuery(f"unexpected {text!r}")
+
+    def parse_group(self, opener: str, op: Optional[str]) -> Node:
+        """( ... ) groups are and-ed, { ... } groups are or-ed, op applies to every word"""
+        children = []
+        while self.peek() and self.peek()[0] != 'close':
+            if self.peek() == ('term', 'AND') or (opener == '{' and self.peek() == ('term', 'OR')):
+                self.take()
+                continue
+            children.append(self.parse_unary() if opener == '{' else self.parse_or())
+        if not self.peek():
+            raise UnsupportedQuery("unclosed group")
+        self.take()
+
+        if op:
+            children = [apply_op(child, op) for child in children]
+        if len(children) == 1:
+            return children[0]
+        return Or(children) if opener == '{' else And(children)
+
+
+def apply_op(node: Node, op: str) -> Node:
+    """subject:(a b) means subject:a subject:b, push op onto free text terms"""
+    if isinstance(node, Term):
+        return Term(op, node.value) if node.op is None else node
+    if isinstance(node, Not):
+        return Not(apply_op(node.child, op))
+    return type(node)([apply_op(child, op) for child in node.children])
+
+
+def make_term(text: str) -> Term:
+    if re.match(r'^[A-Za-z_]+:', text):
+        op, value = text.split(':', 1)
+        return Term(op.lower(), value.strip('"').lower())
+    return Term(None, text.strip('"').lower())
+
+
+def parse(query: str) -> Node:
+    """parse gmail search syntax, an empty query is an empty And"""
+    parser = _Parser(tokenize(query))
+    node = parser.parse_and()
+    if parser.peek():
+        raise UnsupportedQuery(f"unexpected {parser.peek()[1]!r}")
+    return node
+
+
+# local evaluation
+
+LABEL_ALIASES = {
+    ('is', 'unread'): 'UNREAD',
+    ('is', 'starred'): 'STARRED',
+    ('is', 'important'): 'IMPORTANT',
+    ('in', 'inbox'): 'INBOX',
+    ('in', 'sent'): 'SENT',
+    ('in', 'drafts'): 'DRAFT',
+    ('in', 'draft'): 'DRAFT',
+    ('in', 'trash'): 'TRASH',
+    ('in', 'spam'): 'SPAM',
+    ('in', 'starred'): 'STARRED',
+    ('in', 'important'): 'IMPORTANT',
+    ('category', 'primary'): 'CATEGORY_PERSONAL',
+    ('category', 'personal'): 'CATEGORY_PERSONAL',
+    ('category', 'social'): 'CATEGORY_SOCIAL',
+    ('category', 'promotions'): 'CATEGORY_PROMOTIONS',
+    ('category', 'updates'): 'CATEGORY_UPDATES',
+    ('category', 'forums'): 'CATEGORY_FORUMS',
+}
+
+# fts5 columns of the local store searched by each operator
+FTS_COLUMNS = {'from': 'sender', 'to': 'recipients', 'subject': 'subject'}
+
+DAY_MS = 24 * 60 * 60 * 1000
+UNIT_MS = {'d': DAY_MS, 'm': 30 * DAY_MS, 'y': 365 * DAY_MS}
+
+
+def parse_date_ms(value: str) -> int:
+    """gmail dates are yyyy/mm/dd (or with dashes) or unix seconds
+
+    only unix seconds name an exact instant. gmail reads calendar dates as
+    midnight in its own time zone, not the server's or utc, so those are
+    left to gmail rather than answered with a window a few hours off
+    """
+    if value.isdigit():
+        return int(value) * 1000
+    try:
+        datetime.datetime.strptime(value.replace('-', '/'), '%Y/%m/%d')
+    except ValueError:
+        raise UnsupportedQuery(f"can't read date {value!r}")
+    raise UnsupportedQuery(f"calendar date {value!r} is resolved by gmail")
+
+
+def parse_age_ms(value: str) -> int:
+    match = re.fullmatch(r'(\d+)([dmy])', value)
+    if not match:
+        raise UnsupportedQuery(f"can't read age {value!r}")
+    return int(match.group(1)) * UNIT_MS[match.group(2)]
+
+
+def parse_size(value: str) -> int:
+    match = re.fullmatch(r'(\d+)([km]?)', value)
+    if not match:
+        raise UnsupportedQuery(f"can't read size {value!r}")
+    return int(match.group(1)) * {'': 1, 'k': 1024, 'm': 1024 * 1024}[match.group(2)]
+
+
+def lower_date_bound(node: Node, now_ms: Optional[int] = None) -> Optional[int]:
+    """earliest internal date a match can have, None when unbounded"""
+    now_ms = now_ms or int(time.time() * 1000)
+    if isinstance(node, Term):
+        if node.op in ('after', 'newer'):
+            return parse_date_ms(node.value)
+        if node.op == 'newer_than':
+            return now_ms - parse_age_ms(node.value)
+        return None
+    if isinstance(node, And):
+        bounds = [b for b in (lower_date_bound(c, now_ms) for c in node.children) if b is not None]
+        return max(bounds) if bounds else None
+    if isinstance(node, Or):
+        bounds = [lower_date_bound(c, now_ms) for c in node.children]
+        return None if not bounds or None in bounds else min(bounds)
+    return None
+
+
+def mentions_spam_trash(node: Node) -> bool:
+    if isinstance(node, Term):
+        return node.op == 'in' and node.value in ('trash', 'spam', 'anywhere')
+    if isinstance(node, Not):
+        return mentions_spam_trash(node.child)
+    return any(mentions_spam_trash(c) for c in node.children)
+
+
+class SqlCompiler:
+    """compiles an ast to a where clause over messages aliased as m
+
+    raises UnsupportedQuery for anything the store can't answer exactly, such
+    as free text (bodies aren't always stored) or has:attachment
+    """
+
+    def __init__(self, label_names: Dict[str, str], now_ms: Optional[int] = None):
+        # lowercased label name -> label id, for label:
+        self.label_names = label_names
+        self.now_ms = now_ms or int(time.time() * 1000)
+
+    def compile(self, node: Node) -> Tuple[str, List[Any]]:
+        if isinstance(node, And):
+            if not node.children:
+                return "1", []
+            return self._join(node.children, " and ")
+        if isinstance(node, Or):
+            return self._join(node.children, " or ")
+        if isinstance(node, Not):
+            sql, params = self.compile(node.child)
+            return f"not ({sql})", params
+        return self._term(node)
+
+    def _join(self, children: List[Node], glue: str) -> Tuple[str, List[Any]]:
+        parts, params = [], []
+        for child in children:
+            sql, child_params = self.compile(child)
+            parts.append(f"({sql})")
+            params += child_params
+        return glue.join(parts), params
+
+    def _term(self, term: Term) -> Tuple[str, List[Any]]:
+        op, value = term.op, term.value
+        if op in ('from', 'to') and value.lower() == 'me':
+            # the account owner, not the word "me", gmail knows the address
+            raise UnsupportedQuery(f"{op}:me")
+        if op == 'from' and re.fullmatch(r'[^@\s]+@[^@\s]+', value):
+            # full address, exact match on the indexed column
+            return "m.sender_address = ?", [value]
+        if op in ('from', 'to', 'subject'):
+            # gmail matches whole words, subject:cat is not "education", from:ann is not joanna
+            return _has_words(), [f"{FTS_COLUMNS[op]} : {_phrase(value)}"]
+        if (op, value) in LABEL_ALIASES:
+            return _has_label(), [LABEL_ALIASES[(op, value)]]
+        if op == 'is' and value == 'read':
+            return f"not {_has_label()}", ['UNREAD']
+        if op == 'in' and value == 'anywhere':
+            return "1", []
+        if op == 'label':
+            label_id = self.label_names.get(value.replace('-', ' ')) or self.label_names.get(value)
+            if not label_id:
+                raise UnsupportedQuery(f"unknown label {value!r}")
+            return _has_label(), [label_id]
+        if op in ('after', 'newer'):
+            return "m.internal_date >= ?", [parse_date_ms(value)]
+        if op in ('before', 'older'):
+            return "m.internal_date < ?", [parse_date_ms(value)]
+        if op == 'newer_than':
+            return "m.internal_date >= ?", [self.now_ms - parse_age_ms(value)]
+        if op == 'older_than':
+            return "m.internal_date < ?", [self.now_ms - parse_age_ms(value)]
+        if op in ('larger', 'size'):
+            return "m.size_estimate >= ?", [parse_size(value)]
+        if op == 'smaller':
+            return "m.size_estimate < ?", [parse_size(value)]
+        raise UnsupportedQuery(f"operator not available locally: {op or 'free text'}")
+
+
+def compile_query(query: str, label_names: Dict[str, str], now_ms: Optional[int] = None) -> Tuple[str, List[Any], Node]:
+    """where clause and params for a gmail query, with default spam/trash exclusion"""
+    node = parse(query)
+    sql, params = SqlCompiler(label_names, now_ms).compile(node)
+    if not mentions_spam_trash(node):
+        sql = f"({sql}) and not {_has_label()} and not {_has_label()}"
+        params += ['TRASH', 'SPAM']
+    return sql, params, node
+
+
+def _has_label() -> str:
+    return "exists (select 1 from message_labels l where l.user = m.user and l.id = m.id and l.label = ?)"
+
+
+def _has_words() -> str:
+    return "m.rowid in (select rowid from messages_fts where messages_fts match ?)"
+
+
+def _phrase(value: str) -> str:
+    """fts5 phrase of the value's words, tokenized like the index so alice@example.com is alice example com"""
+    words = re.findall(r"\w+", value)
+    if not words:
+        raise UnsupportedQuery(f"no words to match in {value!r}")
+    return '"' + " ".join(words) + '"'
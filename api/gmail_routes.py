@@ -1,21 +1,82 @@
-from fastapi import APIRouter, HTTPException, Depends
+import os
+import json
+import time
+import base64
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from .auth import AuthService
-from .gmail_service import GmailService
+from .auth import get_auth_service
+from .gmail_service import GmailService, batch_error, page_offset
+from .message_cache import message_cache
+from .response_cache import response_cache
+from .query_cache import query_cache
+from .local_store import local_store
+from .ranker import ranker, RANK_MODES
+from .column_store import column_store
+from .mail_watcher import watchers
+from .warmup import warmup
+from .prefetch import prefetcher
+from .quota import quota_scheduler
+from .circuit import breakers, revalidator, is_outage
+from .hedge import hedger
+from .deadlines import RequestAborted
+from . import deadlines, turns
+from . import log as logs
+from .turns import turn_log
+from .startup import load_agent
+from .etags import message_etag, list_etag, etag_matches
+from .models import MessageSummary, MessageDetail, MessageListResponse, BatchGetRequest
+from .responses import FastJSONResponse, parse_fields, shape
 
-router = APIRouter(prefix="/gmail", tags=["gmail"])
+router = APIRouter(prefix="/gmail", tags=["gmail"], default_response_class=FastJSONResponse)
 security = HTTPBearer()
 
-@router.get("/messages")
+# clients may keep responses but have to revalidate them with the etag
+REVALIDATE = "private, no-cache"
+
+# ids per batchGet call, gmail itself allows 100 calls per batch request
+BATCH_GET_MAX = int(os.getenv("BATCH_GET_MAX", "100"))
+BATCH_FORMATS = {"full": MessageDetail, "metadata": MessageSummary}
+
+# marks answers served from cache while gmail could not confirm them
+STALE_WARNING = '110 - "Response is Stale"'
+
+
+def unavailable(gmail_service) -> HTTPException:
+    """503 for reads that failed during a gmail outage with nothing cached to serve"""
+    retry_after = max(1, int(breakers.retry_after(gmail_service.user_key) + 0.5))
+    return HTTPException(503, "gmail is unavailable, try again shortly", headers={"Retry-After": str(retry_after)})
+
+
+def freshness_headers(gmail_service, headers: dict) -> dict:
+    if gmail_service.stale:
+        headers["Warning"] = STALE_WARNING
+    return headers
+
+
+@router.get("/messages", response_model=MessageListResponse)
 async def get_messages(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     query: str = "",
-    max_results: int = 50
+    max_results: int = 50,
+    page_token: str = None,
+    prefetch: bool = False,
+    fields: str = None
 ):
-    """get gmail messages using fastapi auth"""
+    """get gmail messages using fastapi auth
+
+    rows carry the summary fields unless fields= names others, body included.
+    prefetch=true fetches the next page and likely-opened bodies in the background
+    """
+    selected = parse_fields(fields, MessageDetail, MessageSummary.model_fields)
+    try:
+        offset = page_offset(page_token)
+    except ValueError:
+        raise HTTPException(400, "invalid page_token")
     try:
         # create auth service instance here instead
-        auth_service = AuthService()
+        auth_service = get_auth_service()
         
         # validate session and get credentials
         session_data = await auth_service.validate_session(credentials.credentials)
@@ -27,32 +88,306 @@ async def get_messages(
             auth_service.client_secret
         )
         
-        # search emails
-        messages = gmail_service.search_emails(query, max_results)
+        # an unchanged mailbox version proves the cached page is still current
+        if_none_match = request.headers.get("if-none-match")
+        version = None
+        if if_none_match:
+            version = await asyncio.to_thread(gmail_service.cached_page_version, query, max_results, page_token)
+        if version:
+            etag = list_etag(version, query, max_results, page_token, selected)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
         
-        # get details for each message
-        detailed_messages = []
-        for msg in messages[:10]:  # limit details to first 10
-            details = gmail_service.get_email_details(msg['id'])
-            if details:
-                detailed_messages.append(details)
+        # search emails, later pages come from the cached result list.
+        # gmail calls run on worker threads so a client disconnect can cancel the rest
+        prefetcher.record_page(gmail_service.user_key, query, page_token)
+        messages, next_page_token = await asyncio.to_thread(
+            gmail_service.search_emails_page, query, max_results, page_token
+        )
+        deadlines.check()
+        if not messages and gmail_service.outage:
+            raise unavailable(gmail_service)
         
-        return {
+        # details of the whole page, cached ones first and the rest in batches
+        found, _ = await asyncio.to_thread(gmail_service.get_emails_details, [m['id'] for m in messages])
+        deadlines.check()
+        detailed_messages = [shape(found[m['id']], MessageDetail, selected) for m in messages if found.get(m['id'])]
+        
+        if prefetch:
+            prefetcher.schedule(gmail_service, query, max_results, next_page_token, [m['id'] for m in messages])
+        
+        headers = {}
+        version = query_cache.version(gmail_service.user_key, query, offset + max_results + 1)
+        if version:
+            headers = {"ETag": list_etag(version, query, max_results, page_token, selected), "Cache-Control": REVALIDATE}
+        
+        # rows are already shaped, skip a second validation pass
+        return FastJSONResponse({
             "messages": detailed_messages,
-            "total_count": len(messages)
-        }
+            "total_count": len(messages),
+            "next_page_token": next_page_token,
+            "stale": gmail_service.stale
+        }, headers=freshness_headers(gmail_service, headers))
         
+    except (HTTPException, RequestAborted):
+        raise
     except Exception as e:
         raise HTTPException(500, f"error fetching messages: {str(e)}")
 
-@router.get("/message/{message_id}")
+@router.get("/search/local")
+async def search_local(
+    q: str,
+    limit: int = 20,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """ranked full text search over already fetched mail, no gmail calls"""
+    auth_service = get_auth_service()
+    session_data = await auth_service.validate_session(credentials.credentials)
+    user_key = session_data.get("user_id") or session_data.get("email")
+    
+    start = time.perf_counter()
+    results = local_store.search(user_key, q, min(limit, 100))
+    
+    return {
+        "messages": results,
+        "total_count": len(results),
+        "indexed_count": local_store.count(user_key),
+        "took_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+@router.get("/search/ranked")
+async def search_ranked(
+    text: str,
+    q: str = "",
+    limit: int = 10,
+    mode: str = "bm25",
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """messages most relevant to free text, optionally among the matches of a gmail query"""
+    if mode not in RANK_MODES:
+        raise HTTPException(400, f"mode must be one of: {', '.join(RANK_MODES)}")
+
+    try:
+        auth_service = get_auth_service()
+        session_data = await auth_service.validate_session(credentials.credentials)
+        gmail_service = GmailService(
+            session_data,
+            auth_service.client_id,
+            auth_service.client_secret
+        )
+
+        start = time.perf_counter()
+        results = await asyncio.to_thread(gmail_service.rank_emails, text, q, min(limit, 100), mode)
+
+        return {
+            "messages": results,
+            "total_count": len(results),
+            "took_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    except Exception as e:
+        raise HTTPException(500, f"error ranking messages: {str(e)}")
+
+@router.get("/mailbox/summary")
+async def mailbox_summary(
+    label: str = None,
+    sender: str = None,
+    after_ms: int = None,
+    before_ms: int = None,
+    top: int = 10,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """counts, sizes, labels and top senders over stored metadata
+
+    gmail is only asked for history when the stored columns are behind,
+    like after a restart
+    """
+    auth_service = get_auth_service()
+    session_data = await auth_service.validate_session(credentials.credentials)
+    user_key = session_data.get("user_id") or session_data.get("email")
+
+    stale = False
+    if column_store.needs_sync(user_key):
+        gmail_service = GmailService(session_data, auth_service.client_id, auth_service.client_secret)
+        await asyncio.to_thread(gmail_service.sync_history)
+        stale = gmail_service.stale
+
+    start = time.perf_counter()
+    summary = column_store.summary(
+        user_key, min(top, 100), label=label, sender=sender, after_ms=after_ms, before_ms=before_ms
+    )
+    summary["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    summary["stale"] = stale
+    return summary
+
+@router.post("/local/sync")
+async def sync_local(
+    max_messages: int = 2000,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """store metadata of recent mail so searches inside that window skip gmail"""
+    try:
+        auth_service = get_auth_service()
+        session_data = await auth_service.validate_session(credentials.credentials)
+        gmail_service = GmailService(
+            session_data,
+            auth_service.client_id,
+            auth_service.client_secret
+        )
+
+        start = time.perf_counter()
+        synced = await asyncio.to_thread(gmail_service.sync_local_store, min(max_messages, 10000))
+
+        return {
+            "synced_count": synced,
+            "coverage": local_store.coverage(gmail_service.user_key),
+            "took_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    except Exception as e:
+        raise HTTPException(500, f"error syncing messages: {str(e)}")
+
+@router.get("/changes")
+async def get_changes(
+    since: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """messages added, deleted or relabelled since a history id, plus the new history id"""
+    if not since.isdigit():
+        raise HTTPException(400, "since must be a gmail history id")
+
+    try:
+        auth_service = get_auth_service()
+        session_data = await auth_service.validate_session(credentials.credentials)
+        gmail_service = GmailService(
+            session_data,
+            auth_service.client_id,
+            auth_service.client_secret
+        )
+
+        changes = await asyncio.to_thread(gmail_service.get_changes, since)
+
+    except (HTTPException, RequestAborted):
+        raise
+    except Exception as e:
+        if is_outage(e):
+            raise unavailable(gmail_service)
+        # gmail's own 4xx (bad id, revoked access) go back as they are, anything else is upstream
+        code = batch_error(e)['code']
+        raise HTTPException(code if 400 <= code < 500 else 502, f"error fetching changes: {str(e)}")
+
+    # only gmail's 404 for the start id gets here as None
+    if changes is None:
+        # history ids expire after about a week, the client has to list again
+        raise HTTPException(410, "history id too old, full refresh required")
+    return changes
+
+@router.websocket("/ws")
+async def mail_events(websocket: WebSocket, token: str):
+    """push new mail and label changes, one upstream watcher per user for all tabs"""
+    try:
+        auth_service = get_auth_service()
+        session_data = await auth_service.validate_session(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    gmail_service = GmailService(
+        session_data,
+        auth_service.client_id,
+        auth_service.client_secret
+    )
+    user_key = gmail_service.user_key
+
+    await websocket.accept()
+    queue = watchers.subscribe(user_key, gmail_service, session_data.get("email"))
+    receive = None
+    try:
+        # the client sends nothing, receiving only notices the disconnect
+        receive = asyncio.create_task(websocket.receive())
+        while True:
+            event = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({receive, event}, return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                if receive.result()["type"] == "websocket.disconnect":
+                    event.cancel()
+                    break
+                receive = asyncio.create_task(websocket.receive())
+                if event not in done:
+                    event.cancel()
+                    continue
+            # a change that finished together with the client's frame is still sent
+            await websocket.send_json(event.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if receive:
+            receive.cancel()
+        watchers.unsubscribe(user_key, queue)
+
+@router.post("/push")
+async def pubsub_push(request: Request, token: str = ""):
+    """pub/sub push endpoint for gmail watch notifications"""
+    if not os.getenv("PUBSUB_VERIFICATION_TOKEN") or token != os.getenv("PUBSUB_VERIFICATION_TOKEN"):
+        raise HTTPException(403, "invalid push token")
+
+    try:
+        body = await request.json()
+        data = json.loads(base64.b64decode(body["message"]["data"]))
+        if not isinstance(data, dict):
+            raise ValueError("data is not a json object")
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(400, f"malformed push message: {str(e)}")
+
+    watchers.notify_email(data.get("emailAddress", ""), str(data.get("historyId", "")))
+    # pub/sub only needs a 2xx to stop redelivering
+    return {"status": "ok"}
+
+@router.get("/profile")
+async def get_profile_counts(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """message, thread and inbox totals for the mail page header"""
+    try:
+        auth_service = get_auth_service()
+        session_data = await auth_service.validate_session(credentials.credentials)
+        gmail_service = GmailService(
+            session_data,
+            auth_service.client_id,
+            auth_service.client_secret
+        )
+        return await asyncio.to_thread(gmail_service.get_mailbox_counts)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"error fetching profile: {str(e)}")
+
+@router.get("/warmup")
+async def get_warmup_status(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """state of the post-login cache warm-up"""
+    auth_service = get_auth_service()
+    session_data = await auth_service.validate_session(credentials.credentials)
+    user_key = session_data.get("user_id") or session_data.get("email")
+
+    status = warmup.status(user_key)
+    if status is None:
+        raise HTTPException(404, "no warm-up for this session")
+    return status
+
+@router.get("/message/{message_id}", response_model=MessageDetail)
 async def get_message(
     message_id: str,
+    request: Request,
+    fields: str = None,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    """get specific email details"""
+    """get specific email details, fields= limits the returned fields"""
+    selected = parse_fields(fields, MessageDetail, MessageDetail.model_fields)
     try:
-        auth_service = AuthService()
+        auth_service = get_auth_service()
         session_data = await auth_service.validate_session(credentials.credentials)
         gmail_service = GmailService(
             session_data, 
@@ -60,15 +395,79 @@ async def get_message(
             auth_service.client_secret
         )
         
-        details = gmail_service.get_email_details(message_id)
+        prefetcher.record_message(gmail_service.user_key, message_id)
+        # a 304 vouches for the client's copy, so a cached record is checked against gmail first
+        if_none_match = request.headers.get("if-none-match")
+        fetch = gmail_service.current_email_details if if_none_match else gmail_service.get_email_details
+        details = await asyncio.to_thread(fetch, message_id)
         if not details:
+            if gmail_service.outage:
+                raise unavailable(gmail_service)
             raise HTTPException(404, "message not found")
         
-        return details
+        # a checked record answers with one minimal get, a fetched one still saves the body
+        etag = message_etag(details, selected)
+        if not gmail_service.stale and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+        
+        return FastJSONResponse(
+            shape(details, MessageDetail, selected),
+            headers=freshness_headers(gmail_service, {"ETag": etag, "Cache-Control": REVALIDATE})
+        )
         
+    except (HTTPException, RequestAborted):
+        raise
     except Exception as e:
         raise HTTPException(500, f"error fetching message: {str(e)}")
 
+@router.post("/messages:batchGet")
+async def batch_get_messages(
+    body: BatchGetRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """many messages in one round trip, results in request order with an error per failed id
+
+    cached messages are answered locally, the rest are fetched in one gmail batch
+    """
+    if body.format not in BATCH_FORMATS:
+        raise HTTPException(400, f"format must be one of: {', '.join(BATCH_FORMATS)}")
+    if len(body.ids) > BATCH_GET_MAX:
+        raise HTTPException(400, f"at most {BATCH_GET_MAX} ids per request")
+    model = BATCH_FORMATS[body.format]
+    selected = parse_fields(body.fields, model, model.model_fields)
+    try:
+        auth_service = get_auth_service()
+        session_data = await auth_service.validate_session(credentials.credentials)
+        gmail_service = GmailService(
+            session_data,
+            auth_service.client_id,
+            auth_service.client_secret
+        )
+
+        if body.format == "full":
+            for message_id in dict.fromkeys(body.ids):
+                prefetcher.record_message(gmail_service.user_key, message_id)
+            found, errors = await asyncio.to_thread(gmail_service.get_emails_details, body.ids)
+        else:
+            found, errors = await asyncio.to_thread(gmail_service.get_emails_summaries, body.ids)
+        deadlines.check()
+
+        results = []
+        for message_id in body.ids:
+            if message_id in found:
+                results.append({"id": message_id, "message": shape(found[message_id], model, selected)})
+            else:
+                results.append({"id": message_id, "error": errors.get(message_id, {"code": 404, "message": "message not found"})})
+        return FastJSONResponse(
+            {"messages": results, "stale": gmail_service.stale},
+            headers=freshness_headers(gmail_service, {})
+        )
+
+    except (HTTPException, RequestAborted):
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"error fetching messages: {str(e)}")
+
 @router.post("/chat")
 async def gmail_chat(
     request: dict,
@@ -76,7 +475,7 @@ async def gmail_chat(
 ):
     """ai chat interface for gmail management"""
     try:
-        auth_service = AuthService()
+        auth_service = get_auth_service()
         session_data = await auth_service.validate_session(credentials.credentials)
         gmail_service = GmailService(
             session_data,
@@ -84,15 +483,53 @@ async def gmail_chat(
             auth_service.client_secret
         )
         
-        # create agent with gmail service
-        from .agent_fastapi import MailAgent
-        agent = MailAgent(gmail_service)
+        # create agent with gmail service, a cold import runs off the event loop
+        MailAgent = await asyncio.to_thread(load_agent)
+        agent = await asyncio.to_thread(MailAgent, gmail_service)
         
         # process user message
         user_message = request.get("message", "")
-        response = agent.chat(user_message)
+        response = await asyncio.to_thread(agent.chat, user_message)
         
-        return {"response": response}
+        start = time.perf_counter()
+        body = FastJSONResponse({"response": response})
+        turns.record_serialization(agent.last_turn, time.perf_counter() - start)
+        return body
         
     except Exception as e:
         raise HTTPException(500, f"error in chat: {str(e)}")
+
+@router.get("/chat/turns")
+async def get_chat_turns(
+    limit: int = 20,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """timing breakdown of the caller's recent chat turns, newest first"""
+    auth_service = get_auth_service()
+    session_data = await auth_service.validate_session(credentials.credentials)
+    user_key = session_data.get("user_id") or session_data.get("email")
+    
+    return {"turns": turn_log.recent(user_key, max(1, min(limit, turn_log.size)))}
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """hit ratios and sizes of the in-process caches"""
+    auth_service = get_auth_service()
+    await auth_service.validate_session(credentials.credentials)
+    
+    return {
+        "messages": message_cache.stats(),
+        "queries": query_cache.stats(),
+        "responses": response_cache.stats(),
+        "ranker": ranker.stats(),
+        "columns": column_store.stats(),
+        "watchers": watchers.stats(),
+        "prefetch": prefetcher.stats(),
+        "quota": quota_scheduler.stats(),
+        "breakers": breakers.stats(),
+        "hedging": hedger.stats(),
+        "revalidations": revalidator.stats(),
+        "logging": logs.stats()
+    }
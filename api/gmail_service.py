@@ -1,13 +1,60 @@
 import os
 import base64
 import datetime
+import threading
 from typing import List, Dict, Any, Optional
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
-from googleapiclient.discovery import build
+import httplib2
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from .response_cache import response_cache
+from .message_cache import message_cache
+from .query_cache import query_cache
+from .local_store import local_store
+from .ranker import ranker
+from .column_store import column_store
+from .gmail_query import UnsupportedQuery
+from .quota import quota_scheduler, request_units, units
+from .circuit import breakers, revalidator, is_outage
+from .hedge import hedger
+from . import deadlines, tracing, discovery
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# socket timeout of a gmail call made outside any request deadline
+GMAIL_TIMEOUT = float(os.getenv("GMAIL_TIMEOUT_SECONDS", "30"))
+
+
+def set_timeout(http, seconds: float):
+    """socket timeout for the next call on an authorized http, pooled connections included"""
+    inner = getattr(http, 'http', http)
+    inner.timeout = seconds
+    for connection in getattr(inner, 'connections', {}).values():
+        connection.timeout = seconds
+        if getattr(connection, 'sock', None) is not None:
+            connection.sock.settimeout(seconds)
+
+
+def page_offset(page_token: Optional[str]) -> int:
+    """offset a list page token stands for, ValueError unless it is a non-negative integer"""
+    if not page_token:
+        return 0
+    if not (page_token.isascii() and page_token.isdigit()):
+        raise ValueError(f"invalid page token: {page_token!r}")
+    return int(page_token)
+
+
+def batch_error(exception: Exception) -> Dict[str, Any]:
+    """status and message of one failed call in a batch"""
+    status = getattr(getattr(exception, 'resp', None), 'status', None)
+    if isinstance(exception, KeyError) and exception.args:
+        # a missing id, str() of a KeyError would quote the message
+        return {'code': 404, 'message': str(exception.args[0])}
+    return {'code': int(status or 500), 'message': str(exception)}
 
 
 class GmailService:
@@ -21,7 +68,273 @@ class GmailService:
             client_secret=client_secret,
             scopes=session_data["scopes"]
         )
-        self.service = build('gmail', 'v1', credentials=self.credentials)
+        self.service = discovery.client('gmail', 'v1', credentials=self.credentials)
+        self.user_key = session_data.get("user_id") or session_data.get("email")
+        self._local = threading.local()
+        self._history_id = None
+        # set when a read was answered from cache gmail could not confirm
+        self.stale = False
+        # last outage error seen, routes answer 503 when nothing could be served
+        self.outage: Optional[Exception] = None
+
+    def _http(self):
+        """per-thread authorized http, httplib2 connections are not thread safe"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def _execute(self, request):
+        """execute a gmail api request or batch on the calling thread's http
+
+        fails fast with UpstreamUnavailable while the user's or the global circuit is
+        open, and with RequestAborted once the calling request is out of time or gone.
+        every call is counted in the metrics and the current request's trace
+        """
+        with tracing.gmail_call(request):
+            deadlines.check()
+            breakers.check(self.user_key)
+            quota_scheduler.charge(self.user_key, request_units(request))
+            http = self._http()
+            if http is not None:
+                remaining = deadlines.remaining()
+                set_timeout(http, GMAIL_TIMEOUT if remaining is None else min(remaining, GMAIL_TIMEOUT))
+            try:
+                result = request.execute(http=http)
+            except Exception as e:
+                # a timeout cut short by our own deadline says nothing about gmail
+                if not deadlines.expired():
+                    breakers.record(self.user_key, not is_outage(e))
+                raise
+            breakers.record(self.user_key, True)
+            return result
+
+    def _revalidate(self, key, refresh):
+        """refresh a stale answer in the background once the circuit lets a trial call through"""
+        if breakers.retry_after(self.user_key) == 0:
+            revalidator.submit((self.user_key, key), refresh)
+
+    def _failed(self, e: Exception):
+        if is_outage(e):
+            self.outage = e
+
+    def _on_mutation(self, message_ids: Optional[List[str]] = None,
+                     add_labels: List[str] = None, remove_labels: List[str] = None):
+        """drop cached data that a mailbox change could have made stale
+
+        message_ids=None means any message may have changed, [] means none did.
+        known label changes are applied to the local store, other changes to
+        specific messages drop them from it until they are fetched again.
+        label changes are only passed in once gmail has accepted them
+        """
+        response_cache.invalidate_user(self.user_key)
+        message_cache.invalidate(self.user_key, message_ids)
+        query_cache.mark_stale(self.user_key)
+
+        if message_ids and (add_labels or remove_labels):
+            local_store.update_labels(self.user_key, message_ids, add_labels, remove_labels)
+            column_store.update_labels(self.user_key, message_ids, add_labels, remove_labels)
+        elif message_ids:
+            local_store.remove(self.user_key, message_ids)
+            column_store.remove(self.user_key, message_ids)
+
+    def get_history_id(self, user_id: str = 'me') -> Optional[str]:
+        """current mailbox history id, changes whenever the mailbox does"""
+        try:
+            profile = self._execute(self.service.users().getProfile(userId=user_id))
+            self._history_id = profile.get('historyId')
+            return self._history_id
+        except Exception as e:
+            log.error("error getting history id: %s", e)
+            return None
+
+    def list_history(self, start_history_id: str, user_id: str = 'me'):
+        """history records since start_history_id and the new history id
+
+        returns (None, None) when gmail answers 404, its way of saying the id
+        is too old. every other error is raised, it says nothing about the id
+        """
+        records = []
+        page_token = None
+
+        try:
+            while True:
+                result = self._execute(self.service.users().history().list(
+                    userId=user_id,
+                    startHistoryId=start_history_id,
+                    pageToken=page_token
+                ))
+
+                records.extend(result.get('history', []))
+                page_token = result.get('nextPageToken')
+
+                if not page_token:
+                    return records, result.get('historyId', start_history_id)
+        except Exception as e:
+            if getattr(getattr(e, 'resp', None), 'status', None) != 404:
+                raise
+            log.info("history id %s expired: %s", start_history_id, e)
+            return None, None
+
+    def watch_mailbox(self, topic_name: str, user_id: str = 'me') -> Dict:
+        """ask gmail to publish inbox changes to a pub/sub topic"""
+        return self._execute(self.service.users().watch(
+            userId=user_id,
+            body={'topicName': topic_name, 'labelIds': ['INBOX']}
+        ))
+
+    def get_changes(self, since_history_id: str, user_id: str = 'me') -> Optional[Dict]:
+        """messages added, deleted or relabelled since a history id, net of each other
+
+        returns None when gmail no longer has history that old, the caller
+        then has to re-list
+        """
+        records, history_id = self.list_history(since_history_id, user_id)
+        if records is None:
+            return None
+
+        # last event per message wins, a message added and removed in the window is just deleted
+        added, deleted, labels = {}, set(), {}
+        for record in records:
+            for item in record.get('messagesAdded', []):
+                message = item['message']
+                added[message['id']] = message.get('labelIds', [])
+                deleted.discard(message['id'])
+            for item in record.get('messagesDeleted', []):
+                message_id = item['message']['id']
+                added.pop(message_id, None)
+                labels.pop(message_id, None)
+                deleted.add(message_id)
+            for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                message = item['message']
+                if message['id'] in deleted or 'labelIds' not in message:
+                    continue
+                if message['id'] in added:
+                    added[message['id']] = message['labelIds']
+                else:
+                    labels[message['id']] = message['labelIds']
+
+        return {
+            'history_id': history_id,
+            'added': self.get_emails_metadata(list(added)) if added else [],
+            'deleted': sorted(deleted),
+            'relabelled': [{'id': message_id, 'labels': ids} for message_id, ids in labels.items()]
+        }
+
+    def sync_history(self):
+        """bring cached query results and the local store up to the current mailbox version
+
+        while gmail is failing the caches are served as they are, marked stale,
+        and brought up to date in the background
+        """
+        if breakers.degraded(self.user_key) and self._history_start():
+            self.stale = True
+            self._revalidate('history', self._sync_history)
+            return
+        try:
+            self._sync_history()
+        except Exception as e:
+            log.warning("error syncing history, serving cached results: %s", e)
+            self._failed(e)
+            self.stale = True
+
+    def _history_start(self) -> Optional[str]:
+        """oldest history id a cache needs records from, None when all are current"""
+        starts = []
+        if query_cache.needs_sync(self.user_key):
+            starts.append(query_cache.history_id(self.user_key))
+        if local_store.needs_sync(self.user_key):
+            starts.append(local_store.coverage(self.user_key)['history_id'])
+        if column_store.needs_sync(self.user_key):
+            starts.append(column_store.history_id(self.user_key))
+        starts = [start for start in starts if start]
+        return min(starts, key=int) if starts else None
+
+    def _sync_history(self):
+        start = self._history_start()
+        if not start:
+            return
+
+        # one history call from the oldest version, each cache skips what it has seen
+        records, history_id = self.list_history(start)
+        if records is None:
+            query_cache.invalidate(self.user_key)
+            local_store.drop_coverage(self.user_key)
+            message_cache.invalidate(self.user_key)
+            column_store.reset(self.user_key)
+            return
+
+        # parsed records of messages changed elsewhere are refetched on next read
+        changed = {
+            item['message']['id'] for r in records
+            for item in r.get('labelsAdded', []) + r.get('labelsRemoved', []) + r.get('messagesDeleted', [])
+        }
+        if changed:
+            message_cache.invalidate(self.user_key, changed)
+
+        query_cache.apply_history(self.user_key, records, history_id)
+        column_store.apply_history(self.user_key, records, history_id)
+        if local_store.coverage(self.user_key):
+            added = [item['message']['id'] for r in records for item in r.get('messagesAdded', [])]
+            errors = {}
+            stored = {m['id'] for m in self.get_emails_metadata(added, errors=errors)} if added else set()
+            # new mail has to be stored before coverage moves past it. a 404 is mail
+            # deleted since, any other miss would leave a hole in local answers
+            missing = [m for m in added if m not in stored and errors.get(m, {}).get('code') != 404]
+            if missing:
+                log.warning("dropping local coverage, %d new messages could not be stored", len(missing))
+                local_store.drop_coverage(self.user_key)
+                local_store.apply_history(self.user_key, records)
+            else:
+                local_store.apply_history(self.user_key, records, history_id)
+        else:
+            local_store.apply_history(self.user_key, records)
+
+    def sync_local_store(self, max_messages: int = 2000, user_id: str = 'me') -> int:
+        """store metadata of the newest max_messages messages and record coverage
+
+        afterwards queries whose date window fits the synced range are answered
+        locally. returns the number of messages synced
+        """
+        history_id = self.get_history_id(user_id)
+        if not history_id:
+            return 0
+
+        message_ids = []
+        page_token = None
+        try:
+            while len(message_ids) < max_messages:
+                result = self._execute(self.service.users().messages().list(
+                    userId=user_id,
+                    maxResults=min(500, max_messages - len(message_ids)),
+                    pageToken=page_token,
+                    includeSpamTrash=True
+                ))
+                message_ids.extend(m['id'] for m in result.get('messages', []))
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    break
+        except Exception as e:
+            log.error("error listing messages for sync: %s", e)
+            return 0
+
+        records = self.get_emails_metadata(message_ids)
+        if len(records) < len(message_ids):
+            # a missing message would make local answers silently incomplete
+            return len(records)
+
+        self.list_labels(user_id)
+        since_ms = min((r['internal_date'] for r in records), default=0)
+        local_store.set_coverage(self.user_key, 0 if not page_token else since_ms, not page_token, history_id)
+        return len(records)
+
+    def _search_local(self, query: str, max_results: int) -> Optional[List[Dict]]:
+        """answer from the local store, None when gmail has to"""
+        try:
+            return local_store.query(self.user_key, query, max_results)
+        except UnsupportedQuery:
+            return None
 
     
     def search_emails(self, query: str = '', max_results: int = 200, user_id: str = 'me') -> List[Dict]:
@@ -29,35 +342,100 @@ class GmailService:
         messages = []
         next_page_token = None
         
+        self.sync_history()
+        cached = query_cache.get(self.user_key, query, max_results)
+        if cached is not None:
+            return cached
+
+        local = self._search_local(query, max_results)
+        if local is not None:
+            return local
+
+        # read the version before listing so later deltas are replayed on top
+        history_id = query_cache.history_id(self.user_key) or self._history_id or self.get_history_id()
+
+        # a shorter listing of the query is continued from gmail's token, not listed again
+        partial = query_cache.partial(self.user_key, query)
+        if partial:
+            messages, next_page_token = partial
+        seen = {m['id'] for m in messages}
+
         try:
             while True:
-                result = self.service.users().messages().list(
+                result = self._execute(self.service.users().messages().list(
                     userId=user_id,
                     q=query,
                     maxResults=min(500, max_results - len(messages)) if max_results else 500,
                     pageToken=next_page_token
-                ).execute()
+                ))
                 
-                messages.extend(result.get('messages', []))
+                for message in result.get('messages', []):
+                    if message['id'] not in seen:
+                        seen.add(message['id'])
+                        messages.append(message)
                 
                 next_page_token = result.get('nextPageToken')
                 
                 if not next_page_token or (max_results and len(messages) >= max_results):
                     break
             
+            if history_id:
+                query_cache.put(self.user_key, query, messages, not next_page_token, history_id, next_page_token)
             return messages[:max_results] if max_results else messages
             
         except Exception as e:
-            print(f"error searching emails: {e}")
+            log.error("error searching emails: %s", e)
+            self._failed(e)
             return []
 
+    def rank_emails(self, text: str, query: str = '', top_k: int = 10, mode: str = 'bm25',
+                    max_candidates: int = 500) -> List[Dict]:
+        """stored messages most relevant to free text, best first
+
+        a query narrows the candidates to its gmail matches, without one every
+        stored message outside spam and trash is ranked. candidates that were
+        never fetched are stored from one metadata batch first
+        """
+        candidates = None
+        if query or not local_store.count(self.user_key):
+            candidates = [m['id'] for m in self.search_emails(query, max_candidates)]
+            missing = local_store.missing(self.user_key, candidates)
+            if missing:
+                self.get_emails_metadata(missing)
+
+        ranked = ranker.rank(self.user_key, text, top_k, candidates, mode)
+        scores = dict(ranked)
+        records = local_store.get_many(self.user_key, [message_id for message_id, _ in ranked])
+        for record in records:
+            record['score'] = scores[record['id']]
+        return records
+
+    def cached_page_version(self, query: str = '', page_size: int = 50, page_token: Optional[str] = None) -> Optional[str]:
+        """mailbox version a cached list page reflects once history has been applied
+
+        None when the page isn't cached, then only a real listing can tell
+        """
+        self.sync_history()
+        return query_cache.version(self.user_key, query, page_offset(page_token) + page_size + 1)
+
+    def search_emails_page(self, query: str = '', page_size: int = 50, page_token: Optional[str] = None):
+        """one page of search results and the token of the next page
+
+        tokens are offsets into the cached result list, so later pages of a
+        cached query cost no list calls
+        """
+        offset = page_offset(page_token)
+        messages = self.search_emails(query, offset + page_size + 1)
+        next_page_token = str(offset + page_size) if len(messages) > offset + page_size else None
+        return messages[offset:offset + page_size], next_page_token
+
     def get_email_messages(self, user_id='me', label_ids=None, folder_name='INBOX', max_results=500):
         """get emails from specific folder/labels"""
         messages = []
         next_page_token = None
 
         if folder_name:
-            label_results = self.service.users().labels().list(userId=user_id).execute()
+            label_results = self._execute(self.service.users().labels().list(userId=user_id))
             labels = label_results.get('labels', [])
             folder_label_id = next((label['id'] for label in labels if label['name'].lower() == folder_name.lower()), None)
 
@@ -71,12 +449,12 @@ class GmailService:
         
         try:
             while True:
-                result = self.service.users().messages().list(
+                result = self._execute(self.service.users().messages().list(
                     userId=user_id,
                     labelIds=label_ids,
                     maxResults=min(500, max_results - len(messages)) if max_results else 500,
                     pageToken=next_page_token
-                ).execute()
+                ))
 
                 messages.extend(result.get('messages', []))
                 next_page_token = result.get('nextPageToken')
@@ -87,58 +465,178 @@ class GmailService:
             return messages[:max_results] if max_results else messages
             
         except Exception as e:
-            print(f"error getting email messages: {e}")
+            log.error("error getting email messages: %s", e)
             return []
 
+    def _parse_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """details record of a format=full message"""
+        payload = message['payload']
+        headers = payload.get('headers', [])
+
+        # extract headers
+        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'no subject')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'unknown sender')
+        recipients = next((h['value'] for h in headers if h['name'] == 'To'), 'unknown recipients')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'unknown date')
+        
+        # extract body
+        body = self._extract_body(payload)
+        
+        # check for attachments
+        has_attachments = False
+        if 'parts' in payload:
+            for part in payload['parts']:
+                if part.get('filename'):
+                    has_attachments = True
+                    break
+        
+        # get labels and other metadata
+        labels = message.get('labelIds', [])
+        star = 'STARRED' in labels
+        
+        details = {
+            'id': message['id'],
+            'subject': subject,
+            'sender': sender,
+            'recipients': recipients,
+            'date': date,
+            'body': body,
+            'snippet': message.get('snippet', ''),
+            'has_attachments': has_attachments,
+            'star': star,
+            'labels': labels,
+            'label': ', '.join(labels),
+            'thread_id': message.get('threadId'),
+            'internal_date': int(message.get('internalDate', 0)),
+            'history_id': message.get('historyId'),
+            'size_estimate': message.get('sizeEstimate', 0)
+        }
+        return details
+
+    def _store_details(self, details: Dict[str, Any]):
+        message_cache.put(self.user_key, details['id'], details)
+        local_store.upsert(self.user_key, details)
+        column_store.upsert(self.user_key, [details], self._known_history_id())
+
+    def get_emails_details(self, message_ids: List[str], user_id: str = 'me'):
+        """full details of many emails, cached ones first, the rest from batch requests of 100
+
+        returns (details by id, error by id)
+        """
+        found, errors = {}, {}
+        misses = []
+        for message_id in dict.fromkeys(message_ids):
+            cached = message_cache.get(self.user_key, message_id)
+            if cached is not None:
+                found[message_id] = cached
+            else:
+                misses.append(message_id)
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = batch_error(exception)
+                return
+            details = self._parse_message(response)
+            self._store_details(details)
+            found[request_id] = details
+
+        try:
+            for i in range(0, len(misses), 100):
+                batch = self.service.new_batch_http_request(callback=collect)
+                for message_id in misses[i:i + 100]:
+                    batch.add(
+                        self.service.users().messages().get(userId=user_id, id=message_id, format='full'),
+                        request_id=message_id
+                    )
+                self._execute(batch)
+        except Exception as e:
+            log.error("error getting email details: %s", e)
+            self._failed(e)
+            for message_id in misses:
+                if message_id in found:
+                    continue
+                stale = self._stale_details(message_id) if is_outage(e) else None
+                if stale is not None:
+                    found[message_id] = stale
+                else:
+                    errors.setdefault(message_id, {'code': 503 if is_outage(e) else 502, 'message': str(e)})
+        return found, errors
+
+    def _stale_details(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """last known record of a message for when gmail can't be asked, marks the answer stale"""
+        details = message_cache.get_stale(self.user_key, message_id)
+        if details is None:
+            # stored metadata, without the body
+            rows = local_store.get_many(self.user_key, [message_id])
+            details = rows[0] if rows else None
+        if details is not None:
+            self.stale = True
+        return details
+
     def get_email_details(self, message_id: str, user_id: str = 'me') -> Dict[str, Any]:
+        cached = message_cache.get(self.user_key, message_id)
+        if cached is not None:
+            return cached
+
+        if breakers.degraded(self.user_key):
+            stale = self._stale_details(message_id)
+            if stale is not None:
+                self._revalidate(('message', message_id), lambda: self._fetch_details(message_id, user_id))
+                return stale
+
+        try:
+            # slow reads get a backup call while quota and the circuit allow it
+            return hedger.call(
+                lambda: self._fetch_details(message_id, user_id),
+                lambda: not breakers.degraded(self.user_key)
+                and quota_scheduler.allows(self.user_key, units('messages.get'))
+            )
+        except deadlines.RequestAborted:
+            raise
+        except Exception as e:
+            log.error("error getting email details: %s", e)
+            self._failed(e)
+            return (self._stale_details(message_id) if is_outage(e) else None) or {}
+
+    def current_email_details(self, message_id: str, user_id: str = 'me') -> Dict[str, Any]:
+        """details of an email that gmail still has at the same version
+
+        a cached record is checked with a format=minimal get, one quota
+        unit, and fetched again when the message's history id moved. when
+        gmail can't be asked the cached record is returned marked stale
+        """
+        if message_cache.get(self.user_key, message_id) is None:
+            return self.get_email_details(message_id, user_id)
         try:
-            message = self.service.users().messages().get(
+            minimal = self._execute(self.service.users().messages().get(
                 userId=user_id,
                 id=message_id,
-                format='full'
-            ).execute()
-            
-            payload = message['payload']
-            headers = payload.get('headers', [])
-
-            # extract headers
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'no subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'unknown sender')
-            recipients = next((h['value'] for h in headers if h['name'] == 'To'), 'unknown recipients')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'unknown date')
-            
-            # extract body
-            body = self._extract_body(payload)
-            
-            # check for attachments
-            has_attachments = False
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part.get('filename'):
-                        has_attachments = True
-                        break
-            
-            # get labels and other metadata
-            labels = message.get('labelIds', [])
-            star = 'STARRED' in labels
-            
-            return {
-                'id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'recipients': recipients,
-                'date': date,
-                'body': body,
-                'snippet': message.get('snippet', ''),
-                'has_attachments': has_attachments,
-                'star': star,
-                'labels': labels,
-                'label': ', '.join(labels)
-            }
-            
+                format='minimal'
+            ))
         except Exception as e:
-            print(f"error getting email details: {e}")
-            return {}
+            if batch_error(e)['code'] == 404:
+                message_cache.invalidate(self.user_key, [message_id])
+                return {}
+            log.warning("error checking message version, serving cached record: %s", e)
+            self._failed(e)
+            self.stale = True
+            return self.get_email_details(message_id, user_id)
+
+        details = self.get_email_details(message_id, user_id)
+        if details.get('history_id') != minimal.get('historyId'):
+            message_cache.invalidate(self.user_key, [message_id])
+            details = self.get_email_details(message_id, user_id)
+        return details
+
+    def _fetch_details(self, message_id: str, user_id: str = 'me') -> Dict[str, Any]:
+        message = self._execute(self.service.users().messages().get(
+            userId=user_id,
+            id=message_id,
+            format='full'
+        ))
+        details = self._parse_message(message)
+        self._store_details(details)
+        return details
 
     def _extract_body(self, payload):
         """extract email body from payload"""
@@ -162,14 +660,14 @@ class GmailService:
             today = datetime.date.today()
             query = f"after:{today.strftime('%Y/%m/%d')}"
             
-            results = self.service.users().messages().list(
+            results = self._execute(self.service.users().messages().list(
                 userId=user_id,
                 q=query
-            ).execute()
+            ))
             
             return results.get('resultSizeEstimate', 0)
         except Exception as e:
-            print(f"error counting today's emails: {e}")
+            log.error("error counting today's emails: %s", e)
             return 0
 
     def count_emails_this_week(self, user_id: str = 'me') -> int:
@@ -178,14 +676,14 @@ class GmailService:
             start_of_week = today - datetime.timedelta(days=today.weekday())
             query = f"after:{start_of_week.strftime('%Y/%m/%d')}"
             
-            results = self.service.users().messages().list(
+            results = self._execute(self.service.users().messages().list(
                 userId=user_id,
                 q=query
-            ).execute()
+            ))
             
             return results.get('resultSizeEstimate', 0)
         except Exception as e:
-            print(f"error counting this week's emails: {e}")
+            log.error("error counting this week's emails: %s", e)
             return 0
 
     def count_emails_this_month(self, user_id: str = 'me') -> int:
@@ -194,14 +692,14 @@ class GmailService:
             start_of_month = today.replace(day=1)
             query = f"after:{start_of_month.strftime('%Y/%m/%d')}"
             
-            results = self.service.users().messages().list(
+            results = self._execute(self.service.users().messages().list(
                 userId=user_id,
                 q=query
-            ).execute()
+            ))
             
             return results.get('resultSizeEstimate', 0)
         except Exception as e:
-            print(f"error counting this month's emails: {e}")
+            log.error("error counting this month's emails: %s", e)
             return 0
 
     def get_email_stats_summary(self, user_id: str = 'me') -> Dict[str, int]:
@@ -216,27 +714,27 @@ class GmailService:
             }
             
             # get unread count
-            unread_results = self.service.users().messages().list(
+            unread_results = self._execute(self.service.users().messages().list(
                 userId=user_id,
                 q='is:unread'
-            ).execute()
+            ))
             stats['unread'] = unread_results.get('resultSizeEstimate', 0)
             
             # get emails with attachments
-            attachment_results = self.service.users().messages().list(
+            attachment_results = self._execute(self.service.users().messages().list(
                 userId=user_id,
                 q='has:attachment'
-            ).execute()
+            ))
             stats['with_attachments'] = attachment_results.get('resultSizeEstimate', 0)
             
             # get total count
-            total_results = self.service.users().messages().list(userId=user_id).execute()
+            total_results = self._execute(self.service.users().messages().list(userId=user_id))
             stats['total'] = total_results.get('resultSizeEstimate', 0)
             
             return stats
             
         except Exception as e:
-            print(f"error getting email stats: {e}")
+            log.error("error getting email stats: %s", e)
             return {
                 'today': 0,
                 'this_week': 0,
@@ -247,14 +745,54 @@ class GmailService:
             }
 
     
+    def _known_history_id(self) -> Optional[str]:
+        """latest mailbox version seen without asking gmail, None if there is none"""
+        return query_cache.history_id(self.user_key) or self._history_id
+
     def list_labels(self, user_id: str = 'me') -> List[Dict]:
+        version = self._known_history_id()
+        if version:
+            cached = response_cache.get(self.user_key, version, 'labels')
+            if cached is not None:
+                return cached
+
+        generation = response_cache.generation(self.user_key)
         try:
-            results = self.service.users().labels().list(userId=user_id).execute()
-            return results.get('labels', [])
+            results = self._execute(self.service.users().labels().list(userId=user_id))
+            labels = results.get('labels', [])
+            local_store.set_label_names(self.user_key, labels)
+            if version:
+                response_cache.put(self.user_key, version, 'labels', labels, generation)
+            return labels
         except Exception as e:
-            print(f"error listing labels: {e}")
+            log.error("error listing labels: %s", e)
             return []
 
+    def get_mailbox_counts(self, user_id: str = 'me') -> Dict[str, int]:
+        """total messages and threads from the profile, inbox totals from its label"""
+        version = self._known_history_id()
+        if version:
+            cached = response_cache.get(self.user_key, version, 'counts')
+            if cached is not None:
+                return cached
+
+        generation = response_cache.generation(self.user_key)
+        try:
+            profile = self._execute(self.service.users().getProfile(userId=user_id))
+            inbox = self._execute(self.service.users().labels().get(userId=user_id, id='INBOX'))
+            self._history_id = profile.get('historyId')
+            counts = {
+                'messages_total': profile.get('messagesTotal', 0),
+                'threads_total': profile.get('threadsTotal', 0),
+                'inbox_total': inbox.get('messagesTotal', 0),
+                'inbox_unread': inbox.get('messagesUnread', 0)
+            }
+            response_cache.put(self.user_key, self._history_id, 'counts', counts, generation)
+            return counts
+        except Exception as e:
+            log.error("error getting mailbox counts: %s", e)
+            return {'messages_total': 0, 'threads_total': 0, 'inbox_total': 0, 'inbox_unread': 0}
+
     def get_labels(self) -> List[Dict]:
         """alias for list_labels for compatibility"""
         return self.list_labels()
@@ -267,26 +805,30 @@ class GmailService:
                 'labelListVisibility': label_list_visibility,
                 'messageListVisibility': message_list_visibility
             }
-            created_label = self.service.users().labels().create(userId=user_id, body=label).execute()
+            created_label = self._execute(self.service.users().labels().create(userId=user_id, body=label))
             return created_label
         except Exception as e:
-            print(f"error creating label: {e}")
+            log.error("error creating label: %s", e)
             return None
+        finally:
+            self._on_mutation([])
 
     def get_label_details(self, label_id: str, user_id: str = 'me'):
         try:
-            return self.service.users().labels().get(userId=user_id, id=label_id).execute()
+            return self._execute(self.service.users().labels().get(userId=user_id, id=label_id))
         except Exception as e:
-            print(f"error getting label details: {e}")
+            log.error("error getting label details: %s", e)
             return None
 
     def delete_label(self, label_id: str, user_id: str = 'me'):
         try:
-            self.service.users().labels().delete(userId=user_id, id=label_id).execute()
+            self._execute(self.service.users().labels().delete(userId=user_id, id=label_id))
             return True
         except Exception as e:
-            print(f"error deleting label: {e}")
+            log.error("error deleting label: %s", e)
             return False
+        finally:
+            self._on_mutation()
 
     def map_label_name_to_id(self, label_name: str, user_id: str = 'me'):
         """get label id from label name"""
@@ -295,34 +837,40 @@ class GmailService:
             label = next((label for label in labels if label['name'] == label_name), None)
             return label['id'] if label else None
         except Exception as e:
-            print(f"error mapping label name to id: {e}")
+            log.error("error mapping label name to id: %s", e)
             return None
 
     
     def trash_email(self, message_id: str, user_id: str = 'me') -> bool:
         try:
-            self.service.users().messages().trash(userId=user_id, id=message_id).execute()
+            self._execute(self.service.users().messages().trash(userId=user_id, id=message_id))
+            self._on_mutation([message_id], add_labels=['TRASH'])
             return True
         except Exception as e:
-            print(f"error trashing email: {e}")
+            log.error("error trashing email: %s", e)
+            self._on_mutation([message_id])
             return False
 
     def untrash_email(self, message_id: str, user_id: str = 'me') -> bool:
         try:
-            self.service.users().messages().untrash(userId=user_id, id=message_id).execute()
+            self._execute(self.service.users().messages().untrash(userId=user_id, id=message_id))
             return True
         except Exception as e:
-            print(f"error untrashing email: {e}")
+            log.error("error untrashing email: %s", e)
             return False
+        finally:
+            self._on_mutation([message_id])
 
     def delete_email(self, message_id: str, user_id: str = 'me') -> bool:
         """permanently delete email"""
         try:
-            self.service.users().messages().delete(userId=user_id, id=message_id).execute()
+            self._execute(self.service.users().messages().delete(userId=user_id, id=message_id))
             return True
         except Exception as e:
-            print(f"error deleting email: {e}")
+            log.error("error deleting email: %s", e)
             return False
+        finally:
+            self._on_mutation([message_id])
 
     def modify_email_labels(self, message_id: str, add_labels: List[str] = None, 
                            remove_labels: List[str] = None, user_id: str = 'me'):
@@ -333,23 +881,25 @@ class GmailService:
 
             if add_labels:
                 for batch in batch_labels(add_labels):
-                    self.service.users().messages().modify(
+                    self._execute(self.service.users().messages().modify(
                         userId=user_id,
                         id=message_id,
                         body={'addLabelIds': batch}
-                    ).execute()
+                    ))
 
             if remove_labels:
                 for batch in batch_labels(remove_labels):
-                    self.service.users().messages().modify(
+                    self._execute(self.service.users().messages().modify(
                         userId=user_id,
                         id=message_id,
                         body={'removeLabelIds': batch}
-                    ).execute()
+                    ))
             
+            self._on_mutation([message_id], add_labels=add_labels, remove_labels=remove_labels)
             return True
         except Exception as e:
-            print(f"error modifying email labels: {e}")
+            log.error("error modifying email labels: %s", e)
+            self._on_mutation([message_id])
             return False
 
     
@@ -386,15 +936,17 @@ class GmailService:
             
             raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
 
-            sent_message = self.service.users().messages().send(
+            sent_message = self._execute(self.service.users().messages().send(
                 userId=user_id,
                 body={'raw': raw_message}
-            ).execute()
+            ))
 
             return sent_message
         except Exception as e:
-            print(f"error sending email: {e}")
+            log.error("error sending email: %s", e)
             return None
+        finally:
+            self._on_mutation([])
 
     
     def search_email_conversations(self, query: str, max_results: int = 5, user_id: str = 'me'):
@@ -403,12 +955,12 @@ class GmailService:
 
         try:
             while True:
-                result = self.service.users().threads().list(
+                result = self._execute(self.service.users().threads().list(
                     userId=user_id,
                     q=query,
                     maxResults=min(500, max_results - len(conversations)) if max_results else 500,
                     pageToken=next_page_token
-                ).execute()
+                ))
                 
                 conversations.extend(result.get('threads', []))
                 next_page_token = result.get('nextPageToken')
@@ -418,25 +970,25 @@ class GmailService:
             
             return conversations[:max_results] if max_results else conversations
         except Exception as e:
-            print(f"error searching conversations: {e}")
+            log.error("error searching conversations: %s", e)
             return []
 
     def get_message_and_replies(self, message_id: str, user_id: str = 'me'):
         try:
             # get thread id from message
-            message = self.service.users().messages().get(
+            message = self._execute(self.service.users().messages().get(
                 userId=user_id,
                 id=message_id,
                 format='full'            
-            ).execute()
+            ))
             thread_id = message['threadId']
 
             # get the whole thread
-            thread = self.service.users().threads().get(
+            thread = self._execute(self.service.users().threads().get(
                 userId=user_id,
                 id=thread_id,
                 format='minimal'        
-            ).execute()
+            ))
 
             processed_messages = []
             for msg in thread.get('messages', []):
@@ -457,31 +1009,168 @@ class GmailService:
 
             return processed_messages
         except Exception as e:
-            print(f"error getting message and replies: {e}")
+            log.error("error getting message and replies: %s", e)
             return []
 
     
-    def batch_trash_emails(self, message_ids: List[str], user_id: str = 'me'):
+    def batch_trash_emails(self, message_ids: List[str], user_id: str = 'me',
+                           errors: Optional[Dict[str, Dict]] = None) -> bool:
+        """move many emails to trash in batch requests of 100
+
+        true when every id was trashed, failed ids are reported in errors when a dict is passed
+        """
+        return self._batch_each('trash', message_ids, user_id, errors, add_labels=['TRASH'])
+
+    def batch_untrash_emails(self, message_ids: List[str], user_id: str = 'me',
+                             errors: Optional[Dict[str, Dict]] = None) -> bool:
+        return self._batch_each('untrash', message_ids, user_id, errors, remove_labels=['TRASH'])
+
+    def _batch_each(self, method: str, message_ids: List[str], user_id: str,
+                    errors: Optional[Dict[str, Dict]], add_labels: List[str] = None,
+                    remove_labels: List[str] = None) -> bool:
+        """one messages.<method> call per id in batches of 100, with per-id results"""
+        unique_ids = list(dict.fromkeys(message_ids))
+        done, failed = [], {}
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = batch_error(exception)
+            else:
+                done.append(request_id)
+
         try:
-            batch = self.service.new_batch_http_request()
-            for message_id in message_ids:
-                batch.add(self.service.users().messages().trash(userId=user_id, id=message_id))
-            batch.execute()
-            return True
+            # gmail caps a batch request at 100 calls
+            for i in range(0, len(unique_ids), 100):
+                batch = self.service.new_batch_http_request(callback=collect)
+                for message_id in unique_ids[i:i + 100]:
+                    call = getattr(self.service.users().messages(), method)
+                    batch.add(call(userId=user_id, id=message_id), request_id=message_id)
+                self._execute(batch)
         except Exception as e:
-            print(f"error batch trashing emails: {e}")
-            return False
+            log.error("error batch %s emails: %s", method, e)
+            self._failed(e)
+            # ids without an answer may or may not have changed
+            answered = set(done) | set(failed)
+            unknown = [m for m in unique_ids if m not in answered]
+            for message_id in unknown:
+                failed[message_id] = {'code': 503 if is_outage(e) else 502, 'message': str(e)}
+            self._on_mutation(unknown)
+
+        if done:
+            self._on_mutation(done, add_labels=add_labels, remove_labels=remove_labels)
+        if errors is not None:
+            errors.update(failed)
+        return not failed
+
+    def batch_modify_emails(self, message_ids: List[str], add_labels: List[str] = None,
+                            remove_labels: List[str] = None, user_id: str = 'me',
+                            errors: Optional[Dict[str, Dict]] = None) -> bool:
+        """add or remove labels on many emails with messages.batchModify
 
-    def batch_untrash_emails(self, message_ids: List[str], user_id: str = 'me'):
+        a failed call fails all of its ids and stops the rest, they are
+        reported in errors when a dict is passed
+        """
+        unique_ids = list(dict.fromkeys(message_ids))
+        body = {}
+        if add_labels:
+            body['addLabelIds'] = add_labels
+        if remove_labels:
+            body['removeLabelIds'] = remove_labels
+
+        done = 0
         try:
-            batch = self.service.new_batch_http_request()
-            for message_id in message_ids:
-                batch.add(self.service.users().messages().untrash(userId=user_id, id=message_id))
-            batch.execute()
+            # batchModify accepts up to 1000 ids per call
+            for i in range(0, len(unique_ids), 1000):
+                self._execute(self.service.users().messages().batchModify(
+                    userId=user_id,
+                    body={'ids': unique_ids[i:i + 1000], **body}
+                ))
+                done = i + len(unique_ids[i:i + 1000])
             return True
         except Exception as e:
-            print(f"error batch untrashing emails: {e}")
+            log.error("error batch modifying emails: %s", e)
+            self._failed(e)
+            if errors is not None:
+                error = batch_error(e)
+                errors.update({message_id: error for message_id in unique_ids[done:]})
+            # the failed call may have been applied in part
+            self._on_mutation(unique_ids[done:])
             return False
+        finally:
+            if done:
+                self._on_mutation(unique_ids[:done], add_labels=add_labels, remove_labels=remove_labels)
+
+    def get_emails_metadata(self, message_ids: List[str], user_id: str = 'me',
+                            errors: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """get headers and labels for many emails in one batch request, indexing them locally
+
+        failed ids are left out, or reported in errors when a dict is passed
+        """
+        results = {}
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                if errors is not None:
+                    errors[request_id] = batch_error(exception)
+                return
+            headers = response.get('payload', {}).get('headers', [])
+            results[request_id] = {
+                'id': response['id'],
+                'subject': next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'no subject'),
+                'sender': next((h['value'] for h in headers if h['name'].lower() == 'from'), 'unknown sender'),
+                'recipients': next((h['value'] for h in headers if h['name'].lower() == 'to'), 'unknown recipients'),
+                'date': next((h['value'] for h in headers if h['name'].lower() == 'date'), 'unknown date'),
+                'snippet': response.get('snippet', ''),
+                'labels': response.get('labelIds', []),
+                'thread_id': response.get('threadId'),
+                'internal_date': int(response.get('internalDate', 0)),
+                'history_id': response.get('historyId'),
+                'size_estimate': response.get('sizeEstimate', 0)
+            }
+            local_store.upsert(self.user_key, results[request_id])
+
+        # batch request ids must be unique
+        unique_ids = list(dict.fromkeys(message_ids))
+
+        try:
+            for i in range(0, len(unique_ids), 100):
+                batch = self.service.new_batch_http_request(callback=collect)
+                for message_id in unique_ids[i:i + 100]:
+                    batch.add(
+                        self.service.users().messages().get(
+                            userId=user_id,
+                            id=message_id,
+                            format='metadata',
+                            metadataHeaders=['Subject', 'From', 'To', 'Date']
+                        ),
+                        request_id=message_id
+                    )
+                self._execute(batch)
+                column_store.upsert(
+                    self.user_key, [results[m] for m in unique_ids[i:i + 100] if m in results], self._known_history_id()
+                )
+
+            return [results[message_id] for message_id in message_ids if message_id in results]
+        except Exception as e:
+            log.error("error getting email metadata: %s", e)
+            return []
+
+    def get_emails_summaries(self, message_ids: List[str], user_id: str = 'me'):
+        """metadata of many emails, stored rows first, the rest from one batch
+
+        returns (summary by id, error by id)
+        """
+        unique_ids = list(dict.fromkeys(message_ids))
+        found = {row['id']: row for row in local_store.get_many(self.user_key, unique_ids)}
+        misses = [m for m in unique_ids if m not in found]
+        errors = {}
+        if misses:
+            for record in self.get_emails_metadata(misses, user_id, errors):
+                found[record['id']] = record
+            for message_id in misses:
+                if message_id not in found:
+                    errors.setdefault(message_id, {'code': 502, 'message': 'metadata unavailable'})
+        return found, errors
 
     def empty_trash(self, user_id: str = 'me'):
         page_token = None
@@ -489,12 +1178,12 @@ class GmailService:
 
         try:
             while True:
-                response = self.service.users().messages().list(
+                response = self._execute(self.service.users().messages().list(
                     userId=user_id,
                     q='in:trash',
                     pageToken=page_token,
                     maxResults=500
-                ).execute()
+                ))
 
                 messages = response.get('messages', [])
                 if not messages:
@@ -503,7 +1192,7 @@ class GmailService:
                 batch = self.service.new_batch_http_request()
                 for message in messages:
                     batch.add(self.service.users().messages().delete(userId=user_id, id=message['id']))
-                batch.execute()
+                self._execute(batch)
 
                 total_deleted += len(messages)
                 page_token = response.get('nextPageToken')
@@ -513,5 +1202,7 @@ class GmailService:
 
             return total_deleted
         except Exception as e:
-            print(f"error emptying trash: {e}")
+            log.error("error emptying trash: %s", e)
             return 0
+        finally:
+            self._on_mutation()
@@ -5,6 +5,9 @@ simplified version of the main gmail_interact.py
 import base64
 import datetime
 from typing import List, Dict, Any
+from .log import get_logger
+
+log = get_logger(__name__)
 
 def extract_body(payload):
     body = '<Text body not available>'
@@ -31,7 +34,7 @@ def search_emails(service, query: str = '', max_results: int = 10) -> List[Dict]
         messages = results.get('messages', [])
         return messages
     except Exception as e:
-        print(f"An error occurred in search_emails: {e}")
+        log.error("An error occurred in search_emails: %s", e)
         return []
 
 def get_email_message_details(service, message_id: str) -> Dict[str, Any]:
@@ -76,7 +79,7 @@ def get_email_message_details(service, message_id: str) -> Dict[str, Any]:
         }
         
     except Exception as e:
-        print(f"An error occurred in get_email_message_details: {e}")
+        log.error("An error occurred in get_email_message_details: %s", e)
         return {}
 
 def list_labels(service) -> List[Dict]:
@@ -85,7 +88,7 @@ def list_labels(service) -> List[Dict]:
         labels = results.get('labels', [])
         return labels
     except Exception as e:
-        print(f"An error occurred in list_labels: {e}")
+        log.error("An error occurred in list_labels: %s", e)
         return []
 
 def trash_email(service, user_id: str, message_id: str) -> bool:
@@ -96,7 +99,7 @@ def trash_email(service, user_id: str, message_id: str) -> bool:
         ).execute()
         return True
     except Exception as e:
-        print(f"An error occurred in trash_email: {e}")
+        log.error("An error occurred in trash_email: %s", e)
         return False
 
 def count_emails_today(service) -> int:
@@ -111,7 +114,7 @@ def count_emails_today(service) -> int:
         
         return results.get('resultSizeEstimate', 0)
     except Exception as e:
-        print(f"An error occurred in count_emails_today: {e}")
+        log.error("An error occurred in count_emails_today: %s", e)
         return 0
 
 def count_emails_this_week(service) -> int:
@@ -127,7 +130,7 @@ def count_emails_this_week(service) -> int:
         
         return results.get('resultSizeEstimate', 0)
     except Exception as e:
-        print(f"An error occurred in count_emails_this_week: {e}")
+        log.error("An error occurred in count_emails_this_week: %s", e)
         return 0
 
 def count_emails_this_month(service) -> int:
@@ -143,7 +146,7 @@ def count_emails_this_month(service) -> int:
         
         return results.get('resultSizeEstimate', 0)
     except Exception as e:
-        print(f"An error occurred in count_emails_this_month: {e}")
+        log.error("An error occurred in count_emails_this_month: %s", e)
         return 0
 
 def get_email_stats_summary(service) -> Dict[str, int]:
@@ -178,7 +181,7 @@ def get_email_stats_summary(service) -> Dict[str, int]:
         return stats
         
     except Exception as e:
-        print(f"An error occurred in get_email_stats_summary: {e}")
+        log.error("An error occurred in get_email_stats_summary: %s", e)
         return {
             'today': 0,
             'this_week': 0,
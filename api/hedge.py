@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional
+from . import deadlines
+
+
+class Hedger:
+    """duplicates slow reads to cut tail latency
+
+    a call that has not finished by the percentile latency of recent calls
+    gets one identical backup call, whichever answers first wins. reads are
+    only hedged once min_samples latencies are known and while allowed()
+    says the extra call is affordable. a disabled hedger just makes the call
+    """
+
+    def __init__(self, enabled: bool = True, percentile: float = 95.0, min_samples: int = 20,
+                 window: int = 200, min_delay: float = 0.05, max_workers: int = 8):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._metrics = {'calls': 0, 'hedged': 0, 'hedge_won': 0}
+
+    def delay(self) -> Optional[float]:
+        """seconds to wait before hedging, None until enough calls were seen"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+        return max(ordered[index], self.min_delay)
+
+    def _timed(self, read: Callable[[], Any]):
+        start = time.perf_counter()
+        result = read()
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _submit(self, read: Callable[[], Any]):
+        # the request's deadline travels with the call
+        context = contextvars.copy_context()
+        return self._pool.submit(context.run, self._timed, read)
+
+    def call(self, read: Callable[[], Any], allowed: Callable[[], bool] = lambda: True) -> Any:
+        if not self.enabled:
+            return read()
+        with self._lock:
+            self._metrics['calls'] += 1
+        delay = self.delay()
+        if delay is None:
+            return self._timed(read)
+
+        primary = self._submit(read)
+        remaining = deadlines.remaining()
+        done, _ = wait([primary], timeout=delay if remaining is None else min(delay, max(remaining, 0)))
+        if done or not allowed():
+            return primary.result()
+
+        with self._lock:
+            self._metrics['hedged'] += 1
+        backup = self._submit(read)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, timeout=deadlines.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                deadlines.check()
+                continue
+            # both can finish in one wait, any success wins over a failure
+            for future in sorted(done, key=lambda f: f is backup):
+                if future.exception() is None:
+                    if future is backup:
+                        with self._lock:
+                            self._metrics['hedge_won'] += 1
+                    return future.result()
+        # both calls failed, the primary's error is the one the caller would have seen
+        return primary.result()
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        with self._lock:
+            return dict(self._metrics, enabled=self.enabled, delay_ms=round(delay * 1000, 1) if delay is not None else None)
+
+
+# off unless HEDGE_READS is set, every hedge costs a second gmail call
+hedger = Hedger(
+    enabled=os.getenv("HEDGE_READS", "").lower() in ("1", "true", "yes"),
+    percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+    min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+)
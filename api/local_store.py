@@ -0,0 +1,409 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import deque
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable, List, Optional
+from .gmail_query import UnsupportedQuery, compile_query, lower_date_bound
+
+SCHEMA = """
+create table if not exists messages (
+    user text not null,
+    id text not null,
+    thread_id text,
+    subject text,
+    sender text,
+    sender_address text,
+    recipients text,
+    date text,
+    internal_date integer,
+    snippet text,
+    body text,
+    labels text,
+    has_attachments integer,
+    history_id text,
+    size_estimate integer,
+    primary key (user, id)
+);
+create table if not exists message_labels (
+    user text not null,
+    id text not null,
+    label text not null,
+    primary key (user, id, label)
+);
+create table if not exists label_names (
+    user text not null,
+    name text not null,
+    id text not null,
+    primary key (user, name)
+);
+create table if not exists coverage (
+    user text primary key,
+    since_ms integer not null,
+    complete integer not null,
+    history_id text not null,
+    synced_at real not null
+);
+create index if not exists idx_messages_sender on messages (user, sender_address);
+create index if not exists idx_messages_date on messages (user, internal_date);
+create index if not exists idx_message_labels_label on message_labels (user, label);
+create virtual table if not exists messages_fts using fts5(
+    subject, sender, recipients, body, tokenize = 'unicode61'
+);
+"""
+
+# bm25 column weights: subject, sender, recipients, body
+FTS_WEIGHTS = (5.0, 3.0, 1.0, 1.0)
+
+# text columns, a rewrite that leaves these alone is only a label change
+TEXT_COLUMNS = ("subject", "sender", "recipients", "snippet", "body")
+# changes remembered per user for derived indexes to catch up from
+JOURNAL_SIZE = 10000
+
+RESULT_COLUMNS = "m.id, m.thread_id, m.subject, m.sender, m.recipients, m.date, m.internal_date, m.snippet, m.labels, m.has_attachments"
+
+
+class LocalStore:
+    """sqlite copy of the messages this process has fetched
+
+    holds one row per (user, message) with the parsed fields, a label table
+    and an fts5 index over subject, sender, recipients and body, so mail
+    that was already seen can be searched without gmail. rows are added as
+    get_email_details caches them and kept current from history deltas.
+
+    a sync records coverage: every message newer than since_ms (or all of
+    them when complete) is stored as of history_id. gmail queries whose
+    date window lies inside the coverage are answered from the store.
+    """
+
+    def __init__(self, path: str = ":memory:", sync_interval: float = 5.0):
+        self.sync_interval = sync_interval
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # bumped whenever a user's stored text or labels change, with a journal of
+        # (version, kind, ids) so derived indexes can apply the change instead of rebuilding
+        self._versions: Dict[str, int] = {}
+        self._journal: Dict[str, deque] = {}
+        with self._lock:
+            self._db.executescript(SCHEMA)
+
+    def version(self, user: str) -> int:
+        return self._versions.get(user, 0)
+
+    def _bump(self, user: str, kind: str, ids: Iterable[str] = ()):
+        """record a change, kind is text, labels, removed or reset (every row of the user)"""
+        version = self._versions.get(user, 0) + 1
+        self._versions[user] = version
+        journal = self._journal.setdefault(user, deque(maxlen=JOURNAL_SIZE))
+        if kind == 'reset':
+            journal.clear()
+        journal.append((version, kind, tuple(ids)))
+
+    def changes(self, user: str, since: int) -> Optional[List[tuple]]:
+        """(version, kind, ids) entries after version since, None when the journal can't tell
+
+        a reset or entries that fell off the journal leave only a rebuild
+        """
+        with self._lock:
+            journal = list(self._journal.get(user, ()))
+        entries = [entry for entry in journal if entry[0] > since]
+        if since < self._versions.get(user, 0) and (not entries or entries[0][0] != since + 1):
+            return None
+        if any(kind == 'reset' for _, kind, _ in entries):
+            return None
+        return entries
+
+    def upsert(self, user: str, record: Dict[str, Any]):
+        """add or refresh a parsed message record, a record without body keeps the stored one"""
+        if 'body' not in record:
+            with self._lock:
+                row = self._db.execute(
+                    "select body from messages where user = ? and id = ?", (user, record['id'])
+                ).fetchone()
+            record = {**record, 'body': row[0] if row else ''}
+
+        labels = list(record.get('labels', []))
+        values = (
+            record.get('thread_id'),
+            record.get('subject', ''),
+            record.get('sender', ''),
+            parseaddr(record.get('sender', ''))[1].lower(),
+            record.get('recipients', ''),
+            record.get('date', ''),
+            int(record.get('internal_date') or 0),
+            record.get('snippet', ''),
+            record.get('body', ''),
+            ",".join(labels),
+            int(bool(record.get('has_attachments'))),
+            record.get('history_id'),
+            int(record.get('size_estimate') or 0),
+        )
+
+        with self._lock, self._db:
+            row = self._db.execute(
+                f"select rowid, labels, {', '.join(TEXT_COLUMNS)} from messages where user = ? and id = ?",
+                (user, record['id'])
+            ).fetchone()
+            if row:
+                rowid = row[0]
+                text_changed = tuple(row[c] or '' for c in TEXT_COLUMNS) != tuple(
+                    record.get(c) or '' for c in TEXT_COLUMNS)
+                self._db.execute(
+                    """update messages set thread_id = ?, subject = ?, sender = ?, sender_address = ?,
+                       recipients = ?, date = ?, internal_date = ?, snippet = ?, body = ?, labels = ?,
+                       has_attachments = ?, history_id = ?, size_estimate = ? where rowid = ?""",
+                    values + (rowid,)
+                )
+                self._db.execute("delete from messages_fts where rowid = ?", (rowid,))
+            else:
+                rowid = self._db.execute(
+                    """insert into messages (user, id, thread_id, subject, sender, sender_address, recipients,
+                       date, internal_date, snippet, body, labels, has_attachments, history_id, size_estimate)
+                       values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (user, record['id']) + values
+                ).lastrowid
+                text_changed = True
+
+            self._db.execute(
+                "insert into messages_fts (rowid, subject, sender, recipients, body) values (?, ?, ?, ?, ?)",
+                (rowid, record.get('subject', ''), record.get('sender', ''),
+                 record.get('recipients', ''), record.get('body', ''))
+            )
+            self._set_labels(user, record['id'], labels)
+            if text_changed:
+                self._bump(user, 'text', [record['id']])
+            elif row['labels'] != ",".join(labels):
+                self._bump(user, 'labels', [record['id']])
+
+    def remove(self, user: str, message_ids: Optional[Iterable[str]] = None):
+        """drop messages of a user, all of them when ids is None"""
+        with self._lock, self._db:
+            if message_ids is None:
+                rowids = [r[0] for r in self._db.execute("select rowid from messages where user = ?", (user,))]
+                self._db.execute("delete from message_labels where user = ?", (user,))
+            else:
+                ids = list(message_ids)
+                rowids = [r[0] for r in self._db.execute(
+                    f"select rowid from messages where user = ? and id in ({_marks(ids)})", [user] + ids
+                )]
+                self._db.execute(
+                    f"delete from message_labels where user = ? and id in ({_marks(ids)})", [user] + ids
+                )
+
+            for rowid in rowids:
+                self._db.execute("delete from messages_fts where rowid = ?", (rowid,))
+                self._db.execute("delete from messages where rowid = ?", (rowid,))
+            if rowids and message_ids is None:
+                self._bump(user, 'reset')
+            elif rowids:
+                self._bump(user, 'removed', ids)
+
+    def update_labels(self, user: str, message_ids: Iterable[str], add: List[str] = None, remove: List[str] = None):
+        """apply a label change made through the api to stored rows"""
+        changed = []
+        with self._lock, self._db:
+            for message_id in message_ids:
+                row = self._db.execute(
+                    "select labels from messages where user = ? and id = ?", (user, message_id)
+                ).fetchone()
+                if row is None:
+                    continue
+                labels = [l for l in row[0].split(",") if l and l not in (remove or [])]
+                labels += [l for l in (add or []) if l not in labels]
+                self._write_labels(user, message_id, labels)
+                changed.append(message_id)
+            if changed:
+                self._bump(user, 'labels', changed)
+
+    def apply_history(self, user: str, records: List[Dict[str, Any]], history_id: Optional[str] = None):
+        """keep stored rows in step with history.list records
+
+        records the coverage already includes are skipped. new messages are
+        not in the records' payload, the caller fetches and upserts those
+        """
+        coverage = self.coverage(user)
+        if coverage:
+            records = [r for r in records if int(r['id']) > int(coverage['history_id'])]
+
+        deleted = [item['message']['id'] for r in records for item in r.get('messagesDeleted', [])]
+        if deleted:
+            self.remove(user, deleted)
+
+        with self._lock, self._db:
+            relabelled = []
+            for record in records:
+                for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    message = item['message']
+                    if 'labelIds' in message and self._write_labels(user, message['id'], message['labelIds']):
+                        relabelled.append(message['id'])
+            if relabelled:
+                self._bump(user, 'labels', relabelled)
+
+            if coverage and history_id:
+                self._db.execute(
+                    "update coverage set history_id = ?, synced_at = ? where user = ?",
+                    (history_id, time.time(), user)
+                )
+
+    def set_coverage(self, user: str, since_ms: int, complete: bool, history_id: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "insert or replace into coverage (user, since_ms, complete, history_id, synced_at) values (?, ?, ?, ?, ?)",
+                (user, since_ms, int(complete), history_id, time.time())
+            )
+
+    def drop_coverage(self, user: str):
+        with self._lock, self._db:
+            self._db.execute("delete from coverage where user = ?", (user,))
+
+    def coverage(self, user: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("select * from coverage where user = ?", (user,)).fetchone()
+        return dict(row) if row else None
+
+    def needs_sync(self, user: str) -> bool:
+        coverage = self.coverage(user)
+        return bool(coverage) and time.time() - coverage['synced_at'] >= self.sync_interval
+
+    def set_label_names(self, user: str, labels: List[Dict[str, Any]]):
+        """remember label name -> id so label: queries resolve locally"""
+        with self._lock, self._db:
+            self._db.execute("delete from label_names where user = ?", (user,))
+            self._db.executemany(
+                "insert or replace into label_names (user, name, id) values (?, ?, ?)",
+                [(user, label['name'].lower(), label['id']) for label in labels]
+            )
+
+    def query(self, user: str, query: str, limit: int = 100, now_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+        """answer a gmail search from the store, newest first
+
+        raises UnsupportedQuery when an operator can't be evaluated locally or
+        the query's date window reaches past the synced coverage
+        """
+        coverage = self.coverage(user)
+        if not coverage:
+            raise UnsupportedQuery("mailbox not synced")
+
+        with self._lock:
+            label_names = {r[0]: r[1] for r in self._db.execute(
+                "select name, id from label_names where user = ?", (user,)
+            )}
+        where, params, node = compile_query(query, label_names, now_ms)
+
+        if not coverage['complete']:
+            bound = lower_date_bound(node, now_ms)
+            if bound is None or bound < coverage['since_ms']:
+                raise UnsupportedQuery("query reaches past the synced window")
+
+        with self._lock:
+            rows = self._db.execute(
+                f"""select m.id, m.thread_id from messages m
+                    where m.user = ? and ({where})
+                    order by m.internal_date desc limit ?""",
+                [user] + params + [limit or -1]
+            ).fetchall()
+        return [{'id': row['id'], 'threadId': row['thread_id']} for row in rows]
+
+    def search(self, user: str, text: str, limit: int = 20, include_spam_trash: bool = False) -> List[Dict[str, Any]]:
+        """full text search over stored messages, best bm25 match first"""
+        match = fts_query(text)
+        if not match:
+            return []
+
+        exclude = "" if include_spam_trash else """
+            and not exists (select 1 from message_labels l
+                            where l.user = m.user and l.id = m.id and l.label in ('TRASH', 'SPAM'))"""
+        with self._lock:
+            rows = self._db.execute(
+                f"""select {RESULT_COLUMNS}, bm25(messages_fts, ?, ?, ?, ?) as score
+                    from messages_fts join messages m on m.rowid = messages_fts.rowid
+                    where messages_fts match ? and m.user = ? {exclude}
+                    order by score limit ?""",
+                FTS_WEIGHTS + (match, user, limit)
+            ).fetchall()
+        return [row_to_result(row) for row in rows]
+
+    def documents(self, user: str, message_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """id, labels and indexed text of every stored message, or of the given ids"""
+        ids = "" if message_ids is None else f"and id in ({_marks(message_ids)})"
+        with self._lock:
+            rows = self._db.execute(
+                f"""select id, labels, subject, sender, recipients, snippet, body
+                    from messages where user = ? {ids} order by rowid""", [user] + list(message_ids or [])
+            ).fetchall()
+        return [row_to_result(row) for row in rows]
+
+    def get_many(self, user: str, message_ids: List[str]) -> List[Dict[str, Any]]:
+        """stored rows for ids in the given order, unknown ids are skipped"""
+        if not message_ids:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"select {RESULT_COLUMNS} from messages m where m.user = ? and m.id in ({_marks(message_ids)})",
+                [user] + list(message_ids)
+            ).fetchall()
+        by_id = {row['id']: row_to_result(row) for row in rows}
+        return [by_id[i] for i in message_ids if i in by_id]
+
+    def missing(self, user: str, message_ids: List[str]) -> List[str]:
+        """ids from the list that are not stored yet"""
+        if not message_ids:
+            return []
+        with self._lock:
+            stored = {r[0] for r in self._db.execute(
+                f"select id from messages where user = ? and id in ({_marks(message_ids)})",
+                [user] + list(message_ids)
+            )}
+        return [i for i in message_ids if i not in stored]
+
+    def count(self, user: str) -> int:
+        with self._lock:
+            return self._db.execute("select count(*) from messages where user = ?", (user,)).fetchone()[0]
+
+    def _write_labels(self, user: str, message_id: str, labels: List[str]) -> bool:
+        """store a message's labels, False when the message isn't stored"""
+        updated = self._db.execute(
+            "update messages set labels = ? where user = ? and id = ?", (",".join(labels), user, message_id)
+        ).rowcount
+        if updated:
+            self._set_labels(user, message_id, labels)
+        return bool(updated)
+
+    def _set_labels(self, user: str, message_id: str, labels: List[str]):
+        self._db.execute("delete from message_labels where user = ? and id = ?", (user, message_id))
+        self._db.executemany(
+            "insert or ignore into message_labels (user, id, label) values (?, ?, ?)",
+            [(user, message_id, label) for label in labels]
+        )
+
+
+def fts_query(text: str) -> str:
+    """turn free text into an fts5 query, every word required, last one as a prefix"""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+def row_to_result(row: sqlite3.Row) -> Dict[str, Any]:
+    result = dict(row)
+    result['labels'] = [l for l in (result.get('labels') or "").split(",") if l]
+    result['has_attachments'] = bool(result.get('has_attachments'))
+    if 'score' in result:
+        # bm25 is lower-is-better, flip it so bigger means more relevant
+        result['score'] = -result['score']
+    return result
+
+
+def _marks(values: List[Any]) -> str:
+    return ", ".join("?" for _ in values) or "null"
+
+
+local_store = LocalStore(
+    os.getenv("LOCAL_STORE_PATH", ":memory:"),
+    sync_interval=float(os.getenv("LOCAL_STORE_SYNC_INTERVAL", "5"))
+)
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Tuple
+
+# every module logs under the package logger, so one handler covers api/
+PACKAGE = __name__.rsplit(".", 1)[0]
+
+
+class ErrorSampler(logging.Filter):
+    """lets through the first burst warnings or errors of a message per window
+
+    records are keyed by logger, level and the unformatted message, so
+    "error searching emails: %s" failing for every request of an outage is
+    logged burst times a window, and the next one through carries how many
+    were dropped in between. below warning nothing is sampled
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        # key -> [window start, seen in window, suppressed in window]
+        self._seen: Dict[Tuple[str, int, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                if len(self._seen) >= 1000:
+                    self._prune(now)
+                self._seen[key] = [now, 1, 0]
+                return True
+            state[1] += 1
+            if state[1] <= self.burst:
+                return True
+            state[2] += 1
+            return False
+
+    def _prune(self, now: float):
+        for key in [k for k, s in self._seen.items() if now - s[0] >= self.window]:
+            del self._seen[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'messages': len(self._seen), 'suppressed': sum(s[2] for s in self._seen.values())}
+
+
+class ContextFilter(logging.Filter):
+    """stamps records with the trace id of the request they were logged in"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # imported here, tracing's own imports log through this module
+        from . import tracing
+        trace = tracing.current()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """hands records to the writer thread and never waits on a full queue, it drops instead"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # format in the caller, args and tracebacks may not survive the thread hop
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """one json object per line: ts, level, logger, msg, then trace id and fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key in ('trace_id', 'suppressed'):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """human readable lines for local development"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = dict(getattr(record, 'fields', None) or {})
+        for key in ('trace_id', 'suppressed'):
+            if hasattr(record, key):
+                extras[key] = getattr(record, key)
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return line
+
+
+def fields(**values) -> Dict[str, Dict]:
+    """structured fields for a record, log.info("...", extra=fields(user=...))"""
+    return {'fields': values}
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def _configure() -> Tuple[NonBlockingQueueHandler, ErrorSampler, QueueListener]:
+    """route the package logger through a bounded queue to a single writer thread
+
+    callers, including the event loop, only pay for formatting the message
+    and a put_nowait, the stream write happens on the listener's thread
+    """
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if os.getenv("LOG_FORMAT", "json") == "json" else TextFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    sampler = ErrorSampler(
+        burst=int(os.getenv("LOG_SAMPLE_BURST", "10")),
+        window=float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "60"))
+    )
+    handler.addFilter(sampler)
+    handler.addFilter(ContextFilter())
+
+    logger = logging.getLogger(PACKAGE)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.addHandler(handler)
+    # uvicorn configures the root logger, don't write every record twice
+    logger.propagate = False
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    # flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    return handler, sampler, listener
+
+
+handler, sampler, listener = _configure()
+
+
+def stats() -> Dict[str, int]:
+    return dict(sampler.stats(), dropped=handler.dropped, queued=handler.queue.qsize())
@@ -0,0 +1,205 @@
+import os
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+from .log import get_logger
+
+log = get_logger(__name__)
+
+
+class Notifier:
+    """tells watchers when a user's mailbox may have changed
+
+    a watcher awaits wait() between history checks. notify() wakes the
+    user's watcher early, it is what a pub/sub push handler calls
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._events: Dict[str, asyncio.Event] = {}
+
+    def _event(self, user_key: str) -> asyncio.Event:
+        if user_key not in self._events:
+            self._events[user_key] = asyncio.Event()
+        return self._events[user_key]
+
+    async def wait(self, user_key: str):
+        """return when the mailbox should be checked again"""
+        event = self._event(user_key)
+        try:
+            await asyncio.wait_for(event.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    def register(self, gmail_service):
+        """subscribe the mailbox upstream, called once per watcher from a worker thread"""
+
+    def notify(self, user_key: str, history_id: Optional[str] = None):
+        self._event(user_key).set()
+
+    def forget(self, user_key: str):
+        self._events.pop(user_key, None)
+
+
+class PollingNotifier(Notifier):
+    """local stand-in for gmail push: check every few seconds"""
+
+    def __init__(self, interval: float = 15.0):
+        super().__init__(interval)
+
+
+class PubSubNotifier(Notifier):
+    """gmail users.watch notifications delivered to the push route
+
+    polls only rarely as a safety net, real changes arrive through notify()
+    """
+
+    def __init__(self, topic: str, interval: float = 300.0):
+        super().__init__(interval)
+        self.topic = topic
+
+    def register(self, gmail_service):
+        # gmail drops a watch after 7 days, every new watcher renews it
+        gmail_service.watch_mailbox(self.topic)
+
+
+def make_notifier() -> Notifier:
+    kind = os.getenv("MAIL_NOTIFIER", "poll")
+    if kind == "pubsub":
+        return PubSubNotifier(os.environ["GMAIL_PUBSUB_TOPIC"], float(os.getenv("MAIL_NOTIFIER_INTERVAL", "300")))
+    if kind == "poll":
+        return PollingNotifier(float(os.getenv("MAIL_NOTIFIER_INTERVAL", "15")))
+    raise ValueError(f"unknown MAIL_NOTIFIER: {kind}")
+
+
+def change_event(changes: Dict[str, Any]) -> Dict[str, Any]:
+    """compact push payload, enough for a list view to update in place"""
+    return {
+        'type': 'changes',
+        'history_id': changes['history_id'],
+        'added': [
+            {key: m.get(key) for key in ('id', 'thread_id', 'subject', 'sender', 'date', 'snippet', 'labels')}
+            for m in changes['added']
+        ],
+        'deleted': changes['deleted'],
+        'relabelled': changes['relabelled']
+    }
+
+
+class MailWatcher:
+    """one background history poll per user, fanned out to every open socket"""
+
+    def __init__(self, user_key: str, gmail_service, notifier: Notifier):
+        self.user_key = user_key
+        self.gmail_service = gmail_service
+        self.notifier = notifier
+        self.history_id: Optional[str] = None
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.polls = 0
+        self.events = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.notifier.forget(self.user_key)
+
+    def publish(self, event: Dict[str, Any]):
+        for queue in self.subscribers:
+            if queue.full():
+                # a stalled tab gets a reset instead of an ever growing backlog
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'type': 'reset', 'history_id': event.get('history_id')})
+            else:
+                queue.put_nowait(event)
+
+    async def _run(self):
+        # blocking google calls run on worker threads, the event loop stays free
+        self.history_id = await asyncio.to_thread(self.gmail_service.get_history_id)
+        try:
+            await asyncio.to_thread(self.notifier.register, self.gmail_service)
+        except Exception as e:
+            log.warning("error registering mailbox watch, polling only: %s", e)
+        while True:
+            await self.notifier.wait(self.user_key)
+            try:
+                await self.check()
+            except Exception as e:
+                log.error("error checking mailbox changes: %s", e)
+
+    async def check(self):
+        if not self.history_id:
+            self.history_id = await asyncio.to_thread(self.gmail_service.get_history_id)
+            return
+
+        self.polls += 1
+        changes = await asyncio.to_thread(self.gmail_service.get_changes, self.history_id)
+        if changes is None:
+            # history expired, clients re-list from scratch
+            self.history_id = await asyncio.to_thread(self.gmail_service.get_history_id)
+            self.publish({'type': 'reset', 'history_id': self.history_id})
+            return
+
+        self.history_id = changes['history_id']
+        if changes['added'] or changes['deleted'] or changes['relabelled']:
+            self.events += 1
+            self.publish(change_event(changes))
+
+
+class WatcherRegistry:
+    """watchers keyed by user, started with the first socket and stopped with the last"""
+
+    def __init__(self, notifier: Notifier, queue_size: int = 100):
+        self.notifier = notifier
+        self.queue_size = queue_size
+        self._watchers: Dict[str, MailWatcher] = {}
+        # push notifications name the mailbox by address
+        self._emails: Dict[str, str] = {}
+
+    def subscribe(self, user_key: str, gmail_service, email: Optional[str] = None) -> asyncio.Queue:
+        watcher = self._watchers.get(user_key)
+        if watcher is None:
+            watcher = self._watchers[user_key] = MailWatcher(user_key, gmail_service, self.notifier)
+            watcher.start()
+        if email:
+            self._emails[email.lower()] = user_key
+        queue = asyncio.Queue(self.queue_size)
+        watcher.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, user_key: str, queue: asyncio.Queue):
+        watcher = self._watchers.get(user_key)
+        if watcher is None:
+            return
+        watcher.subscribers.discard(queue)
+        if not watcher.subscribers:
+            watcher.stop()
+            del self._watchers[user_key]
+            self._emails = {e: u for e, u in self._emails.items() if u != user_key}
+
+    def notify(self, user_key: str, history_id: Optional[str] = None):
+        if user_key in self._watchers:
+            self.notifier.notify(user_key, history_id)
+
+    def notify_email(self, email: str, history_id: Optional[str] = None):
+        user_key = self._emails.get(email.lower())
+        if user_key:
+            self.notify(user_key, history_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'notifier': type(self.notifier).__name__,
+            'watchers': len(self._watchers),
+            'subscribers': sum(len(w.subscribers) for w in self._watchers.values()),
+            'polls': sum(w.polls for w in self._watchers.values()),
+            'events': sum(w.events for w in self._watchers.values())
+        }
+
+
+watchers = WatcherRegistry(make_notifier())
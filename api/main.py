@@ -7,9 +7,37 @@ load_dotenv(env_path)
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse, FileResponse
+from fastapi import Request
 
-app = FastAPI(title="gmail ai assistant api", version="1.0.0")
+# discovery documents are parsed and the agent warmed before the first request needs them
+from .startup import lifespan
+app = FastAPI(title="gmail ai assistant api", version="1.0.0", lifespan=lifespan)
+
+# compress large json bodies, added first so it wraps only the app, cors stays outermost
+from .responses import CompressionMiddleware
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024")))
+
+# deadline per request, cancelled when the client disconnects
+from .deadlines import DeadlineMiddleware, RequestAborted, aborted_response
+app.add_middleware(
+    DeadlineMiddleware,
+    timeout=float(os.getenv("REQUEST_TIMEOUT_SECONDS", "30")),
+    overrides={
+        "/api/gmail/chat": float(os.getenv("CHAT_TIMEOUT_SECONDS", "120")),
+        "/api/gmail/local/sync": float(os.getenv("SYNC_TIMEOUT_SECONDS", "300")),
+    }
+)
+app.add_exception_handler(RequestAborted, aborted_response)
+
+# sampling profiler for requests carrying PROFILE_TOKEN, inside tracing so profiles are named by trace id
+from .profiler import ProfilerMiddleware, profile_store, authorized, FORMATS
+app.add_middleware(ProfilerMiddleware, store=profile_store,
+                   interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000)
+
+# trace id, server-timing and request metrics, outside the deadline so aborted requests count too
+from .tracing import TracingMiddleware
+app.add_middleware(TracingMiddleware)
 
 # cors middleware
 app.add_middleware(
@@ -24,9 +52,46 @@ app.add_middleware(
 async def root():
     return {"message": "gmail ai assistant api working"}
 
+from .metrics import registry
+from .message_cache import message_cache
+from .query_cache import query_cache
+from .response_cache import response_cache
+
+CACHES = {"messages": message_cache, "queries": query_cache, "responses": response_cache}
+
+def _cache_stat(field: str):
+    return lambda: [({"cache": name}, cache.stats()[field]) for name, cache in CACHES.items()]
+
+registry.collect("cache_hits_total", "cache hits by cache", "counter", _cache_stat("hits"))
+registry.collect("cache_misses_total", "cache misses by cache", "counter", _cache_stat("misses"))
+registry.collect("cache_hit_ratio", "hits over lookups since start by cache", "gauge", _cache_stat("hit_ratio"))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """prometheus scrape endpoint, bearer METRICS_TOKEN required when set"""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(401, "metrics token required")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+async def get_profile(profile_id: str, request: Request, format: str = "speedscope", profile: str = None):
+    """profile artifact of a request run with the profile token, speedscope json or folded stacks"""
+    if not authorized(request.headers.get("x-profile") or profile):
+        raise HTTPException(404, "not found")
+    if format not in FORMATS:
+        raise HTTPException(400, f"format must be one of: {', '.join(FORMATS)}")
+    path = profile_store.path(profile_id, format)
+    if not path:
+        raise HTTPException(404, "profile not found")
+    media_type = "application/json" if format == "speedscope" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
 # import auth service after dotenv is loaded
-from .auth import AuthService
-auth_service = AuthService()
+from .auth import get_auth_service
+from .gmail_service import GmailService
+from .warmup import warmup
+auth_service = get_auth_service()
 
 @app.get("/api/auth/oauth-url")
 async def get_oauth_url():
@@ -46,6 +111,11 @@ async def handle_oauth_callback(code: str = None, error: str = None):
     
     try:
         session_token = await auth_service.handle_oauth_callback(code)
+        
+        # fill caches for the first page view while the browser follows the redirect
+        session_data = await auth_service.validate_session(session_token)
+        warmup.start(GmailService(session_data, auth_service.client_id, auth_service.client_secret))
+        
         return RedirectResponse(url=f"http://localhost:5173/mail?token={session_token}")
     except Exception as e:
         raise HTTPException(500, f"oauth callback failed: {str(e)}")
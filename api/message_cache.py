@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# rough per-entry cost of the dict, key tuple and bookkeeping
+ENTRY_OVERHEAD_BYTES = 400
+
+
+def record_size(record: Dict[str, Any]) -> int:
+    """approximate memory held by a parsed message record"""
+    size = ENTRY_OVERHEAD_BYTES
+    for key, value in record.items():
+        size += len(key)
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, (list, tuple)):
+            size += sum(len(v) if isinstance(v, str) else 8 for v in value)
+        else:
+            size += sys.getsizeof(value)
+    return size
+
+
+class MessageCache:
+    """memory bounded lru + ttl cache of parsed message records
+
+    keyed by (user, message_id). entries are evicted least recently used
+    first once the byte budget is exceeded, and expire after ttl_seconds.
+    expired entries stay readable through get_stale until evicted.
+    callers get a copy so shared records can't be mutated in place.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user: str, message_id: str) -> Optional[Dict[str, Any]]:
+        key = (user, message_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                # kept for get_stale until evicted or replaced
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return _copy(entry[2])
+
+    def get_stale(self, user: str, message_id: str) -> Optional[Dict[str, Any]]:
+        """the entry even if expired, for answering while gmail can't be reached"""
+        with self._lock:
+            entry = self._entries.get((user, message_id))
+            return _copy(entry[2]) if entry is not None else None
+
+    def contains(self, user: str, message_id: str) -> bool:
+        """whether a fresh entry exists, without touching hit stats or lru order"""
+        with self._lock:
+            entry = self._entries.get((user, message_id))
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def put(self, user: str, message_id: str, record: Dict[str, Any]):
+        key = (user, message_id)
+        size = record_size(record)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, _copy(record))
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, user: str, message_ids: Optional[Iterable[str]] = None):
+        """drop the given messages of a user, or all of them when ids is None"""
+        with self._lock:
+            if message_ids is None:
+                keys = [key for key in self._entries if key[0] == user]
+            else:
+                keys = [(user, message_id) for message_id in message_ids]
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+    def _remove(self, key: Tuple[str, str]):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+def _copy(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: list(v) if isinstance(v, list) else v for k, v in record.items()}
+
+
+# shared by the routes and the agent tools
+message_cache = MessageCache(
+    max_bytes=int(os.getenv("MESSAGE_CACHE_BYTES", str(64 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("MESSAGE_CACHE_TTL", "300"))
+)
@@ -0,0 +1,183 @@
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# seconds, from a cached answer to a slow batch
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """a named family of samples keyed by label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per bucket counts, then sum
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+
+    def samples(self) -> List[Sample]:
+        result = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    result.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+                result.append((f"{self.name}_count", labels, cumulative))
+                result.append((f"{self.name}_sum", labels, total))
+        return result
+
+
+class Collected(Metric):
+    """values read at scrape time from a callback returning (labels, value) pairs
+
+    for numbers other modules already keep, like cache hit counts
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 read: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.read = read
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, labels, value) for labels, value in self.read()]
+
+
+class Registry:
+    """metrics of the process in the prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self, name: str, documentation: str, kind: str, read) -> Collected:
+        return self.register(Collected(name, documentation, kind, read))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                log.error("error collecting metric %s: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "http requests by route, method and status", ("route", "method", "status"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "http request latency by route", ("route",))
+gmail_calls = registry.counter(
+    "gmail_calls_total", "gmail api calls by calling route, method and status", ("route", "method", "status"))
+gmail_latency = registry.histogram(
+    "gmail_call_duration_seconds", "gmail api call latency by method", ("method",))
+gmail_calls_per_request = registry.histogram(
+    "gmail_calls_per_request", "gmail api calls made while serving one request", ("route",), COUNT_BUCKETS)
+quota_units = registry.counter(
+    "gmail_quota_units_total", "gmail quota units spent by calling route", ("route",))
+llm_calls = registry.counter(
+    "llm_calls_total", "llm calls by tier, model and status", ("tier", "model", "status"))
+llm_latency = registry.histogram(
+    "llm_call_duration_seconds", "llm call latency by tier and model", ("tier", "model"))
+llm_tokens = registry.counter(
+    "llm_tokens_total", "llm tokens by tier, model and kind (prompt or completion)", ("tier", "model", "kind"))
@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import threading
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from . import tracing
+
+
+# words that usually mean the agent has to change the mailbox or plan several steps
+# matched as whole words, "labels" in "what labels do I have" is a read
+MUTATION_WORDS = ("delete", "trash", "archive", "label", "move", "mark", "clean", "unsubscribe", "organize", "organise")
+PLANNING_WORDS = ("all", "every", "then", "summarize", "summarise", "compare", "draft", "reply", "why")
+MUTATION_PATTERN = re.compile(r"\b(?:" + "|".join(MUTATION_WORDS) + r")\b")
+PLANNING_PATTERN = re.compile(r"\b(?:" + "|".join(PLANNING_WORDS) + r")\b")
+
+
+class TierMetricsHandler(BaseCallbackHandler):
+    """records latency and token usage of every llm call for one tier
+
+    attached to each llm the router builds, so every call also lands in the
+    prometheus metrics and the trace of the request that made it
+    """
+
+    def __init__(self, router: "ModelRouter", tier: str, model: str):
+        self.router = router
+        self.tier = tier
+        self.model = model
+        self._started: Dict[Any, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        latency = time.perf_counter() - started if started else 0.0
+
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+
+        self.router.record(self.tier, self.model, latency, prompt_tokens, completion_tokens)
+        tracing.record_llm_call(self.tier, self.model, latency, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        self.router.record_error(self.tier, self.model)
+        tracing.record_llm_call(self.tier, self.model, time.perf_counter() - started if started else 0.0,
+                                status="error")
+
+
+class ModelRouter:
+    """picks a model tier per request and builds llms with fallbacks
+
+    tiers map to an ordered list of model names, the first is the primary
+    and the rest are fallbacks tried when it errors. the default factory
+    builds ChatOpenAI, offline runs pass their own.
+    """
+
+    def __init__(self, tiers: Optional[Dict[str, List[str]]] = None, llm_factory=None,
+                 strong_threshold: int = 2):
+        self.tiers = tiers or {
+            "fast": _model_list("AGENT_FAST_MODELS", "gpt-4o-mini"),
+            "strong": _model_list("AGENT_STRONG_MODELS", "gpt-4o,gpt-4o-mini")
+        }
+        self.llm_factory = llm_factory or default_llm_factory
+        self.strong_threshold = strong_threshold
+        self._llms: Dict[str, Any] = {}
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def choose_tier(self, user_input: str) -> str:
+        """score query complexity and tool needs, strong tier above the threshold"""
+        if "strong" not in self.tiers:
+            return "fast"
+        if "fast" not in self.tiers:
+            return "strong"
+
+        text = user_input.lower()
+        score = 0
+        if MUTATION_PATTERN.search(text):
+            score += 2
+        if PLANNING_PATTERN.search(text):
+            score += 1
+        if len(text.split()) > 25:
+            score += 1
+        if text.count("?") > 1 or " and " in text:
+            score += 1
+
+        return "strong" if score >= self.strong_threshold else "fast"
+
+    def get_llm(self, tier: str):
+        """llm for a tier, primary model wrapped with its fallbacks"""
+        with self._lock:
+            if tier not in self._llms:
+                models = self.tiers[tier]
+                llms = [
+                    self.llm_factory(model, callbacks=[TierMetricsHandler(self, tier, model)])
+                    for model in models
+                ]
+                self._llms[tier] = llms[0].with_fallbacks(llms[1:]) if len(llms) > 1 else llms[0]
+            return self._llms[tier]
+
+    def record(self, tier: str, model: str, latency: float, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            stats = self._tier_stats(tier)
+            stats["calls"] += 1
+            stats["latency_seconds"] += latency
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["models"][model] = stats["models"].get(model, 0) + 1
+
+    def record_error(self, tier: str, model: str):
+        with self._lock:
+            self._tier_stats(tier)["errors"] += 1
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for tier, stats in self._metrics.items():
+                result[tier] = {
+                    **stats,
+                    "models": dict(stats["models"]),
+                    "avg_latency_seconds": stats["latency_seconds"] / stats["calls"] if stats["calls"] else 0.0
+                }
+            return result
+
+    def _tier_stats(self, tier: str) -> Dict[str, Any]:
+        return self._metrics.setdefault(tier, {
+            "calls": 0,
+            "errors": 0,
+            "latency_seconds": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "models": {}
+        })
+
+
+def _model_list(env_name: str, default: str) -> List[str]:
+    return [m.strip() for m in os.getenv(env_name, default).split(",") if m.strip()]
+
+
+def default_llm_factory(model: str, callbacks=None):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model, temperature=0, callbacks=callbacks)
+
+
+# shared router so metrics cover every agent in the process
+model_router = ModelRouter()
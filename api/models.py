@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class UserInfo(BaseModel):
@@ -34,3 +34,33 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     action_taken: Optional[str] = None
+
+class MessageSummary(BaseModel):
+    id: str
+    thread_id: Optional[str] = None
+    subject: str = ""
+    sender: str = ""
+    recipients: str = ""
+    date: str = ""
+    internal_date: int = 0
+    snippet: str = ""
+    labels: List[str] = []
+    has_attachments: bool = False
+    star: bool = False
+    size_estimate: int = 0
+
+class MessageDetail(MessageSummary):
+    body: str = ""
+    history_id: Optional[str] = None
+
+class MessageListResponse(BaseModel):
+    messages: List[Dict[str, Any]]
+    total_count: int
+    next_page_token: Optional[str] = None
+    # served from cache while gmail was unreachable
+    stale: bool = False
+
+class BatchGetRequest(BaseModel):
+    ids: List[str]
+    format: str = "full"
+    fields: Optional[str] = None
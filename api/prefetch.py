@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from .quota import quota_scheduler, units
+from .message_cache import message_cache
+from .local_store import local_store
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# labels that make a row likely to be opened next
+LIKELY_OPENED = ('UNREAD', 'STARRED')
+
+
+class Prefetcher:
+    """speculative background fetches for the messages route
+
+    after a list page is served it lists the next page and fetches full
+    bodies of the unread or starred rows on the current one. a call is only
+    made while the quota scheduler has headroom, and the job stops as soon as
+    the user has been idle for idle_seconds. prefetched keys are remembered so later requests
+    count as hits, keys never asked for within waste_after count as waste
+    """
+
+    def __init__(self, bodies: int = 5, idle_seconds: float = 30.0, waste_after: float = 300.0,
+                 max_workers: int = 2):
+        self.bodies = bodies
+        self.idle_seconds = idle_seconds
+        self.waste_after = waste_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._last_seen: Dict[str, float] = {}
+        self._prefetched: Dict[Tuple[str, str, str], float] = {}
+        self._metrics = {'pages': 0, 'messages': 0, 'hits': 0, 'wasted': 0, 'cancelled': 0, 'throttled': 0}
+
+    def touch(self, user: str):
+        with self._lock:
+            self._last_seen[user] = time.monotonic()
+
+    def _idle(self, user: str) -> bool:
+        return time.monotonic() - self._last_seen.get(user, 0) > self.idle_seconds
+
+    def _count(self, metric: str, n: int = 1):
+        with self._lock:
+            self._metrics[metric] += n
+
+    def record_page(self, user: str, query: str, page_token: Optional[str]):
+        """a list page was requested, a hit if it was prefetched"""
+        self._record(user, ('page', user, f"{query}\x00{page_token}"))
+
+    def record_message(self, user: str, message_id: str):
+        """a message was opened, a hit if its body was prefetched"""
+        self._record(user, ('message', user, message_id))
+
+    def _record(self, user: str, key: Tuple[str, str, str]):
+        self.touch(user)
+        with self._lock:
+            if self._prefetched.pop(key, None) is not None:
+                self._metrics['hits'] += 1
+            self._sweep()
+
+    def _remember(self, key: Tuple[str, str, str]):
+        with self._lock:
+            self._prefetched[key] = time.monotonic()
+
+    def _sweep(self):
+        cutoff = time.monotonic() - self.waste_after
+        expired = [key for key, at in self._prefetched.items() if at < cutoff]
+        for key in expired:
+            del self._prefetched[key]
+        self._metrics['wasted'] += len(expired)
+
+    def _may_call(self, user: str, method: str, count: int = 1) -> bool:
+        """idle sessions cancel the job, missing headroom skips the call"""
+        if self._idle(user):
+            self._count('cancelled')
+            raise _Cancelled()
+        if not quota_scheduler.allows(user, units(method, count)):
+            self._count('throttled')
+            return False
+        return True
+
+    def schedule(self, gmail_service, query: str, page_size: int, next_page_token: Optional[str],
+                 message_ids: List[str]):
+        self.touch(gmail_service.user_key)
+        self._pool.submit(self._run, gmail_service, query, page_size, next_page_token, message_ids)
+
+    def _run(self, gmail_service, query: str, page_size: int, next_page_token: Optional[str],
+             message_ids: List[str]):
+        try:
+            self._prefetch_bodies(gmail_service, message_ids)
+            if next_page_token:
+                self._prefetch_page(gmail_service, query, page_size, next_page_token)
+        except _Cancelled:
+            pass
+        except Exception as e:
+            log.error("error prefetching: %s", e)
+
+    def _prefetch_bodies(self, gmail_service, message_ids: List[str]):
+        user = gmail_service.user_key
+        # labels come from stored metadata, unknown rows cost one metadata call each
+        unknown = local_store.missing(user, message_ids)
+        for i in range(0, len(unknown), 20):
+            chunk = unknown[i:i + 20]
+            if not self._may_call(user, 'messages.get', len(chunk)):
+                break
+            gmail_service.get_emails_metadata(chunk)
+
+        rows = local_store.get_many(user, message_ids)
+        likely = [
+            row['id'] for row in rows
+            if any(label in row['labels'] for label in LIKELY_OPENED)
+            and not message_cache.contains(user, row['id'])
+        ]
+        for message_id in likely[:self.bodies]:
+            if not self._may_call(user, 'messages.get'):
+                return
+            if gmail_service.get_email_details(message_id):
+                self._remember(('message', user, message_id))
+                self._count('messages')
+
+    def _prefetch_page(self, gmail_service, query: str, page_size: int, page_token: str):
+        user = gmail_service.user_key
+        if not self._may_call(user, 'messages.list'):
+            return
+        gmail_service.search_emails_page(query, page_size, page_token)
+        self._remember(('page', user, f"{query}\x00{page_token}"))
+        self._count('pages')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep()
+            metrics = dict(self._metrics, pending=len(self._prefetched))
+        used = metrics['hits'] + metrics['wasted']
+        metrics['hit_ratio'] = round(metrics['hits'] / used, 3) if used else None
+        return metrics
+
+
+class _Cancelled(Exception):
+    pass
+
+
+prefetcher = Prefetcher(
+    bodies=int(os.getenv("PREFETCH_BODIES", "5")),
+    idle_seconds=float(os.getenv("PREFETCH_IDLE_SECONDS", "30")),
+    waste_after=float(os.getenv("PREFETCH_WASTE_AFTER", "300"))
+)
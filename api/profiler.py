@@ -0,0 +1,239 @@
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from collections import Counter
+from urllib.parse import unquote
+from typing import Any, Dict, List, Optional, Tuple
+from . import tracing
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# python frames threads sit in while they have nothing to do
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+PROFILE_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+FORMATS = {"speedscope": "speedscope.json", "collapsed": "collapsed.txt"}
+
+Frame = Tuple[str, str, int]
+
+
+def _stack(frame) -> Tuple[Frame, ...]:
+    """root first (function, file, first line) tuples of a thread's current stack"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def _idle(stack: Tuple[Frame, ...]) -> bool:
+    if not stack:
+        return True
+    name, filename, _ = stack[-1]
+    return (os.path.basename(filename), name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """wall clock sampler of every python thread's stack
+
+    a daemon thread reads sys._current_frames() every interval seconds.
+    threads that were idle in every sample are left out, so the result is
+    the request's own threads plus whatever else was running at the time
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, Counter] = {}
+        self.started = 0.0
+        self.duration = 0.0
+        self._busy: Dict[str, bool] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = names.get(ident, str(ident))
+                stack = _stack(frame)
+                self.samples.setdefault(name, Counter())[stack] += 1
+                self._busy[name] = self._busy.get(name, False) or not _idle(stack)
+
+    def threads(self) -> Dict[str, Counter]:
+        return {name: stacks for name, stacks in self.samples.items() if self._busy.get(name)}
+
+
+def to_speedscope(name: str, threads: Dict[str, Counter], interval: float) -> Dict[str, Any]:
+    """speedscope file with one sampled profile per thread, weights in milliseconds"""
+    frames: List[Dict[str, Any]] = []
+    index: Dict[Frame, int] = {}
+    profiles = []
+    for thread, stacks in sorted(threads.items()):
+        samples, weights = [], []
+        for stack, count in stacks.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(round(count * interval * 1000, 3))
+        profiles.append({
+            'type': 'sampled',
+            'name': thread,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': round(sum(weights), 3),
+            'samples': samples,
+            'weights': weights
+        })
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'gmail-assistant-profiler',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frames},
+        'profiles': profiles
+    }
+
+
+def to_collapsed(threads: Dict[str, Counter]) -> str:
+    """brendan gregg folded stacks, input for flamegraph.pl or inferno"""
+    lines = []
+    for thread, stacks in sorted(threads.items()):
+        for stack, count in stacks.items():
+            frames = [thread] + [f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack]
+            lines.append(";".join(f.replace(";", ",") for f in frames) + f" {count}")
+    return "\n".join(lines) + "\n"
+
+
+class ProfileStore:
+    """speedscope and folded stack files of the last keep profiles, named by request id"""
+
+    def __init__(self, directory: str, keep: int = 50):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def path(self, profile_id: str, fmt: str) -> Optional[str]:
+        if not PROFILE_ID.match(profile_id) or fmt not in FORMATS:
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{FORMATS[fmt]}")
+        return path if os.path.exists(path) else None
+
+    def save(self, profile_id: str, name: str, profiler: SamplingProfiler):
+        threads = profiler.threads()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f"{profile_id}.speedscope.json"), "w") as f:
+            json.dump(to_speedscope(name, threads, profiler.interval), f)
+        with open(os.path.join(self.directory, f"{profile_id}.collapsed.txt"), "w") as f:
+            f.write(to_collapsed(threads))
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            files = sorted(
+                (os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                 if f.endswith(".speedscope.json")),
+                key=os.path.getmtime
+            )
+            for old in files[:-self.keep] if len(files) > self.keep else []:
+                for suffix in FORMATS.values():
+                    path = old[:-len("speedscope.json")] + suffix
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+def authorized(token: Optional[str]) -> bool:
+    """profiling is off unless PROFILE_TOKEN is set, then callers must present it"""
+    expected = os.getenv("PROFILE_TOKEN")
+    return bool(expected and token and hmac.compare_digest(token.encode(), expected.encode()))
+
+
+def _requested_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    match = re.search(rb"(?:^|&)profile=([^&]+)", scope.get("query_string", b""))
+    return unquote(match.group(1).decode("latin-1")) if match else None
+
+
+class ProfilerMiddleware:
+    """runs a request under the sampling profiler when it carries the profile token
+
+    the token comes in an X-Profile header or a profile= query parameter.
+    the response names the artifact in X-Profile-Id (the request's trace id),
+    fetch it from /debug/profiles/{id}. one request is profiled at a time,
+    others carrying the token run unprofiled. without the token the only
+    cost is the header scan
+    """
+
+    def __init__(self, app, store: ProfileStore, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.interval = interval
+        self._running = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope.get("path", "").startswith("/debug/")
+                or not authorized(_requested_token(scope))):
+            await self.app(scope, receive, send)
+            return
+        if not self._running.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        trace = tracing.current()
+        profile_id = trace.trace_id if trace is not None else f"{time.time_ns():x}"
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+                message = dict(message, headers=headers)
+            await send(message)
+
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            profiler.stop()
+            self._running.release()
+            try:
+                await asyncio.to_thread(self.store.save, profile_id, f"{scope.get('method')} {scope.get('path')}", profiler)
+            except Exception as e:
+                log.error("error saving profile %s: %s", profile_id, e)
+
+
+profile_store = ProfileStore(
+    os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "mail-profiles")),
+    keep=int(os.getenv("PROFILE_KEEP", "50"))
+)
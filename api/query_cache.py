@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# queries made only of these terms depend on nothing but a message's labels
+LABEL_TERMS = {
+    'in:inbox': 'INBOX',
+    'in:sent': 'SENT',
+    'in:drafts': 'DRAFT',
+    'in:starred': 'STARRED',
+    'in:important': 'IMPORTANT',
+    'is:unread': 'UNREAD',
+    'is:starred': 'STARRED',
+    'is:important': 'IMPORTANT',
+    'category:primary': 'CATEGORY_PERSONAL',
+    'category:social': 'CATEGORY_SOCIAL',
+    'category:promotions': 'CATEGORY_PROMOTIONS',
+    'category:updates': 'CATEGORY_UPDATES',
+    'category:forums': 'CATEGORY_FORUMS',
+}
+LABEL_OPERATORS = ('in:', 'is:', 'label:', 'category:')
+# results of these change as time passes, which no history delta reports
+RELATIVE_DATE = re.compile(r"\b(?:newer_than|older_than):")
+
+
+def normalize_query(query: str) -> str:
+    """lowercase and collapse whitespace, sort terms of plain and-queries"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    if re.search(r'[(){}"]|\bor\b', query):
+        return query
+    return " ".join(sorted(query.split(" "))) if query else ""
+
+
+def is_cacheable(query: str) -> bool:
+    return not RELATIVE_DATE.search(query.lower())
+
+
+def _label_terms(query: str) -> Optional[List[tuple]]:
+    """(label, negated) pairs of a label-only query, None if it has other terms"""
+    terms = []
+    for term in query.split(" ") if query else []:
+        negate = term.startswith('-')
+        term = term.lstrip('-')
+        if term == 'is:read':
+            terms.append(('UNREAD', not negate))
+        elif term in LABEL_TERMS:
+            terms.append((LABEL_TERMS[term], negate))
+        else:
+            return None
+    return terms
+
+
+def is_label_only(query: str) -> bool:
+    return _label_terms(query) is not None
+
+
+def label_membership(query: str, label_ids: List[str]) -> Optional[bool]:
+    """whether a message with these labels matches, None if labels can't tell"""
+    terms = _label_terms(query)
+    if terms is None:
+        return None
+
+    labels = set(label_ids)
+    if 'TRASH' in labels or 'SPAM' in labels:
+        return False
+    return all((label in labels) != negate for label, negate in terms)
+
+
+class QueryEntry:
+    def __init__(self, messages: List[Dict[str, str]], complete: bool, page_token: Optional[str] = None):
+        # ordered message refs ({'id', 'threadId'}), newest first like messages.list
+        self.messages = messages
+        # true when the listing reached the last page
+        self.complete = complete
+        # gmail's token for the rest of an incomplete listing
+        self.page_token = page_token
+
+
+class QueryCache:
+    """per-user cache of normalized query -> ordered message refs
+
+    each user's entries are valid as of one mailbox history id. history
+    deltas are applied to every entry: deletions and removals are patched
+    in place, new mail is prepended to label-only queries, and anything the
+    delta can't resolve drops the affected entry.
+    """
+
+    def __init__(self, max_queries_per_user: int = 100, sync_interval: float = 5.0):
+        self.max_queries_per_user = max_queries_per_user
+        self.sync_interval = sync_interval
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def history_id(self, user: str) -> Optional[str]:
+        with self._lock:
+            state = self._users.get(user)
+            return state['history_id'] if state else None
+
+    def needs_sync(self, user: str) -> bool:
+        """true when the user's entries are older than sync_interval or marked stale"""
+        with self._lock:
+            state = self._users.get(user)
+            if not state or not state['entries']:
+                return False
+            return state['stale'] or time.monotonic() - state['synced_at'] >= self.sync_interval
+
+    def mark_stale(self, user: str):
+        with self._lock:
+            if user in self._users:
+                self._users[user]['stale'] = True
+
+    def get(self, user: str, query: str, max_results: int) -> Optional[List[Dict[str, str]]]:
+        """cached refs if the entry covers max_results (or the whole listing)"""
+        with self._lock:
+            state = self._users.get(user)
+            entry = state['entries'].get(normalize_query(query)) if state else None
+            if entry is None or (not entry.complete and (not max_results or len(entry.messages) < max_results)):
+                self.misses += 1
+                return None
+
+            state['entries'].move_to_end(normalize_query(query))
+            self.hits += 1
+            messages = entry.messages[:max_results] if max_results else entry.messages
+            return [dict(m) for m in messages]
+
+    def version(self, user: str, query: str, max_results: int) -> Optional[str]:
+        """history id an answerable entry reflects, None when get() would miss"""
+        with self._lock:
+            state = self._users.get(user)
+            entry = state['entries'].get(normalize_query(query)) if state else None
+            if entry is None or (not entry.complete and (not max_results or len(entry.messages) < max_results)):
+                return None
+            return state['history_id']
+
+    def partial(self, user: str, query: str) -> Optional[Tuple[List[Dict[str, str]], str]]:
+        """refs and gmail page token of an incomplete entry, so a longer listing can continue it"""
+        with self._lock:
+            state = self._users.get(user)
+            entry = state['entries'].get(normalize_query(query)) if state else None
+            if entry is None or entry.complete or not entry.page_token:
+                return None
+            return [dict(m) for m in entry.messages], entry.page_token
+
+    def put(self, user: str, query: str, messages: List[Dict[str, str]], complete: bool, history_id: str,
+            page_token: Optional[str] = None):
+        if not is_cacheable(query):
+            return
+        with self._lock:
+            state = self._users.get(user)
+            if state is None or state['history_id'] != history_id:
+                # entries of another mailbox version can't be mixed with this one
+                state = self._users[user] = {
+                    'history_id': history_id,
+                    'entries': OrderedDict(),
+                    'synced_at': time.monotonic(),
+                    'stale': False
+                }
+
+            key = normalize_query(query)
+            state['entries'][key] = QueryEntry(
+                [{'id': m['id'], 'threadId': m.get('threadId')} for m in messages], complete, page_token
+            )
+            state['entries'].move_to_end(key)
+            while len(state['entries']) > self.max_queries_per_user:
+                state['entries'].popitem(last=False)
+
+    def apply_history(self, user: str, records: List[Dict[str, Any]], history_id: str):
+        """patch every entry of a user with history.list records"""
+        with self._lock:
+            state = self._users.get(user)
+            if state is None:
+                return
+
+            # skip records the entries already reflect
+            records = [r for r in records if int(r['id']) > int(state['history_id'])]
+            for record in records:
+                for key in list(state['entries']):
+                    if not self._apply_record(key, state['entries'][key], record):
+                        del state['entries'][key]
+
+            state['history_id'] = history_id
+            state['synced_at'] = time.monotonic()
+            state['stale'] = False
+
+    def invalidate(self, user: str):
+        with self._lock:
+            self._users.pop(user, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "queries": sum(len(state['entries']) for state in self._users.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+    def _apply_record(self, query: str, entry: QueryEntry, record: Dict[str, Any]) -> bool:
+        """apply one history record to an entry, false if the entry must be dropped"""
+        label_only = is_label_only(query)
+
+        for item in record.get('messagesDeleted', []):
+            _remove(entry, item['message']['id'])
+
+        for item in record.get('messagesAdded', []):
+            message = item['message']
+            if not label_only:
+                return False
+            if label_membership(query, message.get('labelIds', [])) and not _contains(entry, message['id']):
+                # new mail is the newest, so it goes on top
+                entry.messages.insert(0, {'id': message['id'], 'threadId': message.get('threadId')})
+
+        changes = [(True, item) for item in record.get('labelsAdded', [])]
+        changes += [(False, item) for item in record.get('labelsRemoved', [])]
+        for added, item in changes:
+            message = item['message']
+            if label_only:
+                if not label_membership(query, message.get('labelIds', [])):
+                    _remove(entry, message['id'])
+                elif not _contains(entry, message['id']):
+                    # position of an older message joining the list is unknown
+                    return False
+                continue
+
+            changed = set(item.get('labelIds', []))
+            if 'TRASH' in changed or 'SPAM' in changed:
+                # trashed mail leaves default searches, untrashed mail may rejoin anywhere
+                if not added or any(t in query for t in ('in:trash', 'in:spam', 'in:anywhere')):
+                    return False
+                _remove(entry, message['id'])
+            elif any(op in query for op in LABEL_OPERATORS):
+                return False
+        return True
+
+
+def _contains(entry: QueryEntry, message_id: str) -> bool:
+    return any(m['id'] == message_id for m in entry.messages)
+
+
+def _remove(entry: QueryEntry, message_id: str):
+    entry.messages = [m for m in entry.messages if m['id'] != message_id]
+
+
+query_cache = QueryCache(
+    max_queries_per_user=int(os.getenv("QUERY_CACHE_QUERIES", "100")),
+    sync_interval=float(os.getenv("QUERY_CACHE_SYNC_INTERVAL", "5"))
+)
@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+from typing import Any, Dict
+
+# gmail api quota units per call, see developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'getProfile': 1,
+    'labels.list': 1,
+    'labels.get': 1,
+    'history.list': 2,
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.trash': 5,
+    'messages.untrash': 5,
+    'messages.modify': 5,
+    'messages.delete': 10,
+    'messages.batchModify': 50,
+    'messages.send': 100,
+    'threads.list': 10,
+    'threads.get': 10,
+}
+
+
+def units(method: str, count: int = 1) -> int:
+    return QUOTA_UNITS.get(method, 5) * count
+
+
+class QuotaBudget:
+    """fixed allowance of quota units for one background job
+
+    jobs ask before each call and stop or shrink their work once the
+    allowance is used up, so warm-up never eats into interactive quota
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        return self.limit - self.spent
+
+    def try_spend(self, method: str, count: int = 1) -> bool:
+        cost = units(method, count)
+        with self._lock:
+            if self.spent + cost > self.limit:
+                return False
+            self.spent += cost
+            return True
+
+    def affordable(self, method: str) -> int:
+        """how many calls of a method still fit"""
+        return max(self.remaining, 0) // units(method)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'limit': self.limit, 'spent': self.spent}
+
+
+def _batch_calls(request):
+    inner = getattr(request, '_requests', None)
+    if inner is None:
+        return None
+    return list(inner.values()) if isinstance(inner, dict) else [call for _, call, _ in inner]
+
+
+def request_method(request) -> str:
+    """api method of a request like messages.get, batch:messages.get for a batch of them"""
+    calls = _batch_calls(request)
+    if calls is not None:
+        methods = sorted({request_method(call) for call in calls})
+        return "batch:" + (methods[0] if len(methods) == 1 else "mixed")
+    # googleapiclient names calls like gmail.users.messages.get, the fake like messages.get
+    method = getattr(request, 'methodId', None) or getattr(request, 'method', '')
+    return method.replace('gmail.users.', '')
+
+
+def request_units(request) -> int:
+    """quota cost of an api request, a batch costs the sum of its calls"""
+    calls = _batch_calls(request)
+    if calls is not None:
+        return sum(request_units(call) for call in calls)
+    return units(request_method(request))
+
+
+class QuotaScheduler:
+    """per user token bucket of gmail quota units
+
+    every call made through GmailService is charged, interactive calls always
+    go ahead. background work asks allows() first and only runs while the
+    bucket stays above a reserve kept for the user's own requests
+    """
+
+    def __init__(self, rate: float = 250.0, reserve: float = 100.0):
+        self.rate = rate
+        self.reserve = reserve
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.charged = 0
+        self.denied = 0
+
+    def _tokens(self, user: str) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(user, [self.rate, now])
+        bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket[0]
+
+    def charge(self, user: str, cost: int):
+        with self._lock:
+            self._tokens(user)
+            self._buckets[user][0] -= cost
+            self.charged += cost
+
+    def allows(self, user: str, cost: int) -> bool:
+        with self._lock:
+            if self._tokens(user) - cost >= self.reserve:
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'rate': self.rate, 'reserve': self.reserve, 'charged': self.charged, 'denied': self.denied}
+
+
+quota_scheduler = QuotaScheduler(
+    rate=float(os.getenv("GMAIL_QUOTA_RATE", "250")),
+    reserve=float(os.getenv("GMAIL_QUOTA_RESERVE", "100"))
+)
@@ -0,0 +1,294 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .local_store import local_store
+
+# repeat counts per field, a subject hit counts like three body hits
+FIELD_WEIGHTS = (('subject', 3), ('sender', 2), ('recipients', 1), ('body', 1))
+
+STOP_WORDS = frozenset(
+    "a an and are about as at be by email emails for from find get in is it me mail my of on or "
+    "show the this that to was with".split()
+)
+
+RANK_MODES = ("bm25", "tfidf")
+
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if w not in STOP_WORDS and len(w) > 1]
+
+
+def document_terms(doc: Dict[str, Any]) -> Counter:
+    """weighted term counts of a stored message, body falls back to the snippet"""
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        text = doc.get(field) or (doc.get('snippet') if field == 'body' else "")
+        for term in tokenize(text):
+            counts[term] += weight
+    return counts
+
+
+def _postings(terms: List[Tuple[int, Counter]], vocab: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """term-major (indptr, doc positions, tf) of (position, term counts) pairs, growing vocab"""
+    term_idx, doc_idx, tfs = [], [], []
+    for position, counts in terms:
+        for term, tf in counts.items():
+            term_idx.append(vocab.setdefault(term, len(vocab)))
+            doc_idx.append(position)
+            tfs.append(tf)
+
+    term_idx = np.asarray(term_idx, dtype=np.int32)
+    order = np.argsort(term_idx, kind="stable")
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_idx, minlength=len(vocab)), out=indptr[1:])
+    return indptr, np.asarray(doc_idx, dtype=np.int32)[order], np.asarray(tfs, dtype=np.float32)[order]
+
+
+class RankIndex:
+    """term-major sparse matrix over one user's messages, updated in place
+
+    postings of a term are the slice indptr[t]:indptr[t + 1] of doc_idx and
+    tf, so scoring a query is one gather over the postings of its terms and
+    one bincount into per document scores. documents stored or rewritten
+    after the build go to a small delta with the same layout, rebuilt from
+    the delta's term counts alone, and the positions they replace are marked
+    dead. label changes only flip the excluded mask. document counts,
+    frequencies and lengths are taken over live documents when a query is
+    scored, so bm25 stays exact; tf-idf document norms are those of the
+    build and drift until the ranker rebuilds an index grown too far
+    """
+
+    def __init__(self, docs: List[Dict[str, Any]], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.position: Dict[str, int] = {}
+        self.vocab: Dict[str, int] = {}
+        self.excluded = np.zeros(0, dtype=bool)
+        self.alive = np.zeros(0, dtype=bool)
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self._lock = threading.Lock()
+
+        terms = self._append(docs)
+        self.base = _postings(terms, self.vocab)
+        self.built_docs = len(docs)
+        self._delta_terms: List[Tuple[int, Counter]] = []
+        self.delta = _postings([], {})
+        self._compute_norms(terms)
+
+    def __len__(self) -> int:
+        return int(self.alive.sum())
+
+    @property
+    def dead(self) -> int:
+        return len(self.ids) - len(self)
+
+    @property
+    def pending(self) -> int:
+        return len(self._delta_terms)
+
+    def _append(self, docs: List[Dict[str, Any]]) -> List[Tuple[int, Counter]]:
+        """give docs new positions, the old position of a rewritten doc dies"""
+        terms = []
+        for doc in docs:
+            old = self.position.get(doc['id'])
+            if old is not None:
+                self.alive[old] = False
+            self.position[doc['id']] = len(self.ids)
+            terms.append((len(self.ids), document_terms(doc)))
+            self.ids.append(doc['id'])
+
+        n = len(docs)
+        self.excluded = np.concatenate([self.excluded, np.array(
+            [bool({'TRASH', 'SPAM'} & set(doc.get('labels', []))) for doc in docs], dtype=bool)])
+        self.alive = np.concatenate([self.alive, np.ones(n, dtype=bool)])
+        self.lengths = np.concatenate([self.lengths, np.array(
+            [sum(counts.values()) for _, counts in terms], dtype=np.float32)])
+        self.norms = np.concatenate([self.norms, np.ones(n, dtype=np.float32)])
+        return terms
+
+    def _document_frequencies(self) -> np.ndarray:
+        df = np.zeros(len(self.vocab), dtype=np.float32)
+        for indptr, doc_idx, _ in (self.base, self.delta):
+            counts = np.diff(indptr).astype(np.float32)
+            df[:len(counts)] += counts
+        return df
+
+    def _compute_norms(self, terms: List[Tuple[int, Counter]]):
+        """l2 norm of the log tf * idf vector of each doc, so tf-idf scores are cosines"""
+        if not terms:
+            return
+        idf = np.log((1 + len(self)) / (1 + self._document_frequencies())) + 1
+        for position, counts in terms:
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            term_ids = np.fromiter((self.vocab[t] for t in counts), dtype=np.int64, count=len(counts))
+            self.norms[position] = max(float(np.linalg.norm((1 + np.log(tf)) * idf[term_ids])), 1e-9)
+
+    def update(self, docs: List[Dict[str, Any]], removed: Iterable[str] = ()):
+        """store new or rewritten docs in the delta and forget removed ones"""
+        with self._lock:
+            for message_id in removed:
+                position = self.position.pop(message_id, None)
+                if position is not None:
+                    self.alive[position] = False
+            if docs:
+                terms = self._append(docs)
+                self._delta_terms = [(p, c) for p, c in self._delta_terms if self.alive[p]] + terms
+                self.delta = _postings(self._delta_terms, self.vocab)
+                self._compute_norms(terms)
+
+    def relabel(self, docs: List[Dict[str, Any]]):
+        with self._lock:
+            for doc in docs:
+                position = self.position.get(doc['id'])
+                if position is not None:
+                    self.excluded[position] = bool({'TRASH', 'SPAM'} & set(doc.get('labels', [])))
+
+    def _term_postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """live doc positions and tf of a term across base and delta"""
+        docs, tfs = [], []
+        for indptr, doc_idx, tf in (self.base, self.delta):
+            if term_id + 1 < len(indptr):
+                start, end = indptr[term_id], indptr[term_id + 1]
+                docs.append(doc_idx[start:end])
+                tfs.append(tf[start:end])
+        if not docs:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        docs, tfs = np.concatenate(docs), np.concatenate(tfs)
+        live = self.alive[docs]
+        return docs[live], tfs[live]
+
+    def scores(self, terms: Iterable[str], mode: str = "bm25") -> np.ndarray:
+        """score of every document position for the query terms"""
+        with self._lock:
+            counts = Counter(t for t in terms if t in self.vocab)
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            if not counts:
+                return scores
+
+            n = max(len(self), 1)
+            postings = [self._term_postings(self.vocab[t]) for t in counts]
+            df = np.array([len(docs) for docs, _ in postings], dtype=np.float32)
+            docs = np.concatenate([d for d, _ in postings])
+            tf = np.concatenate([t for _, t in postings])
+            repeats = df.astype(np.int64)
+
+            if mode == "tfidf":
+                idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+                query_weights = (1 + np.log(np.array(list(counts.values()), dtype=np.float32))) * idf
+                query_weights /= max(float(np.linalg.norm(query_weights)), 1e-9)
+                contributions = (1 + np.log(tf)) * np.repeat(idf * query_weights, repeats) / self.norms[docs]
+            else:
+                avg_length = float(self.lengths[self.alive].mean()) if len(self) else 1.0
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[docs] / max(avg_length, 1e-9))
+                idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+                contributions = tf * (self.k1 + 1) / (tf + norm) * np.repeat(idf, repeats)
+
+            scores += np.bincount(docs, weights=contributions, minlength=len(self.ids)).astype(np.float32)
+            return scores
+
+    def top(self, terms: Iterable[str], k: int, candidates: Optional[Iterable[str]] = None,
+            mode: str = "bm25", include_spam_trash: bool = False) -> List[Tuple[str, float]]:
+        """best k (id, score) pairs with a positive score, optionally among candidate ids only"""
+        scores = self.scores(terms, mode)
+        if candidates is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[[self.position[c] for c in candidates if c in self.position]] = True
+            scores[~mask] = 0
+        elif not include_spam_trash:
+            scores[self.excluded[:len(scores)]] = 0
+
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.ids[i], round(float(scores[i]), 4)) for i in hits]
+
+
+class Ranker:
+    """per user RankIndex over the local store, kept current from the store's change journal
+
+    a journal gap, a reset or an index whose delta or dead positions grew
+    past a fraction of it is rebuilt from the store
+    """
+
+    def __init__(self, store, k1: float = 1.2, b: float = 0.75, rebuild_fraction: float = 0.2):
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        self.rebuild_fraction = rebuild_fraction
+        self._indexes: Dict[str, Tuple[int, RankIndex]] = {}
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._updates = 0
+
+    def index(self, user: str) -> RankIndex:
+        version = self.store.version(user)
+        with self._lock:
+            cached = self._indexes.get(user)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        if cached:
+            index = cached[1]
+            changes = self.store.changes(user, cached[0])
+            if changes is not None and self._apply(user, index, changes):
+                with self._lock:
+                    self._indexes[user] = (max((v for v, _, _ in changes), default=cached[0]), index)
+                    self._updates += 1
+                return index
+
+        index = RankIndex(self.store.documents(user), self.k1, self.b)
+        with self._lock:
+            self._indexes[user] = (version, index)
+            self._builds += 1
+        return index
+
+    def _apply(self, user: str, index: RankIndex, changes: List[tuple]) -> bool:
+        """bring index up to the journal entries, False when a rebuild is cheaper"""
+        text, labels, removed = set(), set(), set()
+        for _, kind, ids in changes:
+            if kind == 'text':
+                text.update(ids)
+                removed.difference_update(ids)
+            elif kind == 'labels':
+                labels.update(ids)
+            elif kind == 'removed':
+                removed.update(ids)
+                text.difference_update(ids)
+
+        limit = max(256, self.rebuild_fraction * max(index.built_docs, 1))
+        if index.pending + len(text) > limit or index.dead + len(text) + len(removed) > limit:
+            return False
+
+        docs = self.store.documents(user, sorted(text | labels)) if text or labels else []
+        index.update([d for d in docs if d['id'] in text], removed)
+        index.relabel([d for d in docs if d['id'] in labels and d['id'] not in text])
+        return True
+
+    def rank(self, user: str, text: str, top_k: int = 10, candidates: Optional[List[str]] = None,
+             mode: str = "bm25") -> List[Tuple[str, float]]:
+        if mode not in RANK_MODES:
+            raise ValueError(f"unknown rank mode: {mode}")
+        return self.index(user).top(tokenize(text), top_k, candidates, mode)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'users': len(self._indexes),
+                'documents': sum(len(index) for _, index in self._indexes.values()),
+                'terms': sum(len(index.vocab) for _, index in self._indexes.values()),
+                'builds': self._builds,
+                'updates': self._updates
+            }
+
+
+ranker = Ranker(
+    local_store,
+    k1=float(os.getenv("RANK_BM25_K1", "1.2")),
+    b=float(os.getenv("RANK_BM25_B", "0.75"))
+)
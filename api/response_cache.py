@@ -0,0 +1,91 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def normalize_input(text: str) -> str:
+    """lowercase, collapse whitespace and drop trailing punctuation"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class ResponseCache:
+    """lru + ttl cache of agent answers and tool results
+
+    entries are keyed on (user, mailbox history id, key) so a mailbox change
+    moves every lookup to a fresh key. each user also has a generation that
+    is bumped on every mutation; a result is only stored if no mutation
+    happened while it was being computed.
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Any]]" = OrderedDict()
+        self._versions: Dict[str, str] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, user: str) -> int:
+        with self._lock:
+            return self._generations.get(user, 0)
+
+    def get(self, user: str, history_id: str, key: str) -> Optional[Any]:
+        with self._lock:
+            self._observe_version(user, history_id)
+            entry = self._entries.get((user, history_id, key))
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end((user, history_id, key))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: str, history_id: str, key: str, value: Any, generation: int):
+        """store value unless the user's mailbox was mutated since generation"""
+        with self._lock:
+            if self._generations.get(user, 0) != generation:
+                return
+            self._observe_version(user, history_id)
+
+            self._entries[(user, history_id, key)] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end((user, history_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user: str):
+        with self._lock:
+            self._generations[user] = self._generations.get(user, 0) + 1
+            self._drop_user(user)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+    def _observe_version(self, user: str, history_id: str):
+        # a new history id means every older entry of this user is stale
+        if self._versions.get(user) != history_id:
+            self._drop_user(user)
+            self._versions[user] = history_id
+
+    def _drop_user(self, user: str):
+        for key in [k for k in self._entries if k[0] == user]:
+            del self._entries[key]
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", "2000")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "900"))
+)
@@ -0,0 +1,102 @@
+import gzip
+from typing import Any, Dict, Iterable, List, Optional, Type
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson  # noqa: F401
+    FastJSONResponse = ORJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel], default: Iterable[str]) -> List[str]:
+    """comma separated field names checked against a model, default when empty"""
+    if not fields:
+        return list(default)
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in model.model_fields]
+    if unknown:
+        raise HTTPException(400, f"unknown fields: {', '.join(unknown)}")
+    # the id is always returned so rows can be matched up
+    return ['id'] + [f for f in names if f != 'id']
+
+
+def shape(record: Dict[str, Any], model: Type[BaseModel], fields: List[str]) -> Dict[str, Any]:
+    """validate a record against its model and keep only the selected fields"""
+    return model.model_validate(record).model_dump(include=set(fields))
+
+
+class CompressionMiddleware:
+    """brotli or gzip for large json bodies, whichever the client accepts
+
+    brotli is optional, without the package only gzip is offered. bodies
+    below minimum_size and already encoded responses pass through
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _encoding(self, scope) -> Optional[str]:
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1").lower()
+        offered = {part.split(";")[0].strip() for part in accept.split(",")}
+        if brotli is not None and "br" in offered:
+            return "br"
+        if "gzip" in offered:
+            return "gzip"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        encoding = self._encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def buffered_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body"):
+                return
+
+            body = b"".join(chunks)
+            headers = [(k, v) for k, v in start["headers"]]
+            names = {k.lower() for k, _ in headers}
+            content_type = dict(headers).get(b"content-type", b"")
+            if (len(body) >= self.minimum_size and b"content-encoding" not in names
+                    and content_type.startswith(b"application/json")):
+                if encoding == "br":
+                    body = brotli.compress(body, quality=self.brotli_quality)
+                else:
+                    body = gzip.compress(body, compresslevel=self.gzip_level)
+                headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+                headers += [
+                    (b"content-encoding", encoding.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"vary", b"Accept-Encoding"),
+                ]
+            await send(dict(start, headers=headers))
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, buffered_send)
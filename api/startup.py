@@ -0,0 +1,50 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from . import discovery
+from .log import get_logger, fields
+
+log = get_logger(__name__)
+
+# set once the background warm-up finished, whether it worked or not
+agent_ready = threading.Event()
+
+
+def load_agent():
+    """MailAgent, importing langchain and the agent stack on first use
+
+    the import is most of a first chat's latency after a deploy, so no
+    module on the non-chat paths imports it and warm_up does it early
+    """
+    from .agent_fastapi import MailAgent
+    return MailAgent
+
+
+def warm_up():
+    """import the agent stack and build the llm clients of every tier"""
+    start = time.perf_counter()
+    try:
+        load_agent()
+        from .model_router import model_router
+        for tier in model_router.tiers:
+            model_router.get_llm(tier)
+        log.info("agent stack warmed up", extra=fields(ms=round((time.perf_counter() - start) * 1000, 1)))
+    except Exception as e:
+        # a missing api key shows up here first, the chat route reports it per request
+        log.warning("error warming up agent stack: %s", e)
+    finally:
+        agent_ready.set()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """parse the discovery documents before serving, then warm the agent in the background
+
+    AGENT_WARMUP=0 skips the warm-up, for processes that never serve chat
+    """
+    await asyncio.to_thread(discovery.preload)
+    if os.getenv("AGENT_WARMUP", "1") == "1":
+        threading.Thread(target=warm_up, name="agent-warmup", daemon=True).start()
+    yield
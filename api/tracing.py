@@ -0,0 +1,199 @@
+import re
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from .metrics import (
+    http_requests, http_latency, gmail_calls, gmail_latency, gmail_calls_per_request,
+    quota_units, llm_calls, llm_latency, llm_tokens
+)
+from .quota import request_method, request_units
+from .circuit import UpstreamUnavailable
+from .deadlines import RequestAborted
+from . import turns
+
+# spans kept per trace, enough for a chat turn without growing unbounded
+MAX_SPANS = 200
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+
+class Trace:
+    """what one request spent upstream, filled in by the gmail and llm wrappers
+
+    the route label is read from the scope lazily, the router only sets it
+    after the middleware has started the trace
+    """
+
+    def __init__(self, trace_id: str, scope: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.scope = scope or {}
+        self.started = time.perf_counter()
+        self.gmail_calls = 0
+        self.gmail_seconds = 0.0
+        self.quota_units = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.tokens = 0
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        # unmatched paths share one label so scanners can't blow up cardinality
+        return getattr(route, "path", None) or "unmatched"
+
+    def add_span(self, kind: str, name: str, status: str, seconds: float):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append({
+                    'kind': kind,
+                    'name': name,
+                    'status': status,
+                    'start_ms': round((time.perf_counter() - self.started - seconds) * 1000, 2),
+                    'ms': round(seconds * 1000, 2)
+                })
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'trace_id': self.trace_id,
+                'route': self.route,
+                'gmail_calls': self.gmail_calls,
+                'gmail_ms': round(self.gmail_seconds * 1000, 2),
+                'quota_units': self.quota_units,
+                'llm_calls': self.llm_calls,
+                'llm_ms': round(self.llm_seconds * 1000, 2),
+                'tokens': self.tokens,
+                'spans': list(self.spans)
+            }
+
+    def server_timing(self) -> str:
+        return (
+            f'gmail;dur={self.gmail_seconds * 1000:.1f};desc="{self.gmail_calls} calls", '
+            f'llm;dur={self.llm_seconds * 1000:.1f};desc="{self.llm_calls} calls"'
+        )
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def current_route() -> str:
+    trace = _current.get()
+    # prefetch, warm-up and watcher calls run outside any request
+    return trace.route if trace is not None else "background"
+
+
+def error_status(exception: BaseException) -> str:
+    if isinstance(exception, UpstreamUnavailable):
+        return "circuit_open"
+    if isinstance(exception, RequestAborted):
+        return "aborted"
+    status = getattr(getattr(exception, "resp", None), "status", None)
+    return str(status) if status is not None else type(exception).__name__
+
+
+@contextmanager
+def gmail_call(request):
+    """record one gmail request or batch: calls, status, latency and quota by route"""
+    method = request_method(request)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = error_status(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        # refused calls never reached gmail and cost nothing
+        cost = request_units(request) if status not in ("circuit_open", "aborted") else 0
+        route = current_route()
+        gmail_calls.inc(route=route, method=method, status=status)
+        gmail_latency.observe(seconds, method=method)
+        quota_units.inc(cost, route=route)
+        turns.record_gmail(seconds)
+
+        trace = _current.get()
+        if trace is not None:
+            with trace._lock:
+                trace.gmail_calls += 1
+                trace.gmail_seconds += seconds
+                trace.quota_units += cost
+            trace.add_span("gmail", method, status, seconds)
+
+
+def record_llm_call(tier: str, model: str, seconds: float, prompt_tokens: int = 0,
+                    completion_tokens: int = 0, status: str = "ok"):
+    llm_calls.inc(tier=tier, model=model, status=status)
+    llm_latency.observe(seconds, tier=tier, model=model)
+    llm_tokens.inc(prompt_tokens, tier=tier, model=model, kind="prompt")
+    llm_tokens.inc(completion_tokens, tier=tier, model=model, kind="completion")
+    turns.record_llm(model, seconds, prompt_tokens, completion_tokens)
+
+    trace = _current.get()
+    if trace is not None:
+        with trace._lock:
+            trace.llm_calls += 1
+            trace.llm_seconds += seconds
+            trace.tokens += prompt_tokens + completion_tokens
+        trace.add_span("llm", model, status, seconds)
+
+
+def _trace_id(scope) -> str:
+    """continue a w3c traceparent or an x-request-id, otherwise start a new trace"""
+    for name, value in scope.get("headers", []):
+        if name == b"traceparent":
+            match = TRACEPARENT.match(value.decode("latin-1").strip())
+            if match:
+                return match.group(1)
+        elif name == b"x-request-id":
+            candidate = value.decode("latin-1").strip()
+            if re.fullmatch(r"[A-Za-z0-9._-]{1,64}", candidate):
+                return candidate
+    return uuid.uuid4().hex
+
+
+class TracingMiddleware:
+    """starts a trace per http request and records request metrics
+
+    responses carry X-Trace-Id and a Server-Timing header with the time
+    spent in gmail and the llm
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(_trace_id(scope), scope)
+        token = _current.set(trace)
+        status = 500
+
+        async def traced_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode()))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            route = trace.route
+            http_requests.inc(route=route, method=scope.get("method", ""), status=str(status))
+            http_latency.observe(time.perf_counter() - trace.started, route=route)
+            gmail_calls_per_request.observe(trace.gmail_calls, route=route)
+            _current.reset(token)
@@ -0,0 +1,202 @@
+import os
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from .metrics import registry, LATENCY_BUCKETS
+
+# chat turns are slower than single calls
+TURN_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+chat_turns = registry.counter(
+    "chat_turns_total", "agent chat turns by model tier and whether the answer was cached", ("tier", "cached"))
+chat_turn_latency = registry.histogram(
+    "chat_turn_duration_seconds", "agent chat turn latency by model tier", ("tier",), TURN_BUCKETS)
+chat_turn_component = registry.histogram(
+    "chat_turn_component_seconds", "time of a chat turn spent per component (llm, tools, gmail, serialization, other)",
+    ("component",), TURN_BUCKETS)
+chat_tool_latency = registry.histogram(
+    "chat_tool_duration_seconds", "agent tool call latency by tool", ("tool",), LATENCY_BUCKETS)
+chat_tool_gmail = registry.histogram(
+    "chat_tool_gmail_seconds", "gmail time inside one agent tool call by tool", ("tool",), LATENCY_BUCKETS)
+
+
+class ToolCall:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.gmail_seconds = 0.0
+        self.gmail_calls = 0
+        self.error = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'tool': self.name,
+            'ms': _ms(self.seconds),
+            'gmail_ms': _ms(self.gmail_seconds),
+            'gmail_calls': self.gmail_calls,
+            'error': self.error
+        }
+
+
+class Turn:
+    """timing of one MailAgent.chat turn
+
+    llm steps come from the router's llm callbacks, tool calls from the
+    agent executor and gmail time from GmailService._execute, each through
+    the context variables below. tool calls of one step may overlap, so
+    their sum can exceed the turn's wall time
+    """
+
+    def __init__(self, user: str, trace_id: Optional[str] = None):
+        self.turn_id = trace_id or uuid.uuid4().hex
+        self.user = user
+        self.at = time.time()
+        self.started = time.perf_counter()
+        self.tier: Optional[str] = None
+        self.cached = False
+        self.error = False
+        self.seconds = 0.0
+        self.serialization_seconds = 0.0
+        # gmail calls the turn makes itself, outside any tool
+        self.gmail_seconds = 0.0
+        self.steps: List[Dict[str, Any]] = []
+        self.tools: List[ToolCall] = []
+        self._lock = threading.Lock()
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            steps = list(self.steps)
+            tools = [t.as_dict() for t in self.tools]
+        llm = sum(s['ms'] for s in steps)
+        tool_ms = sum(t['ms'] for t in tools)
+        return {
+            'turn_id': self.turn_id,
+            'at': self.at,
+            'tier': self.tier,
+            'cached': self.cached,
+            'error': self.error,
+            'total_ms': _ms(self.seconds),
+            'llm_ms': round(llm, 2),
+            'tools_ms': round(tool_ms, 2),
+            'gmail_ms': round(_ms(self.gmail_seconds) + sum(t['gmail_ms'] for t in tools), 2),
+            'serialization_ms': _ms(self.serialization_seconds),
+            'other_ms': round(max(_ms(self.seconds) - llm - tool_ms, 0.0), 2),
+            'tokens': sum(s['prompt_tokens'] + s['completion_tokens'] for s in steps),
+            'steps': steps,
+            'tools': tools
+        }
+
+
+class TurnLog:
+    """the last size turns of every user, newest first"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._turns = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, turn: Turn):
+        with self._lock:
+            self._turns.appendleft(turn)
+
+    def recent(self, user: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            turns = [t for t in self._turns if t.user == user][:limit]
+        return [t.as_dict() for t in turns]
+
+
+_turn: ContextVar[Optional[Turn]] = ContextVar("turn", default=None)
+_tool: ContextVar[Optional[ToolCall]] = ContextVar("tool", default=None)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+@contextmanager
+def chat_turn(user: str, trace_id: Optional[str] = None):
+    """time a chat turn, logged and exported as metrics when it ends"""
+    turn = Turn(user, trace_id)
+    token = _turn.set(turn)
+    try:
+        yield turn
+    except BaseException:
+        turn.error = True
+        raise
+    finally:
+        _turn.reset(token)
+        turn.seconds = time.perf_counter() - turn.started
+        turn_log.add(turn)
+        _export(turn)
+
+
+def _export(turn: Turn):
+    summary = turn.as_dict()
+    tier = turn.tier or "none"
+    chat_turns.inc(tier=tier, cached=str(turn.cached).lower())
+    chat_turn_latency.observe(turn.seconds, tier=tier)
+    for component in ('llm', 'tools', 'gmail', 'other'):
+        chat_turn_component.observe(summary[f'{component}_ms'] / 1000, component=component)
+    for tool in turn.tools:
+        chat_tool_latency.observe(tool.seconds, tool=tool.name)
+        chat_tool_gmail.observe(tool.gmail_seconds, tool=tool.name)
+
+
+@contextmanager
+def tool_call(name: str):
+    """time one tool call of the current turn, a no-op outside chat turns"""
+    turn = _turn.get()
+    if turn is None:
+        yield
+        return
+    call = ToolCall(name)
+    token = _tool.set(call)
+    try:
+        yield
+    except BaseException:
+        call.error = True
+        raise
+    finally:
+        _tool.reset(token)
+        call.seconds = time.perf_counter() - call.started
+        with turn._lock:
+            turn.tools.append(call)
+
+
+def record_gmail(seconds: float):
+    call = _tool.get()
+    if call is not None:
+        call.gmail_seconds += seconds
+        call.gmail_calls += 1
+        return
+    turn = _turn.get()
+    if turn is not None:
+        turn.gmail_seconds += seconds
+
+
+def record_llm(model: str, seconds: float, prompt_tokens: int, completion_tokens: int):
+    turn = _turn.get()
+    if turn is None:
+        return
+    with turn._lock:
+        turn.steps.append({
+            'step': len(turn.steps) + 1,
+            'model': model,
+            'ms': _ms(seconds),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens
+        })
+
+
+def record_serialization(turn: Turn, seconds: float):
+    """time the route spent encoding the answer, known only after the turn ended"""
+    turn.serialization_seconds = seconds
+    chat_turn_component.observe(seconds, component="serialization")
+
+
+turn_log = TurnLog(int(os.getenv("CHAT_TURN_LOG_SIZE", "200")))
@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from .quota import QuotaBudget
+from .log import get_logger
+
+log = get_logger(__name__)
+
+
+def warm_up(gmail_service, budget: QuotaBudget, query: str = "", pages: int = 2,
+            page_size: int = 50, details: int = 50) -> Dict[str, Any]:
+    """fill the caches a first mail page view reads, cheapest and most visible first
+
+    counts set the mailbox version the later entries are stored under, then
+    the listing and labels, then full details of the first listed messages,
+    which /messages serves its rows from. query and page_size default to the
+    list route's own, so its first load hits the warmed entries. each step
+    is skipped or trimmed once the budget is spent
+    """
+    report = {'counts': False, 'labels': False, 'listed': 0, 'details': 0}
+
+    if budget.try_spend('getProfile') and budget.try_spend('labels.get'):
+        report['counts'] = bool(gmail_service.get_mailbox_counts())
+
+    wanted = pages * page_size
+    if not budget.try_spend('messages.list', -(-wanted // 500)):
+        return report
+    # one extra id so the page view can tell a next page exists
+    message_ids = [m['id'] for m in gmail_service.search_emails(query, wanted + 1)]
+    report['listed'] = len(message_ids)
+
+    if budget.try_spend('labels.list'):
+        report['labels'] = bool(gmail_service.list_labels())
+
+    batch = message_ids[:min(details, budget.affordable('messages.get'))]
+    if batch and budget.try_spend('messages.get', len(batch)):
+        found, _ = gmail_service.get_emails_details(batch)
+        report['details'] = len(found)
+    return report
+
+
+class WarmupManager:
+    """runs one warm-up per user on a small pool right after login"""
+
+    def __init__(self, budget_units: int = 1500, query: str = "", pages: int = 2,
+                 page_size: int = 50, details: int = 50, max_workers: int = 2):
+        self.budget_units = budget_units
+        self.query = query
+        self.pages = pages
+        self.page_size = page_size
+        self.details = details
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="warmup")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, gmail_service) -> bool:
+        """queue a warm-up, False when one is already running for the user"""
+        user = gmail_service.user_key
+        with self._lock:
+            job = self._jobs.get(user)
+            if job and job['state'] in ('queued', 'running'):
+                return False
+            self._jobs[user] = {'state': 'queued', 'started_at': time.time()}
+        self._pool.submit(self._run, gmail_service)
+        return True
+
+    def _run(self, gmail_service):
+        user = gmail_service.user_key
+        budget = QuotaBudget(self.budget_units)
+        self._jobs[user]['state'] = 'running'
+        start = time.perf_counter()
+        try:
+            report = warm_up(gmail_service, budget, self.query, self.pages, self.page_size, self.details)
+            state = 'done'
+        except Exception as e:
+            log.error("error warming caches: %s", e)
+            report, state = {'error': str(e)}, 'failed'
+
+        with self._lock:
+            self._jobs[user].update(
+                report,
+                state=state,
+                units=budget.spent,
+                took_ms=round((time.perf_counter() - start) * 1000, 2)
+            )
+
+    def status(self, user: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(user)
+            return dict(job) if job else None
+
+
+warmup = WarmupManager(
+    budget_units=int(os.getenv("WARMUP_QUOTA_UNITS", "1500")),
+    query=os.getenv("WARMUP_QUERY", ""),
+    pages=int(os.getenv("WARMUP_PAGES", "2")),
+    page_size=int(os.getenv("WARMUP_PAGE_SIZE", "50")),
+    details=int(os.getenv("WARMUP_DETAILS", "50"))
+)
@@ -0,0 +1,175 @@
+"""
+offline agent benchmark
+runs MailAgent and GmailAgent against the fake chat model and an in-memory
+gmail mailbox, and reports tool calls, gmail calls, prompt tokens and wall
+time per query.
+
+    python -m bench.agent_bench
+    python -m bench.agent_bench --write-baseline bench/agent_baseline.json
+    python -m bench.agent_bench --baseline bench/agent_baseline.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+import contextlib
+from typing import Any, Dict, List
+from langchain_core.callbacks import BaseCallbackHandler
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# GmailAgent imports gmail_interact from the standalone scripts folder
+sys.path.append(os.path.join(PROJECT_DIR, 'gmail-api-automate'))
+# every run gets a new fake mailbox, columns kept from an earlier run would be caught up against it
+if "COLUMN_STORE_PATH" not in os.environ:
+    os.environ["COLUMN_STORE_PATH"] = tempfile.mkdtemp(prefix="bench-columns-")
+    atexit.register(shutil.rmtree, os.environ["COLUMN_STORE_PATH"], ignore_errors=True)
+
+from bench.fake_gmail import FakeGmailResource, FakeGmailService, generate_mailbox
+from bench.fake_llm import FakeChatModel
+from api.model_router import ModelRouter
+
+CORPUS = [
+    "how many emails did I get this week?",
+    "show my unread emails",
+    "find emails from alice@example.com",
+    "what labels do I have?",
+    "give me my stats and show unread emails with attachments",
+    "find the invoice from billing@shop.example",
+]
+
+# counts are deterministic, only these are compared against a baseline
+COMPARED = ("tool_calls", "gmail_calls", "prompt_tokens")
+
+
+class TurnRecorder(BaseCallbackHandler):
+    """counts tool calls and prompt tokens of one chat turn"""
+
+    def __init__(self):
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.tool_calls += 1
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.prompt_tokens += usage.get("input_tokens", 0)
+
+
+def fake_router() -> ModelRouter:
+    return ModelRouter(llm_factory=lambda model, callbacks=None: FakeChatModel(model_name=model, callbacks=callbacks))
+
+
+def build_agents(resource: FakeGmailResource) -> Dict[str, Any]:
+    from api.agent_fastapi import MailAgent
+    agents = {"MailAgent": MailAgent(FakeGmailService(resource, user_key="bench-mail"), router=fake_router())}
+
+    from api.agent import GmailAgent
+    try:
+        # GmailAgent talks to the raw api resource through gmail_interact
+        agents["GmailAgent"] = GmailAgent(resource, router=fake_router())
+    except ValueError as e:
+        print(f"skipping GmailAgent: {e}", file=sys.stderr)
+    return agents
+
+
+def run_turn(agent, resource: FakeGmailResource, query: str) -> Dict[str, Any]:
+    recorder = TurnRecorder()
+    before = sum(n for method, n in resource.calls.items() if not method.startswith("batch:"))
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.chat(query, callbacks=[recorder])
+    wall = time.perf_counter() - start
+
+    after = sum(n for method, n in resource.calls.items() if not method.startswith("batch:"))
+    return {
+        "tool_calls": recorder.tool_calls,
+        "gmail_calls": after - before,
+        "prompt_tokens": recorder.prompt_tokens,
+        "wall_ms": round(wall * 1000, 2)
+    }
+
+
+def run(messages: int = 200) -> List[Dict[str, Any]]:
+    """cold pass then a repeat pass of the corpus for each agent"""
+    rows = []
+    resource = FakeGmailResource(generate_mailbox(messages))
+    for agent_name, agent in build_agents(resource).items():
+        for pass_name in ("cold", "repeat"):
+            for query in CORPUS:
+                rows.append({"agent": agent_name, "pass": pass_name, "query": query,
+                             **run_turn(agent, resource, query)})
+    return rows
+
+
+def report(rows: List[Dict[str, Any]]):
+    print(f"{'agent':<11} {'pass':<7} {'tools':>5} {'gmail':>5} {'tokens':>7} {'ms':>8}  query")
+    for row in rows:
+        print(f"{row['agent']:<11} {row['pass']:<7} {row['tool_calls']:>5} {row['gmail_calls']:>5} "
+              f"{row['prompt_tokens']:>7} {row['wall_ms']:>8.1f}  {row['query']}")
+
+    totals: Dict[tuple, Dict[str, float]] = {}
+    for row in rows:
+        total = totals.setdefault((row['agent'], row['pass']), {key: 0 for key in COMPARED + ("wall_ms",)})
+        for key in total:
+            total[key] += row[key]
+    print()
+    for (agent_name, pass_name), total in totals.items():
+        print(f"{agent_name:<11} {pass_name:<7} {total['tool_calls']:>5} {total['gmail_calls']:>5} "
+              f"{total['prompt_tokens']:>7} {total['wall_ms']:>8.1f}  total")
+
+
+def compare(rows: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    """regressions where a deterministic count grew past the baseline"""
+    with open(baseline_path) as f:
+        baseline = {(r['agent'], r['pass'], r['query']): r for r in json.load(f)}
+
+    regressions = []
+    for row in rows:
+        expected = baseline.get((row['agent'], row['pass'], row['query']))
+        if not expected:
+            continue
+        for key in COMPARED:
+            if row[key] > expected[key] * (1 + tolerance):
+                regressions.append(
+                    f"{row['agent']} {row['pass']} '{row['query']}': {key} {expected[key]} -> {row[key]}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline agent benchmark")
+    parser.add_argument("--messages", type=int, default=200, help="size of the fake mailbox")
+    parser.add_argument("--json", action="store_true", help="print rows as json")
+    parser.add_argument("--baseline", help="fail if counts regress against this file")
+    parser.add_argument("--write-baseline", help="write the rows to this file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed growth before failing")
+    args = parser.parse_args()
+
+    rows = run(args.messages)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        report(rows)
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(rows, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(rows, args.baseline, args.tolerance)
+        if regressions:
+            print("\nregressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
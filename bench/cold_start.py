@@ -0,0 +1,193 @@
+"""
+cold start benchmark
+starts fresh python processes that import api.main, run the app's startup
+and serve a first message list and chat against the fake gmail mailbox and
+fake chat model, and reports the median time of each stage.
+
+    python -m bench.cold_start
+    python -m bench.cold_start --write-baseline bench/cold_start_baseline.json
+    python -m bench.cold_start --baseline bench/cold_start_baseline.json
+
+"cold" runs with the agent warm-up off, so the first chat pays for importing
+the agent stack. "warm" lets the background warm-up finish first, like a
+deploy that gets traffic a few seconds after it starts.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {"cold": "0", "warm": "1"}
+STAGES = ("import_ms", "startup_ms", "warmup_ms", "gmail_client_ms", "first_list_ms", "first_chat_ms", "second_chat_ms")
+# modules that must not be imported by api.main, only by the chat path
+CHAT_ONLY_MODULES = ("langchain", "langchain_core", "langchain_openai", "openai", "google_auth_oauthlib")
+
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def fake_llm_factory(model: str, callbacks=None):
+    # imported on first use, the cold chat should pay for langchain like the real one does
+    from bench.fake_llm import FakeChatModel
+    return FakeChatModel(model_name=model, callbacks=callbacks)
+
+
+def child(out_path: str):
+    """one cold process, stage timings written as json to out_path"""
+    result: Dict[str, Any] = {}
+
+    start = time.perf_counter()
+    import api.main
+    result["import_ms"] = _ms(start)
+    result["chat_modules_at_import"] = sorted(m for m in CHAT_ONLY_MODULES if m in sys.modules)
+
+    from fastapi.testclient import TestClient
+    from api.auth import AuthService
+    from api.startup import agent_ready
+    from api.model_router import model_router
+    import api.gmail_routes as routes
+    from bench.fake_gmail import FakeGmailResource, FakeGmailService, generate_mailbox
+
+    session = {"user_id": "cold", "email": "cold@example.com", "access_token": "t", "scopes": []}
+
+    async def validate_session(self, token):
+        return session
+
+    AuthService.validate_session = validate_session
+    # set before startup so the warm-up builds fake models too
+    model_router.llm_factory = fake_llm_factory
+    real_service = routes.GmailService
+    resource = FakeGmailResource(generate_mailbox(200))
+    routes.GmailService = lambda session_data, client_id, client_secret: FakeGmailService(resource, session_data["user_id"])
+
+    start = time.perf_counter()
+    with TestClient(api.main.app) as client:
+        result["startup_ms"] = _ms(start)
+        start = time.perf_counter()
+        if os.getenv("AGENT_WARMUP") == "1":
+            agent_ready.wait(60)
+        result["warmup_ms"] = _ms(start)
+
+        # building the real client needs no network, only the discovery document
+        start = time.perf_counter()
+        real_service(session, "client", "secret").service.users().messages()
+        result["gmail_client_ms"] = _ms(start)
+
+        headers = {"Authorization": "Bearer t"}
+        start = time.perf_counter()
+        client.get("/api/gmail/messages?query=in:inbox&max_results=20", headers=headers).raise_for_status()
+        result["first_list_ms"] = _ms(start)
+
+        for stage, message in (("first_chat_ms", "show my unread emails"), ("second_chat_ms", "what labels do I have?")):
+            start = time.perf_counter()
+            client.post("/api/gmail/chat", json={"message": message}, headers=headers).raise_for_status()
+            result[stage] = _ms(start)
+
+    with open(out_path, "w") as f:
+        json.dump(result, f)
+
+
+def run_once(mode: str) -> Dict[str, Any]:
+    env = dict(os.environ, AGENT_WARMUP=MODES[mode], LOG_LEVEL="WARNING",
+               PYTHONPATH=PROJECT_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    for name, value in (("GOOGLE_CLIENT_ID", "bench"), ("GOOGLE_CLIENT_SECRET", "bench"), ("JWT_SECRET_KEY", "bench")):
+        env.setdefault(name, value)
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        out_path = f.name
+    columns = tempfile.mkdtemp(prefix="bench-columns-")
+    env["COLUMN_STORE_PATH"] = columns
+    try:
+        proc = subprocess.run([sys.executable, "-m", "bench.cold_start", "--child", out_path], cwd=PROJECT_DIR,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{mode} run failed:\n{proc.stderr[-2000:]}")
+        with open(out_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(out_path)
+        shutil.rmtree(columns, ignore_errors=True)
+
+
+def run(runs: int = 5) -> List[Dict[str, Any]]:
+    """median of each stage over runs fresh processes per mode"""
+    rows = []
+    for mode in MODES:
+        results = [run_once(mode) for _ in range(runs)]
+        row = {"mode": mode, "runs": runs}
+        for stage in STAGES:
+            row[stage] = round(statistics.median(r[stage] for r in results), 2)
+        row["chat_modules_at_import"] = sorted({m for r in results for m in r["chat_modules_at_import"]})
+        rows.append(row)
+    return rows
+
+
+def report(rows: List[Dict[str, Any]]):
+    print(f"{'stage':<16} " + " ".join(f"{row['mode']:>9}" for row in rows))
+    for stage in STAGES:
+        print(f"{stage:<16} " + " ".join(f"{row[stage]:>9.1f}" for row in rows))
+    for row in rows:
+        if row["chat_modules_at_import"]:
+            print(f"{row['mode']}: chat modules imported by api.main: {', '.join(row['chat_modules_at_import'])}")
+
+
+def compare(rows: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    """stages slower than the baseline by more than tolerance, and chat modules leaking into startup"""
+    with open(baseline_path) as f:
+        baseline = {r['mode']: r for r in json.load(f)}
+
+    regressions = []
+    for row in rows:
+        if row["chat_modules_at_import"]:
+            regressions.append(f"{row['mode']}: api.main imports {', '.join(row['chat_modules_at_import'])}")
+        expected = baseline.get(row['mode'])
+        if not expected:
+            continue
+        for stage in STAGES:
+            # timings are noisy, a small absolute slack keeps fast stages from flapping
+            if row[stage] > expected[stage] * (1 + tolerance) + 20:
+                regressions.append(f"{row['mode']} {stage}: {expected[stage]} -> {row[stage]} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    parser.add_argument("--json", action="store_true", help="print rows as json")
+    parser.add_argument("--baseline", help="fail if stages regress against this file")
+    parser.add_argument("--write-baseline", help="write the rows to this file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown before failing")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    rows = run(args.runs)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        report(rows)
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(rows, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(rows, args.baseline, args.tolerance)
+        if regressions:
+            print("\nregressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
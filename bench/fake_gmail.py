@@ -0,0 +1,460 @@
+"""
+in-memory stand-in for the gmail v1 api resource
+lets GmailService, the agents and benchmarks run without google
+"""
+import re
+import time
+import base64
+import random
+import datetime
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+from email.utils import format_datetime
+from api.gmail_service import GmailService
+
+
+class FakeHttpError(Exception):
+    """mimics googleapiclient HttpError, carries the status on resp"""
+
+    def __init__(self, status: int):
+        super().__init__(f"<HttpError {status}>")
+        self.resp = _Node(status=status)
+
+
+class FakeRequest:
+    """mimics googleapiclient HttpRequest, runs the handler on execute"""
+
+    def __init__(self, resource: "FakeGmailResource", method: str, handler: Callable[[], Any]):
+        self.resource = resource
+        self.method = method
+        self.handler = handler
+
+    def execute(self, http=None, num_retries: int = 0):
+        self.resource.record_call(self.method)
+        return self.handler()
+
+
+class FakeBatchRequest:
+    """mimics BatchHttpRequest, one upstream call for all added requests"""
+
+    def __init__(self, resource: "FakeGmailResource", callback=None):
+        self.resource = resource
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, callback=None, request_id: Optional[str] = None):
+        request_id = request_id or str(len(self._requests) + 1)
+        if any(existing_id == request_id for existing_id, _, _ in self._requests):
+            raise KeyError(f"a request with this id already exists: {request_id}")
+        self._requests.append((request_id, request, callback))
+
+    def execute(self, http=None):
+        self.resource.record_call("batch")
+        for request_id, request, callback in self._requests:
+            self.resource.record_call(f"batch:{request.method}")
+            response, exception = None, None
+            try:
+                response = request.handler()
+            except Exception as e:
+                exception = e
+            handler = callback or self.callback
+            if handler:
+                handler(request_id, response, exception)
+
+
+class _Node:
+    """attribute bag used to build users().messages() style chains"""
+
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeGmailResource:
+    """in-memory mailbox exposing the subset of the gmail api this repo uses
+
+    messages are stored in gmail api shape (id, threadId, labelIds,
+    internalDate, payload...). every executed request is counted in
+    `calls` by method name, mutations bump the mailbox history id and are
+    recorded for history().list. setting `outage` to a status code makes
+    every call fail with that status until it is cleared.
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]], labels: Optional[List[Dict[str, str]]] = None,
+                 latency: float = 0.0):
+        self.messages: Dict[str, Dict[str, Any]] = {m['id']: m for m in messages}
+        self.labels = labels or default_labels()
+        self.latency = latency
+        self.history_id = 1000
+        self.history: List[Dict[str, Any]] = []
+        self.calls: Counter = Counter()
+        self.outage: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def record_call(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.outage:
+            raise FakeHttpError(self.outage)
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    # resource chain
+
+    def users(self):
+        return _Node(
+            messages=lambda: _Node(
+                list=self._messages_list,
+                get=self._messages_get,
+                trash=lambda userId, id: self._request("messages.trash", lambda: self._set_trashed(id, True)),
+                untrash=lambda userId, id: self._request("messages.untrash", lambda: self._set_trashed(id, False)),
+                delete=lambda userId, id: self._request("messages.delete", lambda: self._delete(id)),
+                modify=lambda userId, id, body: self._request(
+                    "messages.modify",
+                    lambda: self._modify([id], body.get('addLabelIds', []), body.get('removeLabelIds', []))[0]
+                ),
+                batchModify=lambda userId, body: self._request(
+                    "messages.batchModify",
+                    lambda: self._modify(body['ids'], body.get('addLabelIds', []), body.get('removeLabelIds', [])) and ""
+                ),
+                send=lambda userId, body: self._request("messages.send", lambda: self._send(body)),
+            ),
+            labels=lambda: _Node(
+                list=lambda userId: self._request("labels.list", lambda: {'labels': list(self.labels)}),
+                get=lambda userId, id: self._request("labels.get", lambda: self._label_counts(id)),
+                create=lambda userId, body: self._request("labels.create", lambda: self._create_label(body)),
+                delete=lambda userId, id: self._request("labels.delete", lambda: self._delete_label(id)),
+            ),
+            threads=lambda: _Node(
+                list=self._threads_list,
+                get=self._threads_get,
+            ),
+            history=lambda: _Node(
+                list=self._history_list,
+            ),
+            getProfile=lambda userId: self._request("getProfile", lambda: {
+                'emailAddress': 'bench@example.com',
+                'messagesTotal': len(self.messages),
+                'threadsTotal': len({m['threadId'] for m in self.messages.values()}),
+                'historyId': str(self.history_id)
+            }),
+        )
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self, callback)
+
+    def _request(self, method: str, handler: Callable[[], Any]) -> FakeRequest:
+        return FakeRequest(self, method, handler)
+
+    # reads
+
+    def _messages_list(self, userId, q: str = '', labelIds=None, maxResults: int = 100,
+                       pageToken: Optional[str] = None, includeSpamTrash: bool = False):
+        def handler():
+            matches = self._search(q or '', labelIds, includeSpamTrash)
+            return self._page([{'id': m['id'], 'threadId': m['threadId']} for m in matches],
+                              'messages', maxResults, pageToken)
+        return self._request("messages.list", handler)
+
+    def _messages_get(self, userId, id, format: str = 'full', metadataHeaders=None):
+        def handler():
+            if id not in self.messages:
+                raise KeyError(f"message not found: {id}")
+            return shape_message(self.messages[id], format, metadataHeaders)
+        return self._request("messages.get", handler)
+
+    def _threads_list(self, userId, q: str = '', maxResults: int = 100, pageToken: Optional[str] = None):
+        def handler():
+            seen, threads = set(), []
+            for message in self._search(q or '', None, False):
+                if message['threadId'] not in seen:
+                    seen.add(message['threadId'])
+                    threads.append({'id': message['threadId'], 'snippet': message.get('snippet', '')})
+            return self._page(threads, 'threads', maxResults, pageToken)
+        return self._request("threads.list", handler)
+
+    def _threads_get(self, userId, id, format: str = 'full'):
+        def handler():
+            messages = sorted(
+                (m for m in self.messages.values() if m['threadId'] == id),
+                key=lambda m: int(m['internalDate'])
+            )
+            return {'id': id, 'messages': [shape_message(m, format) for m in messages]}
+        return self._request("threads.get", handler)
+
+    def _history_list(self, userId, startHistoryId, pageToken: Optional[str] = None,
+                      maxResults: int = 100, historyTypes=None, labelId=None):
+        def handler():
+            start = int(startHistoryId)
+            if self.history and start < self.history[0]['id'] - 1:
+                # gmail answers 404 for a start id it no longer has history for
+                raise FakeHttpError(404)
+            records = [dict(h, id=str(h['id'])) for h in self.history if h['id'] > start]
+            page = self._page(records, 'history', maxResults, pageToken)
+            page['historyId'] = str(self.history_id)
+            return page
+        return self._request("history.list", handler)
+
+    def _label_counts(self, label_id: str) -> Dict[str, Any]:
+        label = next(label for label in self.labels if label['id'] == label_id)
+        members = [m for m in self.messages.values() if label_id in m.get('labelIds', [])]
+        return dict(
+            label,
+            messagesTotal=len(members),
+            messagesUnread=sum('UNREAD' in m.get('labelIds', []) for m in members)
+        )
+
+    def _page(self, items: List[Any], key: str, max_results: int, page_token: Optional[str]) -> Dict[str, Any]:
+        offset = int(page_token or 0)
+        max_results = max_results or 100
+        page = {key: items[offset:offset + max_results], 'resultSizeEstimate': len(items)}
+        if offset + max_results < len(items):
+            page['nextPageToken'] = str(offset + max_results)
+        if not page[key]:
+            del page[key]
+        return page
+
+    def _search(self, q: str, label_ids, include_spam_trash: bool) -> List[Dict[str, Any]]:
+        terms = parse_simple_query(q)
+        wants_trash = any(t == ('in', 'trash') for t in terms)
+        matches = []
+        for message in self.messages.values():
+            labels = message.get('labelIds', [])
+            if not include_spam_trash and not wants_trash and ('TRASH' in labels or 'SPAM' in labels):
+                continue
+            if label_ids and not all(label in labels for label in label_ids):
+                continue
+            if all(match_term(message, term) for term in terms):
+                matches.append(message)
+        return sorted(matches, key=lambda m: int(m['internalDate']), reverse=True)
+
+    # writes
+
+    def _bump(self, record: Dict[str, Any]):
+        self.history_id += 1
+        self.history.append({'id': self.history_id, **record})
+
+    def _set_trashed(self, message_id: str, trashed: bool):
+        if trashed:
+            return self._modify([message_id], ['TRASH'], ['INBOX'])[0]
+        return self._modify([message_id], ['INBOX'], ['TRASH'])[0]
+
+    def _delete(self, message_id: str):
+        message = self.messages.pop(message_id)
+        self._bump({'messagesDeleted': [{'message': {'id': message_id, 'threadId': message['threadId']}}]})
+        return ""
+
+    def _modify(self, message_ids: List[str], add: List[str], remove: List[str]) -> List[Dict[str, Any]]:
+        updated = []
+        for message_id in message_ids:
+            message = self.messages[message_id]
+            labels = message.setdefault('labelIds', [])
+            added = [label for label in add if label not in labels]
+            removed = [label for label in remove if label in labels]
+            labels[:] = [label for label in labels if label not in removed] + added
+
+            ref = {'message': {'id': message_id, 'threadId': message['threadId'], 'labelIds': list(labels)}}
+            record = {}
+            if added:
+                record['labelsAdded'] = [{**ref, 'labelIds': added}]
+            if removed:
+                record['labelsRemoved'] = [{**ref, 'labelIds': removed}]
+            if record:
+                self._bump(record)
+                message['historyId'] = str(self.history_id)
+            updated.append({'id': message_id, 'threadId': message['threadId'], 'labelIds': list(labels)})
+        return updated
+
+    def _send(self, body: Dict[str, Any]):
+        message_id = f"sent{len(self.messages) + 1:06d}"
+        now = datetime.datetime.now(datetime.timezone.utc)
+        message = make_message(message_id, 'me@example.com', 'unknown recipients', 'sent message', '', now, ['SENT'])
+        self.messages[message_id] = message
+        self._bump({'messagesAdded': [{'message': {'id': message_id, 'threadId': message['threadId'], 'labelIds': ['SENT']}}]})
+        return {'id': message_id, 'threadId': message['threadId'], 'labelIds': ['SENT']}
+
+    def deliver(self, message: Dict[str, Any]):
+        """simulate new mail arriving"""
+        self.messages[message['id']] = message
+        self._bump({'messagesAdded': [{'message': {
+            'id': message['id'], 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])
+        }}]})
+        message['historyId'] = str(self.history_id)
+
+    def _create_label(self, body: Dict[str, Any]):
+        label = {'id': f"Label_{len(self.labels) + 1}", 'name': body['name'], 'type': 'user'}
+        self.labels.append(label)
+        return label
+
+    def _delete_label(self, label_id: str):
+        self.labels = [label for label in self.labels if label['id'] != label_id]
+        return ""
+
+
+class FakeGmailService(GmailService):
+    """GmailService running on a FakeGmailResource instead of google's api"""
+
+    def __init__(self, resource: FakeGmailResource, user_key: str = "fake-user"):
+        self.credentials = None
+        self.service = resource
+        self.user_key = user_key
+        self._local = threading.local()
+        self._history_id = None
+        self.stale = False
+        self.outage = None
+
+    def _http(self):
+        return None
+
+
+# gmail api shaping
+
+USER_LABELS = {'receipts': 'Label_1', 'work': 'Label_2'}
+
+def default_labels() -> List[Dict[str, str]]:
+    system = ['INBOX', 'SENT', 'TRASH', 'SPAM', 'UNREAD', 'STARRED', 'IMPORTANT', 'DRAFT',
+              'CATEGORY_PERSONAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'CATEGORY_UPDATES']
+    return [{'id': name, 'name': name, 'type': 'system'} for name in system] + [
+        {'id': label_id, 'name': name, 'type': 'user'} for name, label_id in USER_LABELS.items()
+    ]
+
+
+def make_message(message_id: str, sender: str, to: str, subject: str, body: str,
+                 date: datetime.datetime, labels: List[str], thread_id: Optional[str] = None,
+                 attachment: Optional[str] = None) -> Dict[str, Any]:
+    headers = [
+        {'name': 'From', 'value': sender},
+        {'name': 'To', 'value': to},
+        {'name': 'Subject', 'value': subject},
+        {'name': 'Date', 'value': format_datetime(date)}
+    ]
+    text_part = {
+        'mimeType': 'text/plain',
+        'filename': '',
+        'body': {'data': base64.urlsafe_b64encode(body.encode('utf-8')).decode('ascii'), 'size': len(body)}
+    }
+    parts = [{'mimeType': 'multipart/alternative', 'filename': '', 'body': {'size': 0}, 'parts': [text_part]}]
+    if attachment:
+        parts.append({'mimeType': 'application/pdf', 'filename': attachment, 'body': {'attachmentId': 'att1', 'size': 2048}})
+
+    return {
+        'id': message_id,
+        'threadId': thread_id or message_id,
+        'labelIds': list(labels),
+        'snippet': body[:100],
+        'historyId': '1000',
+        'internalDate': str(int(date.timestamp() * 1000)),
+        'sizeEstimate': len(body) + 512 + (2048 if attachment else 0),
+        'payload': {'mimeType': 'multipart/mixed', 'headers': headers, 'body': {'size': 0}, 'parts': parts}
+    }
+
+
+def shape_message(message: Dict[str, Any], format: str = 'full', metadata_headers=None) -> Dict[str, Any]:
+    """return a message the way messages.get does for a given format"""
+    shaped = {k: v for k, v in message.items() if k != 'payload'}
+    if format == 'minimal':
+        return shaped
+    payload = message['payload']
+    if format == 'metadata':
+        headers = payload['headers']
+        if metadata_headers:
+            wanted = {h.lower() for h in metadata_headers}
+            headers = [h for h in headers if h['name'].lower() in wanted]
+        shaped['payload'] = {'mimeType': payload['mimeType'], 'headers': headers}
+        return shaped
+    shaped['payload'] = payload
+    return shaped
+
+
+def generate_mailbox(count: int = 200, seed: int = 7, now: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+    """deterministic mailbox of `count` messages spread over the last ~90 days"""
+    rng = random.Random(seed)
+    now = now or datetime.datetime(2026, 10, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    senders = [
+        ('alice@example.com', 'work', ['project update', 'meeting notes', 'quarterly plan']),
+        ('bob@example.com', 'work', ['lunch tomorrow?', 'code review', 'deploy schedule']),
+        ('billing@shop.example', 'receipts', ['your invoice', 'order receipt', 'payment confirmation']),
+        ('news@deals.example', 'promotions', ['50% off this weekend', 'new arrivals', 'last chance sale']),
+        ('friends@social.example', 'social', ['you have new followers', 'event invitation', 'photo tagged']),
+        ('alerts@bank.example', 'updates', ['statement available', 'security alert', 'card payment']),
+    ]
+    words = ("invoice payment meeting project deadline report update schedule travel hotel flight "
+             "review budget contract receipt order delivery account security password team").split()
+
+    messages = []
+    for i in range(count):
+        sender, kind, subjects = senders[rng.randrange(len(senders))]
+        date = now - datetime.timedelta(minutes=rng.randrange(90 * 24 * 60))
+        labels = ['INBOX']
+        if rng.random() < 0.3:
+            labels.append('UNREAD')
+        if rng.random() < 0.05:
+            labels.append('STARRED')
+        if kind in ('promotions', 'social', 'updates'):
+            labels.append(f"CATEGORY_{kind.upper()}")
+        else:
+            labels.append('CATEGORY_PERSONAL')
+        if kind in USER_LABELS:
+            labels.append(USER_LABELS[kind])
+
+        body = " ".join(rng.choice(words) for _ in range(rng.randrange(20, 120)))
+        attachment = 'document.pdf' if rng.random() < 0.15 else None
+        messages.append(make_message(
+            f"msg{i:06d}", sender, 'me@example.com', rng.choice(subjects), body, date, labels,
+            thread_id=f"thr{i // 2:06d}", attachment=attachment
+        ))
+    return messages
+
+
+# minimal query matching, enough for benchmarks
+
+def parse_simple_query(q: str) -> List[tuple]:
+    terms = []
+    for token in re.findall(r'(?:\w+:)?"[^"]*"|\S+', q):
+        negate = token.startswith('-')
+        token = token.lstrip('-')
+        if ':' in token:
+            op, value = token.split(':', 1)
+            term = (op.lower(), value.strip('"').lower())
+        else:
+            term = ('text', token.strip('"').lower())
+        terms.append(('not', term) if negate else term)
+    return terms
+
+
+def match_term(message: Dict[str, Any], term: tuple) -> bool:
+    op, value = term
+    if op == 'not':
+        return not match_term(message, value)
+
+    labels = message.get('labelIds', [])
+    headers = {h['name'].lower(): h['value'].lower() for h in message['payload']['headers']}
+    date = datetime.datetime.fromtimestamp(int(message['internalDate']) / 1000)
+
+    if op == 'from':
+        return value in headers.get('from', '')
+    if op == 'to':
+        return value in headers.get('to', '')
+    if op == 'subject':
+        return value in headers.get('subject', '')
+    if op == 'is':
+        if value == 'read':
+            return 'UNREAD' not in labels
+        return value.upper() in labels
+    if op == 'in':
+        return value == 'anywhere' or value.upper() in labels
+    if op == 'label':
+        return value.upper() in labels or USER_LABELS.get(value) in labels
+    if op == 'category':
+        return f"CATEGORY_{value.upper()}" in labels
+    if op == 'has':
+        return value == 'attachment' and any(p.get('filename') for p in message['payload'].get('parts', []))
+    if op in ('after', 'before', 'newer', 'older'):
+        bound = datetime.datetime.strptime(value.replace('-', '/'), '%Y/%m/%d')
+        return date >= bound if op in ('after', 'newer') else date < bound
+    text = " ".join(headers.values()) + " " + message.get('snippet', '').lower()
+    return value in text
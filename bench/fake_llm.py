@@ -0,0 +1,112 @@
+"""
+deterministic local chat model for offline runs of the agents
+no network calls, same input always gives the same output
+"""
+import re
+import json
+from typing import Any, Dict, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, FunctionMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+def _count_tokens(text: str) -> int:
+    """rough token count, about 4 characters per token"""
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel(BaseChatModel):
+    """rule based stand-in for ChatOpenAI
+
+    with `responses` set it replays them in order (cycling), otherwise it picks
+    tools from keywords in the latest user message and answers with the
+    tool output once it has been observed. works with bind_tools (tool calls)
+    and with openai functions bound as `functions=` (function_call).
+    usage_metadata is filled in so token metrics work like a real model's.
+    """
+
+    model_name: str = "fake-chat"
+    responses: List[AIMessage] = []
+    tool_names: List[str] = []
+    _calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(t, "name", None) or t.get("function", {}).get("name") for t in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        functions = kwargs.get("functions")
+        if self.responses:
+            message = self.responses[self._calls % len(self.responses)].model_copy()
+        elif functions:
+            bound = self.model_copy(update={"tool_names": [f["name"] for f in functions]})
+            message = bound._respond(messages, as_function=True)
+        else:
+            message = self._respond(messages)
+        self._calls += 1
+
+        prompt_text = "".join(str(m.content) for m in messages)
+        input_tokens = _count_tokens(prompt_text)
+        output_tokens = _count_tokens(str(message.content) + json.dumps(message.tool_calls))
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _respond(self, messages: List[BaseMessage], as_function: bool = False) -> AIMessage:
+        # answer once a tool result is in the scratchpad
+        observations = [m for m in messages if isinstance(m, (ToolMessage, FunctionMessage))]
+        if observations:
+            return AIMessage(content="\n".join(str(m.content) for m in observations))
+
+        user_text = next((str(m.content) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        calls = self._pick_tools(user_text)
+        if not calls:
+            return AIMessage(content="I'm sorry, I can't do that")
+        if as_function:
+            # the functions api carries a single call per message
+            function_call = {"name": calls[0]["name"], "arguments": json.dumps(calls[0]["args"])}
+            return AIMessage(content="", additional_kwargs={"function_call": function_call})
+        return AIMessage(content="", tool_calls=[
+            {**call, "id": f"call_{i}", "type": "tool_call"} for i, call in enumerate(calls)
+        ])
+
+    def _pick_tools(self, text: str) -> List[Dict[str, Any]]:
+        """one call per matching rule, searching when nothing else matched"""
+        lowered = text.lower()
+        rules = [
+            (("how many", "stats", "statistics", "count"), ("get_email_stats_tool", "get_email_stats"), {}),
+            (("label", "folder"), ("list_labels_tool", "list_labels"), {}),
+        ]
+        calls = []
+        for keywords, names, args in rules:
+            name = self._available(names)
+            if name and any(k in lowered for k in keywords):
+                calls.append({"name": name, "args": args})
+
+        search_words = ("find", "show", "search", "unread", "from ", "attachment")
+        name = self._available(("search_emails_tool", "search_emails"))
+        if name and (not calls or any(k in lowered for k in search_words)):
+            calls.append({"name": name, "args": {"query": self._to_query(lowered), "max_results": 5}})
+        return calls
+
+    def _available(self, names) -> Optional[str]:
+        return next((n for n in names if n in self.tool_names), None)
+
+    def _to_query(self, text: str) -> str:
+        """map a few phrases onto gmail search syntax"""
+        terms = []
+        if "unread" in text:
+            terms.append("is:unread")
+        if "attachment" in text:
+            terms.append("has:attachment")
+        sender = re.search(r"from ([\w.@-]+)", text)
+        if sender:
+            terms.append(f"from:{sender.group(1)}")
+        return " ".join(terms) or "in:inbox"
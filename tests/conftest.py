@@ -0,0 +1,17 @@
+"""
+shared setup for the api tests, run from the repo root with
+
+    python -m pytest tests
+
+gmail is the in-memory fake from bench/, nothing here talks to google or openai
+"""
+import os
+import tempfile
+
+# settings the api modules read at import time
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test")
+os.environ.setdefault("JWT_SECRET_KEY", "test")
+os.environ.setdefault("AGENT_WARMUP", "0")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("COLUMN_STORE_PATH", tempfile.mkdtemp(prefix="test-columns-"))
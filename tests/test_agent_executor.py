@@ -0,0 +1,70 @@
+import time
+import threading
+from langchain.agents import create_tool_calling_agent
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.tools import tool
+from api.agent_executor import ParallelAgentExecutor
+from bench.fake_llm import FakeChatModel
+
+events = []
+_lock = threading.Lock()
+
+
+def _run(name: str) -> str:
+    with _lock:
+        events.append(('start', name))
+    time.sleep(0.05)
+    with _lock:
+        events.append(('end', name))
+    return name
+
+
+@tool
+def read_a(query: str) -> str:
+    """read a"""
+    return _run(f"read_a {query}")
+
+
+@tool
+def read_b(query: str) -> str:
+    """read b"""
+    return _run(f"read_b {query}")
+
+
+@tool
+def mutate(query: str) -> str:
+    """mutate"""
+    return _run(f"mutate {query}")
+
+
+def run_step(*tools):
+    """one agent step calling tools in this order, the observations in the order they came back"""
+    events.clear()
+    calls = [{'name': t.name, 'args': {'query': str(i)}, 'id': f"call_{i}", 'type': 'tool_call'} for i, t in enumerate(tools)]
+    llm = FakeChatModel(responses=[AIMessage(content="", tool_calls=calls), AIMessage(content="done")])
+    prompt = ChatPromptTemplate.from_messages([("human", "{input}"), ("placeholder", "{agent_scratchpad}")])
+    executor = ParallelAgentExecutor(
+        agent=create_tool_calling_agent(llm, [read_a, read_b, mutate], prompt),
+        tools=[read_a, read_b, mutate],
+        max_iterations=2,
+        sequential_tools={mutate.name},
+        return_intermediate_steps=True
+    )
+    result = executor.invoke({"input": "go"})
+    return [observation for _, observation in result['intermediate_steps']]
+
+
+def test_read_only_calls_overlap_and_keep_their_order():
+    assert run_step(read_a, read_b, read_a) == ["read_a 0", "read_b 1", "read_a 2"]
+    # every call started before the first one finished
+    assert [kind for kind, _ in events[:3]] == ['start'] * 3
+
+
+def test_step_with_a_mutation_runs_in_order_one_at_a_time():
+    assert run_step(read_a, mutate, read_b) == ["read_a 0", "mutate 1", "read_b 2"]
+    assert events == [
+        ('start', "read_a 0"), ('end', "read_a 0"),
+        ('start', "mutate 1"), ('end', "mutate 1"),
+        ('start', "read_b 2"), ('end', "read_b 2"),
+    ]
@@ -0,0 +1,23 @@
+from api.column_store import MailboxColumns
+
+
+def record(message_id: str, labels, sender: str = "a@example.com", date: int = 1000):
+    return {'id': message_id, 'labels': labels, 'sender': sender, 'internal_date': date, 'size_estimate': 10}
+
+
+def test_label_update_that_widens_the_bitset(tmp_path):
+    mailbox = MailboxColumns(str(tmp_path / "m"))
+    mailbox.upsert([record("1", ["INBOX"]), record("2", ["INBOX"])])
+    # INBOX and these fill the first 64 bit word, the removed label needs a second
+    extra = [f"L{i}" for i in range(63)]
+    mailbox.update_labels(["1"], add=extra, remove=["NEW_LABEL"])
+    assert mailbox.label_bits.width == 2
+    assert set(mailbox.row_labels(mailbox._rows(["1"])[0])) == {"INBOX", *extra}
+    assert mailbox.row_labels(mailbox._rows(["2"])[0]) == ["INBOX"]
+    # bits of row 1 must not have leaked into the new word
+    mailbox.update_labels(["2"], add=["LATE"])
+    assert "LATE" not in mailbox.row_labels(mailbox._rows(["1"])[0])
+
+
+def test_summary_of_an_empty_mailbox(tmp_path):
+    assert MailboxColumns(str(tmp_path / "m")).summary()['count'] == 0
@@ -0,0 +1,63 @@
+import pytest
+from api.gmail_query import And, Not, Or, Term, UnsupportedQuery, compile_query, parse
+from api.local_store import local_store
+from bench.fake_gmail import FakeGmailResource, FakeGmailService, default_labels, generate_mailbox
+
+
+def test_parse_groups_and_negation():
+    node = parse('from:Bob (is:unread OR is:starred) -in:trash subject:(cat dog)')
+    assert node == And([
+        Term('from', 'bob'),
+        Or([Term('is', 'unread'), Term('is', 'starred')]),
+        Not(Term('in', 'trash')),
+        And([Term('subject', 'cat'), Term('subject', 'dog')])
+    ])
+
+
+def test_parse_brace_group_is_or():
+    assert parse('{from:a from:b}') == Or([Term('from', 'a'), Term('from', 'b')])
+
+
+@pytest.mark.parametrize("query", [
+    "has:attachment",
+    "invoice",
+    "from:me",
+    "to:me",
+    "label:nonexistent",
+    "(is:unread",
+])
+def test_unsupported_locally(query):
+    with pytest.raises(UnsupportedQuery):
+        compile_query(query, {})
+
+
+def test_default_search_excludes_spam_and_trash():
+    _, params, _ = compile_query("is:unread", {})
+    assert params[-2:] == ['TRASH', 'SPAM']
+    _, params, _ = compile_query("in:trash", {})
+    assert params == ['TRASH']
+
+
+@pytest.fixture(scope="module")
+def synced():
+    """a fake mailbox synced into the local store, with the resource that serves it"""
+    resource = FakeGmailResource(generate_mailbox(120), default_labels())
+    service = FakeGmailService(resource, "query-round-trip")
+    assert service.sync_local_store() == 120
+    return resource, service.user_key
+
+
+@pytest.mark.parametrize("query", [
+    "from:alice",
+    "from:billing@shop.example",
+    "is:unread",
+    "is:read in:inbox",
+    "label:work -is:unread",
+    "category:promotions",
+    "subject:invoice",
+])
+def test_local_answers_match_gmail(synced, query):
+    resource, user = synced
+    expected = [m['id'] for m in resource._search(query, None, False)]
+    assert [m['id'] for m in local_store.query(user, query, limit=0)] == expected
+    assert expected
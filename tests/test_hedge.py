@@ -0,0 +1,43 @@
+import time
+import threading
+import pytest
+from api.hedge import Hedger
+
+
+def primed(delay: float = 0.01) -> Hedger:
+    """hedger that hedges after delay from the first call"""
+    hedger = Hedger(min_samples=1, min_delay=delay)
+    hedger._latencies.extend([delay] * 5)
+    return hedger
+
+
+def test_success_wins_when_both_finish_in_one_wait():
+    hedger = primed()
+
+    # which finished future a wait hands back first is arbitrary, try a few times
+    for _ in range(5):
+        release = threading.Event()
+        calls = []
+
+        def read():
+            calls.append(None)
+            first = len(calls) == 1
+            # both calls block until after the backup started, then finish together
+            release.wait(1)
+            if first:
+                raise RuntimeError("primary failed")
+            return "ok"
+
+        threading.Timer(0.1, release.set).start()
+        assert hedger.call(read) == "ok"
+
+
+def test_raises_when_every_call_fails():
+    hedger = primed()
+
+    def read():
+        time.sleep(0.05)
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError, match="down"):
+        hedger.call(read)
@@ -0,0 +1,81 @@
+import datetime
+import pytest
+from api.local_store import LocalStore, local_store
+from bench.fake_gmail import (FakeGmailResource, FakeGmailService, FakeHttpError, default_labels,
+                              generate_mailbox, make_message)
+
+
+def record(message_id, labels, internal_date=1000):
+    return {'id': message_id, 'thread_id': message_id, 'subject': 'hello', 'sender': 'bob@example.com',
+            'recipients': 'me@example.com', 'internal_date': internal_date, 'labels': labels}
+
+
+def new_mail(message_id):
+    date = datetime.datetime(2026, 10, 2, tzinfo=datetime.timezone.utc)
+    return make_message(message_id, 'carol@example.com', 'me@example.com', 'hello', 'hi', date, ['INBOX', 'UNREAD'])
+
+
+def test_apply_history_advances_coverage():
+    store = LocalStore()
+    store.upsert("u", record("m1", ['INBOX', 'UNREAD']))
+    store.upsert("u", record("m2", ['INBOX'], internal_date=2000))
+    store.set_coverage("u", 0, True, "10")
+
+    store.apply_history("u", [
+        # already reflected by the coverage
+        {'id': '9', 'messagesDeleted': [{'message': {'id': 'm2'}}]},
+        {'id': '11', 'labelsRemoved': [{'message': {'id': 'm1', 'labelIds': ['INBOX']}, 'labelIds': ['UNREAD']}]},
+    ], "11")
+
+    assert store.coverage("u")['history_id'] == "11"
+    assert store.query("u", "is:unread") == []
+    assert [m['id'] for m in store.query("u", "in:inbox")] == ["m2", "m1"]
+
+
+def test_apply_history_without_history_id_keeps_coverage():
+    store = LocalStore()
+    store.upsert("u", record("m1", ['INBOX']))
+    store.set_coverage("u", 0, True, "10")
+    store.apply_history("u", [{'id': '11', 'messagesDeleted': [{'message': {'id': 'm1'}}]}])
+    assert store.coverage("u")['history_id'] == "10"
+    assert store.query("u", "in:inbox") == []
+
+
+@pytest.fixture
+def synced(monkeypatch, request):
+    monkeypatch.setattr(local_store, 'sync_interval', 0)
+    resource = FakeGmailResource(generate_mailbox(30), default_labels())
+    user = f"local-store-{request.node.name}"
+    assert FakeGmailService(resource, user).sync_local_store() == 30
+    return resource, user
+
+
+def test_sync_history_stores_new_mail(synced):
+    resource, user = synced
+    resource.deliver(new_mail('new1'))
+
+    service = FakeGmailService(resource, user)
+    service.sync_history()
+
+    assert local_store.coverage(user)['history_id'] == str(resource.history_id)
+    assert 'new1' in [m['id'] for m in local_store.query(user, "is:unread")]
+
+
+def test_sync_history_drops_coverage_when_new_mail_cant_be_stored(synced):
+    resource, user = synced
+    record_call = resource.record_call
+
+    def failing(method):
+        record_call(method)
+        if method == 'batch:messages.get':
+            raise FakeHttpError(500)
+
+    resource.record_call = failing
+    resource.deliver(new_mail('new1'))
+    service = FakeGmailService(resource, user)
+    service.sync_history()
+    resource.record_call = record_call
+
+    # local answers would silently miss new1, so gmail has to answer
+    assert local_store.coverage(user) is None
+    assert 'new1' in [m['id'] for m in service.search_emails('is:unread', 100)]
@@ -0,0 +1,29 @@
+import pytest
+from api.model_router import ModelRouter
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(llm_factory=lambda model, callbacks=None: None)
+
+
+@pytest.mark.parametrize("question", [
+    "what labels do I have?",
+    "show my unread emails",
+    "find emails from alice@example.com",
+    "how many emails did I get this week?",
+    "call notes from yesterday",
+    "show all unread emails",
+])
+def test_read_only_questions_stay_on_the_fast_tier(router, question):
+    assert router.choose_tier(question) == "fast"
+
+
+@pytest.mark.parametrize("request_text", [
+    "delete the newsletter from bob",
+    "label these as work",
+    "archive all promotions",
+    "trash every email from news@deals.example",
+])
+def test_mutations_go_to_the_strong_tier(router, request_text):
+    assert router.choose_tier(request_text) == "strong"
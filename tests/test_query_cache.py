@@ -0,0 +1,83 @@
+from api.query_cache import QueryCache
+
+
+def refs(*ids):
+    return [{'id': i, 'threadId': i} for i in ids]
+
+
+def test_relative_date_queries_are_not_cached():
+    cache = QueryCache()
+    cache.put("u", "newer_than:2d", refs("m1"), True, "10")
+    cache.put("u", "from:bob Older_Than:1y", refs("m1"), True, "10")
+    cache.put("u", "from:bob", refs("m1"), True, "10")
+
+    assert cache.get("u", "newer_than:2d", 10) is None
+    assert cache.get("u", "from:bob older_than:1y", 10) is None
+    assert cache.version("u", "newer_than:2d", 10) is None
+    assert cache.get("u", "from:bob", 10) == refs("m1")
+
+
+def added(record_id, message_id, labels):
+    return {'id': record_id, 'messagesAdded': [{'message': {'id': message_id, 'threadId': message_id, 'labelIds': labels}}]}
+
+
+def relabelled(record_id, message_id, labels, changed, key='labelsRemoved'):
+    return {'id': record_id, key: [{'message': {'id': message_id, 'labelIds': labels}, 'labelIds': changed}]}
+
+
+def test_new_mail_goes_on_top_of_matching_label_queries():
+    cache = QueryCache()
+    cache.put("u", "is:unread", refs("m2", "m1"), True, "10")
+    cache.put("u", "in:inbox -is:unread", refs("m3"), True, "10")
+
+    cache.apply_history("u", [added("11", "m4", ['INBOX', 'UNREAD'])], "11")
+
+    assert cache.history_id("u") == "11"
+    assert [m['id'] for m in cache.get("u", "is:unread", 10)] == ["m4", "m2", "m1"]
+    assert [m['id'] for m in cache.get("u", "in:inbox -is:unread", 10)] == ["m3"]
+
+
+def test_new_mail_drops_queries_it_cant_place():
+    cache = QueryCache()
+    cache.put("u", "from:bob", refs("m1"), True, "10")
+    cache.apply_history("u", [added("11", "m2", ['INBOX'])], "11")
+    assert cache.get("u", "from:bob", 10) is None
+
+
+def test_deletions_and_label_removals_are_patched():
+    cache = QueryCache()
+    cache.put("u", "is:unread", refs("m3", "m2", "m1"), True, "10")
+    cache.put("u", "from:bob", refs("m3", "m2"), True, "10")
+
+    cache.apply_history("u", [
+        {'id': '11', 'messagesDeleted': [{'message': {'id': 'm3'}}]},
+        relabelled("12", "m2", ['INBOX'], ['UNREAD']),
+    ], "12")
+
+    assert [m['id'] for m in cache.get("u", "is:unread", 10)] == ["m1"]
+    # read state doesn't change who a message is from
+    assert [m['id'] for m in cache.get("u", "from:bob", 10)] == ["m2"]
+
+
+def test_trashing_leaves_default_searches_and_untrashing_drops_them():
+    cache = QueryCache()
+    cache.put("u", "from:bob", refs("m2", "m1"), True, "10")
+    cache.apply_history("u", [relabelled("11", "m2", ['TRASH'], ['TRASH'], 'labelsAdded')], "11")
+    assert [m['id'] for m in cache.get("u", "from:bob", 10)] == ["m1"]
+
+    cache.apply_history("u", [relabelled("12", "m2", ['INBOX'], ['TRASH'])], "12")
+    assert cache.get("u", "from:bob", 10) is None
+
+
+def test_older_message_joining_a_label_query_drops_it():
+    cache = QueryCache()
+    cache.put("u", "is:starred", refs("m2"), True, "10")
+    cache.apply_history("u", [relabelled("11", "m1", ['INBOX', 'STARRED'], ['STARRED'], 'labelsAdded')], "11")
+    assert cache.get("u", "is:starred", 10) is None
+
+
+def test_records_already_applied_are_skipped():
+    cache = QueryCache()
+    cache.put("u", "is:unread", refs("m1"), True, "10")
+    cache.apply_history("u", [added("9", "m0", ['UNREAD']), added("11", "m2", ['UNREAD'])], "11")
+    assert [m['id'] for m in cache.get("u", "is:unread", 10)] == ["m2", "m1"]